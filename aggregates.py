@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+# Incremental meta aggregates for the dashboard.
+#
+# Counters per commander for mana value, colour identity, artist, rarity, card name, lands,
+# mana rocks and decks are kept in the deck store and updated in the same transaction that
+# adds or removes a deck. A new deck therefore costs O(deck size) instead of a rebuild over
+# all decks, and the dashboard charts are built from the counters. Counters are sums, so
+# the counters of several deck stores (communities.py) merge by adding them up.
+#
+# The counters remember the card store and deck store versions they were counted at. A write
+# without the aggregates listening (python deck_store.py import, another process) leaves the
+# deck store version behind, and the counters are counted again the next time they are used.
+#
+# Usage:
+#   python aggregates.py check      # compare the counters with a full rebuild
+#   python aggregates.py rebuild
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+from analytics import build_local_deckdata, is_land, is_mana_rock, load_deckdata
+from card_store import color_mask_letters
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS aggregates (
+    kind TEXT NOT NULL,
+    commander TEXT NOT NULL,
+    key TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (kind, commander, key)
+);
+"""
+
+KINDS = ["cmc", "color_identity", "artist", "rarity", "card", "land", "rock", "deck"]
+
+# Bump when the meaning of the stored keys changes, so existing counters are rebuilt
+AGGREGATES_VERSION = 4
+
+
+# Count the selected rows per (commander, key) with a single bincount over combined codes
+def bincount_by_commander(commander_codes, commanders, values, selected):
+    key_codes, keys = pd.factorize(values[selected])
+    found = key_codes >= 0
+    if not found.any():
+        return pd.Series(dtype=np.int64, index=pd.MultiIndex.from_arrays([[], []]))
+
+    flat = commander_codes[selected][found] * len(keys) + key_codes[found]
+    counts = np.bincount(flat, minlength=len(commanders) * len(keys))
+    nonzero = np.flatnonzero(counts)
+
+    index = pd.MultiIndex.from_arrays([commanders[nonzero // len(keys)], np.asarray(keys[nonzero % len(keys)]).astype(str)])
+    return pd.Series(counts[nonzero], index=index)
+
+
+# Counters for a set of card rows (one row per card copy, with a commander column),
+# as a series indexed by (kind, commander, key)
+def count_aggregates(deckdata):
+    commander_codes, commanders = pd.factorize(deckdata["commander"])
+    commanders = np.asarray(commanders, dtype=object)
+
+    land = is_land(deckdata)
+    everything = np.ones(len(deckdata), dtype=bool)
+    no_key = np.zeros(len(deckdata), dtype=np.uint8)
+
+    columns = {
+        "cmc": (deckdata["cmc"].to_numpy(dtype=float), ~land),
+        "color_identity": (deckdata["color_mask"].to_numpy(), everything),
+        "artist": (deckdata["artist"].to_numpy(), ~land),
+        "rarity": (deckdata["rarity"].to_numpy(), everything),
+        "card": (deckdata["name"].to_numpy(), everything),
+        "land": (no_key, land),
+        "rock": (no_key, is_mana_rock(deckdata)),
+        "deck": (no_key, ~deckdata["deck_id"].duplicated().to_numpy()),
+    }
+
+    parts = {kind: bincount_by_commander(commander_codes, commanders, values, selected) for kind, (values, selected) in columns.items()}
+    counts = pd.concat(parts, names=["kind", "commander", "key"])
+
+    return counts.astype(np.int64)
+
+
+def stored_version(card_version):
+    return f"{AGGREGATES_VERSION}:{card_version}"
+
+
+# Card store and deck store versions the counters of a deck store were counted at (None if
+# never counted)
+def counted_versions(deck_store):
+    with deck_store.connect() as conn:
+        conn.executescript(SCHEMA)
+        rows = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('aggregates_card_version', 'aggregates_deck_version')").fetchall())
+    return rows.get("aggregates_card_version"), rows.get("aggregates_deck_version")
+
+
+# Whether the counters of a deck store are up to date with the card store and with its decks
+def counts_current(deck_store, card_version):
+    return counted_versions(deck_store) == (stored_version(card_version), deck_store.version())
+
+
+def apply_counts(conn, counts, sign):
+    conn.executemany(
+        """
+        INSERT INTO aggregates (kind, commander, key, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT(kind, commander, key) DO UPDATE SET count = count + excluded.count
+        """,
+        ((kind, commander, key, sign * int(count)) for (kind, commander, key), count in counts.items())
+    )
+    if sign < 0:
+        conn.execute("DELETE FROM aggregates WHERE count <= 0")
+
+
+# Counters of all decks in a deck store
+def full_counts(deck_store, card_index):
+    deckdata = load_deckdata(deck_store, card_index)
+    if deckdata.empty:
+        return pd.Series(dtype=np.int64, index=pd.MultiIndex.from_arrays([[], [], []], names=["kind", "commander", "key"]))
+    return count_aggregates(deckdata)
+
+
+# Recompute all counters of a deck store from its decks
+def rebuild_counts(deck_store, card_index, card_version):
+    # Read before counting: a deck added in the meantime makes the counters stale, never current
+    deck_version = deck_store.version()
+    counts = full_counts(deck_store, card_index)
+    with deck_store.connect() as conn:
+        with conn.transaction():
+            conn.execute("DELETE FROM aggregates")
+            apply_counts(conn, counts, 1)
+            conn.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                [("aggregates_card_version", stored_version(card_version)), ("aggregates_deck_version", deck_version)]
+            )
+
+
+# Count the counters of a deck store again when they aren't current (or when forced), without
+# listening to its writes. Returns whether they were counted.
+def refresh_counts(deck_store, card_index, card_version, force=False):
+    if force or not counts_current(deck_store, card_version):
+        rebuild_counts(deck_store, card_index, card_version)
+        return True
+    return False
+
+
+# The counters stored in a deck store as a (kind, commander, key, count) dataframe
+def stored_counts(deck_store, kind=None):
+    query = "SELECT kind, commander, key, count FROM aggregates"
+    params = ()
+    if kind is not None:
+        query += " WHERE kind = ?"
+        params = (kind,)
+
+    with deck_store.connect() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    return pd.DataFrame(rows, columns=["kind", "commander", "key", "count"])
+
+
+# The dashboard tables, built from (kind, commander, key, count) counters
+def aggregate_frames(counts):
+    by_kind = {kind: counts[counts["kind"] == kind] for kind in KINDS}
+
+    cmc = by_kind["cmc"]
+    long_manacurves = pd.DataFrame({
+        "Commander": cmc["commander"].to_numpy(),
+        "Mana value": cmc["key"].astype(float).to_numpy(),
+        "Count": cmc["count"].to_numpy(),
+    })
+
+    mana_totals = long_manacurves.groupby("Mana value")["Count"].sum()
+    row_count = max(long_manacurves["Commander"].nunique(), 1)
+    average_mana_curve = {key: float(mana_totals.get(float(key), 0)) / row_count for key in range(12 + 1)}
+
+    card_frequency = by_kind["card"].groupby("key")["count"].sum().sort_values(ascending=False).reset_index()
+    card_frequency.columns = ["name", "count"]
+
+    color_identity_hveen = by_kind["color_identity"].groupby("key")["count"].sum().sort_values(ascending=False).reset_index()
+    color_identity_hveen.columns = ["color_mask", "count"]
+    color_identity_hveen["color_mask"] = color_identity_hveen["color_mask"].astype(int)
+    color_identity_hveen["color_identity"] = color_identity_hveen["color_mask"].map(color_mask_letters)
+
+    artists_hveen = by_kind["artist"].groupby("key")["count"].sum().sort_values(ascending=False).reset_index()
+    artists_hveen.columns = ["artist", "count"]
+
+    rock_ratio = pd.DataFrame({
+        "Land Count": by_kind["land"].set_index("commander")["count"],
+        "Mana Rock Count": by_kind["rock"].set_index("commander")["count"],
+    }).fillna(0)
+    rock_ratio.index.name = "commander"
+    rock_ratio.reset_index(inplace=True)
+    rock_ratio["Ratio"] = rock_ratio["Land Count"] / rock_ratio["Mana Rock Count"]
+    rock_ratio.replace([np.inf, -np.inf], np.nan, inplace=True)
+    rock_ratio.fillna(0, inplace=True)
+
+    rarities_df = by_kind["rarity"].rename(columns={"key": "rarity", "count": "counts"})[["commander", "rarity", "counts"]]
+    rarities_df = rarities_df.sort_values(["commander", "rarity"]).reset_index(drop=True)
+
+    return {
+        "long_manacurves": long_manacurves,
+        "average_mana_curve": average_mana_curve,
+        "card_frequency": card_frequency,
+        "color_identity_hveen": color_identity_hveen,
+        "artists_hveen": artists_hveen,
+        "rock_ratio": rock_ratio,
+        "rarities_df": rarities_df,
+    }
+
+
+class MetaAggregates:
+    def __init__(self, deck_store, card_index, card_version):
+        self.deck_store = deck_store
+        self.card_index = card_index
+        self.card_version = card_version
+
+        # Card data (types, rarities, ...) can change with a new card store, so start over then
+        self.refresh()
+        deck_store.listeners.append(self)
+
+    # Counters of a list of (deck_id, commander, cards) decks, all counted at once
+    def deck_counts(self, decks):
+        decks = pd.DataFrame.from_records(decks, columns=["deck_id", "commander", "cards"])
+        return count_aggregates(build_local_deckdata(decks, self.card_index))
+
+    # The deck store bumps its version before calling the listeners. The counters move along
+    # with it only if they were current before this write, stale counters stay stale.
+    def apply(self, conn, counts, sign):
+        apply_counts(conn, counts, sign)
+        conn.execute(
+            """
+            UPDATE meta SET value = (SELECT value FROM meta WHERE key = 'version')
+            WHERE key = 'aggregates_deck_version' AND value = (SELECT value FROM meta WHERE key = 'version') - 1
+            """
+        )
+
+    # Called by the deck store inside the transaction that inserts or deletes the decks
+    def add_decks(self, conn, decks):
+        self.apply(conn, self.deck_counts(decks), 1)
+
+    def remove_deck(self, conn, deck_id, commander, cards):
+        self.apply(conn, self.deck_counts([(deck_id, commander, cards)]), -1)
+
+    def refresh(self, force=False):
+        return refresh_counts(self.deck_store, self.card_index, self.card_version, force)
+
+    # Recompute all counters from the decks in the store
+    def rebuild(self):
+        rebuild_counts(self.deck_store, self.card_index, self.card_version)
+
+    def full_counts(self):
+        return full_counts(self.deck_store, self.card_index)
+
+    def counts(self, kind=None):
+        return stored_counts(self.deck_store, kind)
+
+    # Differences between the stored counters and a full rebuild, empty when they agree
+    def check_consistency(self):
+        stored = self.counts().set_index(["kind", "commander", "key"])["count"]
+        rebuilt = self.full_counts()
+
+        both = pd.concat({"stored": stored, "rebuilt": rebuilt}, axis=1).fillna(0).astype(np.int64)
+        return both[both["stored"] != both["rebuilt"]]
+
+    # The dashboard tables, built from the counters (counted again first if they fell behind)
+    def frames(self):
+        self.refresh()
+        return aggregate_frames(self.counts())
+
+
+if __name__ == "__main__":
+    from card_store import open_card_store
+    from deck_store import open_deck_store
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    card_store = open_card_store()
+    aggregates = MetaAggregates(open_deck_store(), card_store.index, card_store.version)
+
+    if command == "check":
+        mismatches = aggregates.check_consistency()
+        print("Aggregates are consistent" if mismatches.empty else mismatches.to_string())
+        sys.exit(0 if mismatches.empty else 1)
+    elif command == "rebuild":
+        aggregates.rebuild()
+        print("Aggregates rebuilt")
+    else:
+        print("Usage: python aggregates.py [check | rebuild]")
+        sys.exit(1)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+# Analytics pipeline behind the dashboard.
+#
+# Everything in here is a plain function of its inputs (the deck store, the card store
+# and the EDHRec responses), so the app can cache the results across Streamlit reruns and
+# only recompute when one of those inputs changes.
+
+import re
+
+import pandas as pd
+import numpy as np
+
+from card_store import color_mask_letters
+from roles import has_role
+
+CARD_COLUMNS = ["name", "released_at", "mana_cost", "cmc", "type_line", "set_name", "rarity", "artist", "type_mask", "color_mask", "role_mask"]
+
+# Card columns of the per copy deck tables, only what the analyses use
+DECK_CARD_COLUMNS = ["name", "cmc", "type_line", "rarity", "artist", "type_mask", "color_mask", "role_mask"]
+
+
+def parse_cardlist(card_list):
+    parsed_cards = []
+    for card in card_list:
+        if re.match(r'\d+', card):
+            count, name = card.split(maxsplit=1)
+            parsed_cards.extend([name.strip()] * int(count))
+        else:
+            parsed_cards.append(card)
+    return parsed_cards
+
+
+def clean_card_names(card_list):
+    pattern = re.compile(r'^\d+\s+')
+
+    cleaned_list = [pattern.sub('', card) for card in card_list]
+    cleaned_list = [card for card in cleaned_list]
+
+    return cleaned_list
+
+
+# Stream the community decks from the deck store into a dataframe with one row per deck
+def load_decks(deck_store, commander=None, player=None):
+    decks = deck_store.iter_decks(commander=commander, player=player)
+
+    return pd.DataFrame.from_records(decks, columns=["deck_id", "player", "commander", "cards"])
+
+
+# Look up data on all cards in a deck, one row per distinct card
+def get_deckdata(card_index, cardslist):
+    return card_index.lookup_unique(cardslist)[CARD_COLUMNS]
+
+
+def is_land(deck_data):
+    return has_role(deck_data, "land")
+
+
+def is_mana_rock(deck_data):
+    return has_role(deck_data, "mana_rock")
+
+
+def create_manacurve(deck_data):
+    manacurve_commander = pd.Series(deck_data.groupby(["cmc"])["name"].count()).to_dict()
+
+    return manacurve_commander
+
+
+def commander_slug(commander):
+    return commander.replace(" ", "-").replace("'","").replace(",","").replace('"', "").lower()
+
+
+# Collects the EDHRec data per commander and materialises the tables once at the end,
+# instead of growing the dataframes one row (or one deck) at a time
+class EdhTableBuilder:
+    def __init__(self):
+        self.edh_records = []
+        self.average_decks = []
+        self.average_decks_noland = []
+
+    def add(self, commander, cardnames, average_deck_data):
+        average_deck_data = average_deck_data.assign(commander=commander)
+        average_deck_noland = average_deck_data[~is_land(average_deck_data)]
+
+        manacurve = create_manacurve(average_deck_noland)
+
+        self.edh_records.append([commander, cardnames, manacurve, average_deck_noland])
+        self.average_decks.append(average_deck_data)
+        self.average_decks_noland.append(average_deck_noland)
+
+    def build(self):
+        edh_df = pd.DataFrame(self.edh_records, columns=["commander", "cards", "manacurve", "average_deck_noland"])
+
+        columns = ["commander"] + CARD_COLUMNS
+        if not self.edh_records:
+            empty = pd.DataFrame(data=None, index=None, columns=columns)
+            return edh_df, empty, empty.copy()
+
+        edh_deckdata = pd.concat(self.average_decks)[columns]
+
+        average_df = pd.concat(self.average_decks_noland, ignore_index=True)[columns]
+        average_df = average_df.drop_duplicates(subset=["commander", "name"])
+
+        return edh_df, edh_deckdata, average_df
+
+
+# Build the EDHRec tables for every commander: the commander pages and the average decks.
+# get_edh and get_average_deck are passed in so the caller decides how requests are made.
+def build_edh_tables(commander_list, card_index, get_edh, get_average_deck):
+    builder = EdhTableBuilder()
+
+    for commander in commander_list:
+        commander_data = get_edh(commander)
+        cardnames = [card["name"] for card in commander_data["cardlist"]]
+
+        average_deck = get_average_deck(commander)
+        average_deck = average_deck["decklist"]
+        average_deck = clean_card_names(average_deck)
+        average_deck = parse_cardlist(average_deck)
+
+        builder.add(commander, cardnames, get_deckdata(card_index, average_deck))
+
+    return builder.build()
+
+
+# Names of the high synergy cards on an EDHRec commander page
+def high_synergy_cards(commander_page):
+    cardlists = commander_page.get("container", {}).get("json_dict", {}).get("cardlists", [])
+    for cardlist in cardlists:
+        if cardlist.get("tag") == "highsynergycards":
+            return [card["name"] for card in cardlist.get("cardviews", [])]
+    return []
+
+
+# High synergy cards per commander that are missing from its EDHRec average deck
+def build_synergy_gaps(high_synergy, average_df):
+    average_names = average_df.groupby("commander")["name"].agg(set).to_dict()
+    return {commander: [card for card in cards if card not in average_names.get(commander, set())] for commander, cards in high_synergy.items()}
+
+
+# The cards of decks as (deck_id, card_id, count) int32 triplets, card_id being the row of the
+# card in the card store. Cards that aren't in the card store are left out.
+def deck_card_triplets(deck_ids, names, counts, card_index):
+    card_ids = card_index.positions(names)
+    found = card_ids >= 0
+
+    return pd.DataFrame({
+        "deck_id": np.asarray(deck_ids, dtype=np.int32)[found],
+        "card_id": card_ids[found].astype(np.int32),
+        "count": np.asarray(counts, dtype=np.int32)[found],
+    })
+
+
+# Triplets of a dataframe with one row per deck and one card name per copy, copies of a
+# card in a deck are counted into one triplet
+def hveen_triplets(hveen, card_index):
+    lengths = np.fromiter((len(cards) for cards in hveen["cards"]), dtype=np.int64, count=len(hveen))
+    names = [name for cards in hveen["cards"] for name in cards]
+    deck_ids = np.repeat(hveen["deck_id"].to_numpy(), lengths)
+
+    triplets = deck_card_triplets(deck_ids, names, np.ones(len(names), dtype=np.int32), card_index)
+    triplets = triplets.groupby(["deck_id", "card_id"], sort=False)["count"].sum().reset_index()
+    return triplets.astype(np.int32)
+
+
+# One row per card copy with the deck id and commander and the card columns, taken from the
+# card store by card_id. Categorical card columns only copy their codes, and names and
+# commanders point to the same string objects, so a copy costs a few dozen bytes.
+def expand_deck_cards(decks, triplets, cards, columns=DECK_CARD_COLUMNS):
+    copies = np.repeat(np.arange(len(triplets)), triplets["count"].to_numpy())
+    deck_ids = triplets["deck_id"].to_numpy()[copies]
+    deck_rows = pd.Index(decks["deck_id"]).get_indexer(deck_ids)
+
+    deckdata = cards[columns].take(triplets["card_id"].to_numpy()[copies]).reset_index(drop=True)
+    deckdata.insert(0, "deck_id", deck_ids)
+    deckdata.insert(1, "commander", decks["commander"].to_numpy()[deck_rows])
+
+    return deckdata
+
+
+# Dataframe with one row per card copy in the community decks, joined with the card data
+def build_local_deckdata(hveen, card_index):
+    return expand_deck_cards(hveen, hveen_triplets(hveen, card_index), card_index.cards)
+
+
+# Same as build_local_deckdata(load_decks(...)), but the decks are read from the deck store
+# as counts and never expanded to a list of names per copy
+def load_deckdata(deck_store, card_index, commander=None):
+    decks, cards = deck_store.deck_cards(commander=commander)
+    decks = pd.DataFrame.from_records(decks, columns=["deck_id", "player", "commander"])
+    deck_ids, names, counts = zip(*cards) if cards else ((), (), ())
+
+    return expand_deck_cards(decks, deck_card_triplets(deck_ids, names, counts, card_index), card_index.cards)
+
+
+# Mana curve per commander in long format, plus the average curve over all decks
+def build_manacurves(hveen_deckdata):
+    hveen_deckdata_nolands = hveen_deckdata[~is_land(hveen_deckdata)]
+
+    by_commander = hveen_deckdata_nolands.groupby("commander")
+    manacurves = {}
+
+    for name, cmc in by_commander:
+        mana_curve = cmc["cmc"].value_counts().to_dict()
+        manacurves[name] = mana_curve
+
+    mana_totals = {key: 0 for key in range(12 + 1)}
+    row_count = 0
+
+    for mana_dict in manacurves.values():
+        row_count += 1
+        for key, value in mana_dict.items():
+            mana_totals[key] += value
+
+    flat_data = []
+    for commander, mana_curve in manacurves.items():
+        for mana_value, count in mana_curve.items():
+            flat_data.append({"Commander": commander, "Mana value": mana_value, "Count": count})
+
+    long_manacurves = pd.DataFrame(flat_data)
+
+    average_mana_curve = {key: value / row_count for key, value in mana_totals.items()}
+
+    return long_manacurves, average_mana_curve
+
+
+def build_card_frequency(hveen_deckdata):
+    card_frequency = hveen_deckdata["name"].value_counts().rename_axis("name").reset_index(name="count")
+
+    return card_frequency
+
+
+# Number of cards per colour identity, one row per WUBRG bitmask
+def build_color_identity(hveen_deckdata):
+    counts = np.bincount(hveen_deckdata["color_mask"].to_numpy(), minlength=32)
+    masks = np.flatnonzero(counts)
+
+    color_identity_hveen = pd.DataFrame({"color_mask": masks, "count": counts[masks]})
+    color_identity_hveen["color_identity"] = color_identity_hveen["color_mask"].map(color_mask_letters)
+
+    return color_identity_hveen.sort_values(by="count", ascending=False, kind="stable").reset_index(drop=True)
+
+
+# Number of nonland cards per artist
+def build_artists(hveen_deckdata):
+    artists_hveen = hveen_deckdata[~is_land(hveen_deckdata)]["artist"].value_counts().reset_index()
+    artists_hveen.columns = ["artist", "count"]
+
+    return artists_hveen.sort_values(by="count", ascending=False)
+
+
+# Land vs mana rock counts per commander
+def build_rock_ratio(hveen_deckdata):
+    land_cards = hveen_deckdata[is_land(hveen_deckdata)]
+    mana_rocks_cards = hveen_deckdata[is_mana_rock(hveen_deckdata)]
+
+    land_count = land_cards.groupby("commander").size()
+    mana_rocks_count = mana_rocks_cards.groupby("commander").size()
+
+    rock_ratio = pd.DataFrame({
+        "Land Count": land_count,
+        "Mana Rock Count": mana_rocks_count
+    })
+
+    rock_ratio = rock_ratio.fillna(0)
+
+    rock_ratio.reset_index(inplace=True)
+    rock_ratio["Ratio"] = rock_ratio["Land Count"] / rock_ratio["Mana Rock Count"]
+
+    rock_ratio.replace([np.inf, -np.inf], np.nan, inplace=True)
+    rock_ratio.fillna(0, inplace=True)
+
+    return rock_ratio
+
+
+def build_rarities(hveen_deckdata):
+    return hveen_deckdata.groupby(["commander", "rarity"], observed=True).size().reset_index(name="counts")
+
+
+# Run the whole local analysis for the community decks
+def build_local_analytics(hveen, card_index):
+    hveen_deckdata = build_local_deckdata(hveen, card_index)
+    long_manacurves, average_mana_curve = build_manacurves(hveen_deckdata)
+
+    return {
+        "hveen_deckdata": hveen_deckdata,
+        "long_manacurves": long_manacurves,
+        "average_mana_curve": average_mana_curve,
+        "card_frequency": build_card_frequency(hveen_deckdata),
+        "color_identity_hveen": build_color_identity(hveen_deckdata),
+        "artists_hveen": build_artists(hveen_deckdata),
+        "rock_ratio": build_rock_ratio(hveen_deckdata),
+        "rarities_df": build_rarities(hveen_deckdata),
+    }
@@ -1,17 +1,23 @@
 # -*- coding: utf-8 -*-
 
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
 import streamlit as st
-import json
-import streamlit.components.v1 as components
-import plotly.express as px
-import plotly.graph_objects as go
-from collections import Counter
-from pyedhrec import EDHRec
-import re
-import requests_cache
+import os
+import sqlite3
+from card_store import open_card_store
+from analytics import load_decks, load_deckdata, build_edh_tables
+from aggregates import MetaAggregates, aggregate_frames
+from communities import DEFAULT_COMMUNITY, community_counts, community_slug, community_summary, list_communities, merge_counts, open_community
+from edh_cache import EdhCache
+from edh_fetch import FetchError
+from figures import FigureCache, commander_figures, identity_chart, mana_curve_chart, opening_hand_chart, radar_chart, rarity_plot, rock_ratio_chart, similarity_heatmap
+from deck_import import DeckValidator, parse_text, store_deck
+from image_cache import ImageCache, card_image_urls, source_url
+from simulate import commander_cmc, deck_batch, deck_key, encode_deck, simulate_deck, simulate_decks
+from similarity import SimilarityIndex, collect_decks, deck_label
+from report import REPORT_DIR, read_manifest, read_report
+from snapshot import STATE_DIR, input_digest, read_snapshot, write_snapshot
+from instrumentation import count, finish_run, span, start_run, to_jsonl, with_recorder
 
 # Setting up config for streamlit application
 st.set_page_config(
@@ -21,9 +27,8 @@ st.set_page_config(
     initial_sidebar_state='collapsed'
 )
 
-session = requests_cache.CachedSession('edh_cache', expire_after="18000")
-
-edhrec = EDHRec()
+# Spans and counters of this run, shown in the "Performance" sidebar panel
+recorder = start_run()
 
 font_css = """
 <head>
@@ -34,512 +39,495 @@ st.markdown(font_css, unsafe_allow_html=True)
 
 st.title("Magic the Gathering Analysis")
 
-col1, col2, col3, col4 = st.columns(4, gap="medium")
-
-# Import Scryfall data and create a dataframe with only the relevant columns
-scryfall = pd.read_json("http://data.scryfall.io/oracle-cards/oracle-cards-20240505210241.json")
-scryfall = scryfall[["name", "released_at", "mana_cost", "cmc", "type_line", "color_identity", "set_name", "rarity", "artist", "image_uris"]]
-
-# Filter out irrelevant card types
-noncard_types = ["Plane", "Token", "Emblem", "Attraction", "Dungeon", "Stickers", "Contraption"]
-scryfall = scryfall[scryfall["type_line"].str.contains('|'.join(noncard_types)) == False]
-
-# Fetch the data of Heerenveen community decks from the json file and create a dataframe called hveen
-decks = pd.read_json("database_mtg.json")
-
-hveen = pd.DataFrame.from_records(decks)
-
-def parse_cardlist(card_list):
-    parsed_cards = []
-    for card in card_list:
-        if re.match(r'\d+', card):
-            count, name = card.split(maxsplit=1)
-            parsed_cards.extend([name.strip()] * int(count))
-        else:
-            parsed_cards.append(card)
-    return parsed_cards
-
-hveen["cards"] = hveen["cards"].apply(parse_cardlist)
-
-# Look up data on all cards in Heerenveen deck
-def get_deckdata(cardslist):
-    deck_data = scryfall[scryfall["name"].isin(cardslist)]
-    deck_data = deck_data[["name", "released_at", "mana_cost", "cmc", "type_line", "color_identity", "set_name", "rarity", "artist", "image_uris"]]
-
-    deck_data = deck_data[deck_data["type_line"].str.contains('|'.join(noncard_types)) == False]
-
-    return deck_data
-
-def create_manacurve(deck_data):
-    manacurve_commander = pd.Series(deck_data.groupby(["cmc"])["name"].count()).to_dict()
-
-    return manacurve_commander
-
-commander_list = hveen["commander"].tolist()
-
-def clean_card_names(card_list):
-    pattern = re.compile(r'^\d+\s+')
-
-    cleaned_list = [pattern.sub('', card) for card in card_list]
-    cleaned_list = [card for card in cleaned_list]
-
-    return cleaned_list
-
-# Initialize dataframe for data of EDHRec
-edh_df = pd.DataFrame(data=None, index=None, columns=["commander", "cards", "manacurve", "average_deck_noland"])
-edh_cards = pd.DataFrame(data=None, index=None, columns=["name", "released_at", "mana_cost", "cmc", "type_line", "color_identity", "set_name", "rarity", "artist", "image_uris"])
-edh_deckdata = pd.DataFrame(data=None, index=None, columns=["commander", "name", "released_at", "mana_cost", "cmc", "type_line", "color_identity", "set_name", "rarity", "artist", "image_uris"])
-average_df = pd.DataFrame(data=None, index=None, columns=["commander", "name", "released_at", "mana_cost", "cmc", "type_line", "color_identity", "set_name", "rarity", "artist", "image_uris"])
-
-# Function to request data for commanders in Heerenveen database from EDHRec
-def get_edh(commander):
-    commander_clean = commander.replace(" ", "-").replace("'","").replace(",","").lower()
-    response = session.get("https://json.edhrec.com/pages/commanders/"+commander_clean+".json")
-    return response.json()
-
-for commander in commander_list:
-    commander_data = get_edh(commander)
-    name = str(commander)
-    cardlist = commander_data["cardlist"]
-    cardlist_df = pd.DataFrame(cardlist)
-    cardnames = cardlist_df["name"].tolist()
-
-    deckdata = get_deckdata(cardnames)
-
-    average_deck = edhrec.get_commanders_average_deck(commander)
-    average_deck = average_deck["decklist"]
-    average_deck = clean_card_names(average_deck)
-    average_deck = parse_cardlist(average_deck)
-    average_deck_data = get_deckdata(average_deck)
-    average_deck_data["commander"] = commander
-    average_deck_noland = average_deck_data[~average_deck_data["type_line"].str.contains("Land", na=False, case=False)]
-    
-    manacurve = create_manacurve(average_deck_noland)
-    
-    # Write commander, card names, average decklist and manacurve to the EDHRec dataframe
-    edh_df.loc[len(edh_df)] = [commander, cardnames, manacurve, average_deck_noland]
-    
-    for index, row in average_deck_noland.iterrows():
-        average_df = pd.concat([average_df, average_deck_noland], ignore_index=True)
-        
-    average_df = average_df.drop_duplicates(subset=["commander", "name"])
-
-    edh_deckdata = pd.concat([edh_deckdata, average_deck_data])
-
-# Dataframe with all cards in Heerenveen decks
-cards_hveen = hveen.explode("cards").set_index("player")
-cards_hveen.rename(columns={"cards": "name"}, inplace=True)
-
-hveen_deckdata = get_deckdata(cards_hveen["name"]).reset_index()
-hveen_deckdata = pd.merge(cards_hveen, hveen_deckdata, on=["name"])
-hveen_deckdata.drop(columns=["index"], inplace=True)
-
-hveen_deckdata_nolands = hveen_deckdata[~hveen_deckdata["type_line"].str.contains("Land", case=False)]
-
-by_commander = hveen_deckdata_nolands.groupby("commander")
-manacurves = {}
-
-for name, cmc in by_commander:
-    mana_curve = cmc["cmc"].value_counts().to_dict()
-    manacurves[name] = mana_curve
-
-manacurves_df = pd.DataFrame(list(manacurves.items()), columns=['Commander', 'Mana Curve'])
-
-flat_df = pd.DataFrame(manacurves)
-
-mana_totals = {key: 0 for key in range(12 + 1)}
-row_count = 0
-
-for mana_dict in manacurves_df["Mana Curve"]:
-     row_count += 1
-     for key, value in mana_dict.items():
-        mana_totals[key] += value
-
-flat_data = []
-for commander, mana_curve in manacurves.items():
-    for mana_value, count in mana_curve.items():
-        flat_data.append({"Commander": commander, "Mana value": mana_value, "Count": count})
-
-long_manacurves = pd.DataFrame(flat_data)
-
-average_mana_curve = {key: value / row_count for key, value in mana_totals.items()}
-
-curve_x = list(average_mana_curve.keys())
-curve_y = list(average_mana_curve.values())
-
-# Card frequency analysis
-card_frequency = hveen_deckdata["name"].value_counts().reset_index()
-card_frequency = card_frequency.rename(columns={"count": "name", "name": "count"})
-
-# Color identity analysis
-color_identity_hveen = hveen_deckdata["color_identity"].loc[hveen_deckdata["name"].isin(["Land"]) == False].value_counts().reset_index()
-color_identity_hveen.columns = ["color_identity", "count"]
-
-color_identity_hveen = color_identity_hveen.sort_values(by="count", ascending=False)
-
-mana_unicode = {
-    'W': '\ue600',
-    'U': '\ue601',
-    'B': '\ue602',
-    'R': '\ue603',
-    'G': '\ue604',
-    '': '\ue904'
-}
-
-def convert_to_unicode(char_list):
-    return "".join(mana_unicode.get(char, "") for char in char_list)
-
-color_identity_hveen["color_unicode"] = color_identity_hveen["color_identity"].apply(convert_to_unicode)
-labels = color_identity_hveen["color_unicode"]
-values = color_identity_hveen["count"]
-
-common_props = dict(labels=labels, values=values)
-
-color_discrete_map={
-    '\ue600': "#fde7a2",  # White
-    '\ue601': "#85b7e5",  # Blue
-    '\ue602': "#7d76ab",  # Black
-    '\ue603': "#d28282",  # Red
-    '\ue604': "#a0c27c",  # Green
-    '\ue904': "#808080",  # Grey
-    '\ue600\ue601': "#add8e6",  # Light Blue
-    '\ue600\ue602': "#d3d3d3",  # Light Grey
-    '\ue600\ue603': "#ffcccc",  # Light Red
-    '\ue600\ue604': "#90ee90",  # Light Green
-    '\ue601\ue600': "#add8e6",  # Light Blue
-    '\ue601\ue602': "#666699",  # Dark Blue
-    '\ue601\ue603': "#800080",  # Purple
-    '\ue601\ue604': "#4682b4",  # Steel Blue
-    '\ue602\ue600': "#d3d3d3",  # Light Grey
-    '\ue602\ue601': "#666699",  # Dark Blue
-    '\ue602\ue603': "#808080",  # Grey
-    '\ue602\ue604': "#006400",  # Dark Green
-    '\ue603\ue600': "#ffcccc",  # Light Red
-    '\ue603\ue601': "#800080",  # Purple
-    '\ue603\ue602': "#808080",  # Grey
-    '\ue603\ue604': "#b22222",  # Firebrick
-    '\ue604\ue600': "#90ee90",  # Light Green
-    '\ue604\ue601': "#4682b4",  # Steel Blue
-    '\ue604\ue602': "#006400",  # Dark Green
-    '\ue604\ue603': "#b22222",  # Firebrick
-    '\ue600\ue601\ue602': "#778899",  # Light Slate Grey
-    '\ue600\ue601\ue603': "#db7093",  # Pale Violet Red
-    '\ue600\ue601\ue604': "#3cb371",  # Medium Sea Green
-    '\ue600\ue602\ue603': "#bc8f8f",  # Rosy Brown
-    '\ue600\ue602\ue604': "#32cd32",  # Lime Green
-    '\ue600\ue603\ue604': "#ff4500",  # Orange Red
-    '\ue601\ue602\ue600': "#778899",  # Light Slate Grey
-    '\ue601\ue602\ue603': "#663399",  # Rebecca Purple
-    '\ue601\ue602\ue604': "#8a2be2",  # Blue Violet
-    '\ue601\ue603\ue600': "#db7093",  # Pale Violet Red
-    '\ue601\ue603\ue602': "#663399",  # Rebecca Purple
-    '\ue601\ue603\ue604': "#c71585",  # Medium Violet Red
-    '\ue601\ue604\ue600': "#3cb371",  # Medium Sea Green
-    '\ue601\ue604\ue602': "#8a2be2",  # Blue Violet
-    '\ue601\ue604\ue603': "#c71585",  # Medium Violet Red
-    '\ue602\ue600\ue601': "#778899",  # Light Slate Grey
-    '\ue602\ue600\ue603': "#bc8f8f",  # Rosy Brown
-    '\ue602\ue600\ue604': "#32cd32",  # Lime Green
-    '\ue602\ue601\ue600': "#778899",  # Light Slate Grey
-    '\ue602\ue601\ue603': "#663399",  # Rebecca Purple
-    '\ue602\ue601\ue604': "#8a2be2",  # Blue Violet
-    '\ue602\ue603\ue600': "#bc8f8f",  # Rosy Brown
-    '\ue602\ue603\ue601': "#663399",  # Rebecca Purple
-    '\ue602\ue603\ue604': "#a52a2a",  # Brown
-    '\ue602\ue604\ue600': "#32cd32",  # Lime Green
-    '\ue602\ue604\ue601': "#8a2be2",  # Blue Violet
-    '\ue602\ue604\ue603': "#a52a2a",  # Brown
-    '\ue603\ue600\ue601': "#db7093",  # Pale Violet Red
-    '\ue603\ue600\ue602': "#bc8f8f",  # Rosy Brown
-    '\ue603\ue600\ue604': "#ff4500",  # Orange Red
-    '\ue603\ue601\ue600': "#db7093",  # Pale Violet Red
-    '\ue603\ue601\ue602': "#663399",  # Rebecca Purple
-    '\ue603\ue601\ue604': "#c71585",  # Medium Violet Red
-    '\ue603\ue602\ue600': "#bc8f8f",  # Rosy Brown
-    '\ue603\ue602\ue601': "#663399",  # Rebecca Purple
-    '\ue603\ue602\ue604': "#a52a2a",  # Brown
-    '\ue603\ue604\ue600': "#ff4500",  # Orange Red
-    '\ue603\ue604\ue601': "#c71585",  # Medium Violet Red
-    '\ue603\ue604\ue602': "#a52a2a",  # Brown
-    '\ue604\ue600\ue601': "#3cb371",  # Medium Sea Green
-    '\ue604\ue600\ue602': "#32cd32",  # Lime Green
-    '\ue604\ue600\ue603': "#ff4500",  # Orange Red
-    '\ue604\ue601\ue600': "#3cb371",  # Medium Sea Green
-    '\ue604\ue601\ue602': "#8a2be2",  # Blue Violet
-    '\ue604\ue601\ue603': "#c71585",  # Medium Violet Red
-    '\ue604\ue602\ue600': "#32cd32",  # Lime Green
-    '\ue604\ue602\ue601': "#8a2be2",  # Blue Violet
-    '\ue604\ue602\ue603': "#a52a2a",  # Brown
-    '\ue604\ue603\ue600': "#ff4500",  # Orange Red
-    '\ue604\ue603\ue601': "#c71585",  # Medium Violet Red
-    '\ue604\ue603\ue602': "#a52a2a"  # Brown
-}
-
-# Set default color for colorless cards and unknown combinations of colors
-default_color = "#999999"
-
-for label in labels: 
-    if label not in color_discrete_map:
-        color_discrete_map[label] = default_color
-
-# Pie chart displaying color identity distribution in all cards used in Heerenveen decks
-identity_chart = px.pie(color_identity_hveen, names=labels, values=values, hole=.3, color_discrete_sequence=[color_discrete_map[key] for key in labels], hover_name=labels, custom_data=["color_identity"])
-# Setting fonts of chart labels and percentage correctly (for mana symbol font)
-identity_chart.update_traces(
-    textposition="inside", 
-    textinfo="label+percent", 
-    # insidetextfont=dict(color="white"),
-    texttemplate="<span style='font-family:Mana'>%{label}</span><br><span style='font-family:Courier New'>%{percent}</span>",
-    hovertemplate="<b style='font-family:Mana'>%{label}:</b> %{value} cards<extra></extra>"
-)
-
-identity_chart.update_layout(
-  margin=dict(l=20, r=20, b=0, t=20),
-  showlegend=False,
-  font_size=18,
-  title={
-    "text":"",
-    "xanchor": "left",
-    "x":0    
-  },
-  font_family="Source Sans Pro"
-)
+# Call a cached loader inside a span, the loaders count their own cache misses
+def call_cached(name, loader, *args):
+    count(f"st_cache.{name}.calls")
+    with span(name):
+        return loader(*args)
+
+# Every community has a deck store of its own (communities.py), the dashboard shows one of them.
+# New communities (python communities.py import ...) show up within a minute.
+@st.cache_data(show_spinner=False, ttl=60)
+def load_community_list():
+    count("st_cache.load_community_list.misses")
+    return list_communities()
+
+community_names = call_cached("load_community_list", load_community_list)
+community = st.selectbox("Community:", community_names) if len(community_names) > 1 else DEFAULT_COMMUNITY
+
+# The commander columns are a fragment (split in two inside it), selecting a commander only reruns those
+col1, col2, commander_col = st.columns([1, 1, 2], gap="medium")
+
+# Open the local Scryfall snapshot (run "python card_store.py refresh" to pick up a new bulk file)
+@st.cache_resource
+def load_card_store():
+    count("st_cache.load_card_store.misses")
+    return open_card_store()
+
+card_store = call_cached("load_card_store", load_card_store)
+
+# Fetch the decks of the community from its deck store (the default community imports
+# database_mtg.json on first start). Everything below is cached per community and version of
+# the deck store and the card store, so widget interactions only re-render the charts.
+@st.cache_resource
+def load_deck_store(community):
+    count("st_cache.load_deck_store.misses")
+    return open_community(community)
+
+deck_store = call_cached("load_deck_store", load_deck_store, community)
+
+# All EDHRec data goes through the EDHRec cache (edh_cache.py): stale entries are served at once
+# and refreshed in the background, a refresh bumps the generation and so rebuilds the tables
+@st.cache_resource
+def load_edh_cache():
+    count("st_cache.load_edh_cache.misses")
+    return EdhCache()
+
+edh_cache = call_cached("load_edh_cache", load_edh_cache)
+
+# What the dashboard state is computed from. After a restart the state is loaded from the
+# snapshot of the same inputs (snapshot.py) when there is one, instead of computing it again.
+def dashboard_inputs():
+    manifest = read_manifest(REPORT_DIR)
+    return {
+        "community": community,
+        "card_version": card_store.version,
+        "deck_store_id": deck_store.store_id,
+        "deck_version": deck_store.version(),
+        "edh": edh_cache.fingerprint(),
+        "report": manifest["built_at"] if manifest is not None else None,
+    }
 
-# Artist analysis
-land_types_pattern = '|'.join([re.escape(land_type) for land_type in "Land"])
-artists_hveen = hveen_deckdata[~hveen_deckdata["type_line"].str.contains(land_types_pattern, na=False, case=False)]["artist"].value_counts().reset_index()
-artists_hveen.columns = ["artist", "count"]
-artists_hveen = artists_hveen.sort_values(by="count", ascending=False)
-
-# Card type analysis
-types = ["Artifact", "Instant", "Sorcery", "Creature", "Enchantment"]
-all_types_global = average_df["type_line"].str.split("—| ")
-
-def flatten_types(types_list):
-  flattened_types = [word for sublist in types_list for word in sublist]
-  flattened_types = [word for word in flattened_types if word in types]
-  
-  return flattened_types
-
-def radar_chart(commander):
-  commander_avg_deck = average_df[average_df["commander"] == commander]
-  avg_commander_types = commander_avg_deck["type_line"].str.split("—| ")
-  flattened_avg_commander_types = flatten_types(avg_commander_types)
-  avg_commander_type_count = Counter(flattened_avg_commander_types)
-  
-  commander_types = hveen_deckdata[hveen_deckdata["commander"] == commander]["type_line"].str.split("—| ")
-  flattened_commander_types = flatten_types(commander_types)
-
-  avg_card_types = pd.DataFrame(avg_commander_type_count.items(), columns=["type", "type_count"]).sort_values("type", ascending=False)
-
-  type_counts = Counter(flattened_commander_types)
-
-  card_types = pd.DataFrame(type_counts.items(), columns=["type", "type_count"]).sort_values("type", ascending=False)
-  card_types_chart = go.Figure()
-
-  card_types_chart.add_trace(go.Scatterpolar(
-      r=card_types["type_count"],
-      theta=card_types["type"],
-      fill="toself",
-      fillcolor=px.colors.qualitative.Plotly[0],
-      marker_color=px.colors.qualitative.Plotly[0],
-      opacity=0.8,
-      name=commander
-  ))
-
-  card_types_chart.add_trace(go.Scatterpolar(
-      r=avg_card_types["type_count"],
-      theta=avg_card_types["type"],
-      line=dict(         
-          dash="dot"
-      ),
-      marker_color=px.colors.qualitative.Plotly[1],
-      opacity=0.8,
-      name="Average deck"
-  ))
-
-  card_types_chart.update_layout(
-      polar=dict(
-          radialaxis=dict(
-              visible=True
-          )
-      ),
-      showlegend=True,
-      title="",
-      margin_t=10,
-      margin_l=50,
-      margin_b=0,
-      height=400
-      )
-
-  return card_types_chart
-
-# Land vs mana rock analysis
-land_cards = hveen_deckdata[hveen_deckdata["type_line"].str.contains("Land", case=False, na=False)]
-mana_rocks = ["Abzan Banner", "Alloy Myr", "Arcane Signet", "Arcum's Astrolabe", "Astral Cornucopia", "Atarka Monument", "Azorius Cluestone", "Azorius Keyrune", "Azorius Locket", "Azorius Signet", "Basalt Monolith", "Black Mana Battery", "Bloodstone Cameo", "Blue Mana Battery", "Boros Cluestone", "Boros Keyrune", "Boros Locket", "Boros Signet", "Caged Sun", "Celestial Prism", "Charcoal Diamond", "Chromatic Lantern", "Chrome Mox", "Coalition Relic", "Coldsteel Heart", "Copper Myr", "Cryptolith Fragment", "Cultivator's Caravan", "Darksteel Ingot", "Dimir Cluestone", "Dimir Keyrune", "Dimir Locket", "Dimir Signet", "Doubling Cube", "Drake-Skull Cameo", "Dreamstone Hedron", "Dromoka Monument", "Everflowing Chalice", "Eye of Ramos", "Fellwar Stone", "Fieldmist Borderpost", "Fire Diamond", "Firewild Borderpost", "Fountain of Ichor", "Gemstone Array", "Gilded Lotus", "Gold Myr", "Golgari Cluestone", "Golgari Keyrune", "Golgari Locket", "Golgari Signet", "Green Mana Battery", "Grim Monolith", "Gruul Cluestone", "Gruul Keyrune", "Gruul Locket", "Gruul Signet", "Heart of Ramos", "Hedron Archive", "Hierophant's Chalice", "Honor-Worn Shaku", "Horn of Ramos", "Iron Myr", "Izzet Cluestone", "Izzet Keyrune", "Izzet Locket", "Izzet Signet", "Jeskai Banner", "Kolaghan Monument", "Leaden Myr", "Lion's Eye Diamond", "Lotus Bloom", "Lotus Petal", "Mana Crypt", "Mana Cylix", "Mana Geode", "Mana Prism", "Mana Vault", "Manalith", "Marble Diamond", "Mardu Banner", "Mind Stone", "Mistvein Borderpost", "Moss Diamond", "Mox Amber", "Mox Diamond", "Mox Emerald", "Mox Jet", "Mox Opal", "Mox Pearl", "Mox Ruby", "Mox Sapphire", "Mox Tantalite", "Myr Reservoir", "Obelisk of Bant", "Obelisk of Esper", "Obelisk of Grixis", "Obelisk of Jund", "Obelisk of Naya", "Ojutai Monument", "Opaline Unicorn", "Orzhov Cluestone", "Orzhov Keyrune", "Orzhov Locket", "Orzhov Signet", "Palladium Myr", "Pentad Prism", "Phyrexian Lens", "Pillar of Origins", "Powerstone Shard", "Prismatic Geoscope", "Prismatic Lens", "Pristine Talisman", "Prophetic Prism", "Rakdos Cluestone", "Rakdos Keyrune", "Rakdos Locket", "Rakdos Signet", "Red Mana Battery", "Seashell Cameo", "Selesnya Cluestone", "Selesnya Keyrune", "Selesnya Locket", "Selesnya Signet", "Serum Powder", "Silumgar Monument", "Silver Myr", "Simic Cluestone", "Simic Keyrune", "Simic Locket", "Simic Signet", "Sisay's Ring", "Skull of Ramos", "Sky Diamond", "Sol Grail", "Sol Ring", "Spectral Searchlight", "Spinning Wheel", "Springleaf Drum", "Star Compass", "Sultai Banner", "Talisman of Conviction", "Talisman of Creativity", "Talisman of Curiosity", "Talisman of Dominance", "Talisman of Hierarchy", "Talisman of Impulse", "Talisman of Indulgence", "Talisman of Resilience", "Temur Banner", "Thought Vessel", "Thran Dynamo", "Tigereye Cameo", "Tooth of Ramos", "Troll-Horn Cameo", "Unstable Obelisk", "Ur-Golem's Eye", "Veinfire Borderpost", "Vessel of Endless Rest", "White Mana Battery", "Wildfield Borderpost", "Worn Powerstone"]
-
-mana_rocks_cards = hveen_deckdata[hveen_deckdata["name"].isin(mana_rocks)]
-
-land_count = land_cards.groupby("commander").size()
-mana_rocks_count = mana_rocks_cards.groupby("commander").size()
-
-rock_ratio = pd.DataFrame({
-    "Commander": commander,
-    "Land Count": land_count,
-    "Mana Rock Count": mana_rocks_count
-})
-
-rock_ratio = rock_ratio.fillna(0)
-
-rock_ratio.reset_index(inplace=True)
-rock_ratio["Ratio"] = rock_ratio["Land Count"] / rock_ratio["Mana Rock Count"]
-
-rock_ratio.replace([np.inf, -np.inf], np.nan, inplace=True)
-rock_ratio.fillna(0, inplace=True)
-
-rock_ratio_chart = px.bar(rock_ratio, x="commander", y=["Land Count", "Mana Rock Count"], title=None, color_discrete_sequence=px.colors.qualitative.Plotly).update_layout(
-    xaxis_title="Deck", yaxis_title="Number of cards", showlegend=False
-)
-rock_ratio_chart["data"][0].hovertemplate = "Land Count: %{y}<extra></extra>"
-rock_ratio_chart["data"][1].hovertemplate = "Mana Rock Count: %{y}<extra></extra>"
-
-# Analysis of ratity per deck
-rarities_df = hveen_deckdata.groupby(["commander", "rarity"]).size().reset_index(name="counts")
-
-rarity_plot = px.scatter(rarities_df, x='rarity', y='counts', 
-                         color='commander',
-                         title=None, height=600)
-
-rarity_plot.update_layout(
-    xaxis=dict(
-        tickmode="array",
-        tickvals=[0,1,2,3,4],
-        ticktext=["common", "uncommon", "rare", "mythic", "special"]
-    ),
-    showlegend=False
-)
+state_inputs = dashboard_inputs()
+state_digest = input_digest(state_inputs)
+state_dir = os.path.join(STATE_DIR, community_slug(community))
+
+# Figures are memoised as Plotly JSON per (commander, data version) in an LRU (figures.py). After
+# the first load the figures of every commander are built in the background, once per data version.
+@st.cache_resource
+def load_figure_cache():
+    count("st_cache.load_figure_cache.misses")
+    return FigureCache()
+
+figure_cache = call_cached("load_figure_cache", load_figure_cache)
+
+@st.cache_resource(max_entries=1)
+def load_state(state_digest):
+    count("st_cache.load_state.misses")
+    state = read_snapshot(state_inputs, state_dir)
+    if state is not None:
+        count("state_snapshot.hits")
+        card_store.restore(state["cards"], state["card_index"])
+        figure_cache.seed(state_digest, state["figures"])
+    return state
+
+state = call_cached("load_state", load_state, state_digest)
+card_index = card_store.index
+
+# The meta aggregates are kept up to date by the deck store on every submitted deck
+@st.cache_resource
+def load_aggregates(community, card_version):
+    count("st_cache.load_aggregates.misses")
+    return MetaAggregates(deck_store, card_index, card_version)
+
+aggregates = call_cached("load_aggregates", load_aggregates, community, card_store.version)
+
+@st.cache_data(show_spinner=False)
+def load_commander_list(community, deck_version):
+    count("st_cache.load_commander_list.misses")
+    return deck_store.commanders()
+
+@st.cache_data(show_spinner=False)
+def load_player_count(community, deck_version):
+    count("st_cache.load_player_count.misses")
+    return deck_store.player_count()
+
+# Cards of the decks of one commander, looked up through the commander index of the deck store
+@st.cache_data(show_spinner=False, max_entries=64)
+def load_commander_deckdata(commander, community, deck_version, card_version):
+    count("st_cache.load_commander_deckdata.misses")
+    return load_deckdata(deck_store, card_index, commander=commander)
+
+# Request the pages and average decks of all commanders of the community from EDHRec at once.
+# Tables with a failed request (not a 404) aren't kept, the next run requests those commanders again.
+@st.cache_data(show_spinner=False)
+def load_edh_tables(commanders, card_version, edh_generation):
+    count("st_cache.load_edh_tables.misses")
+    edh_data, failures = edh_cache.fetch_commanders(commanders)
+    fetched = [commander for commander in commanders if commander in edh_data]
+    tables = build_edh_tables(fetched, card_index, lambda commander: edh_data[commander]["page"], lambda commander: edh_data[commander]["average_deck"])
+
+    return tables, failures
+
+# EDHRec tables of commanders, the cached ones are dropped after a failed request (not a 404)
+def fetch_edh_tables(commanders):
+    edh_args = (tuple(commanders), card_store.version, edh_cache.generation)
+    tables, failures = call_cached("load_edh_tables", load_edh_tables, *edh_args)
+    if any(not edh_cache.not_found(commander) for commander in failures):
+        load_edh_tables.clear(*edh_args)
+    return tables, failures
+
+# Card images are served from the local image cache (image_cache.py), resized to the display width.
+# The images of every card in the deck database are prefetched in the background once per deck version.
+@st.cache_resource
+def load_image_cache():
+    count("st_cache.load_image_cache.misses")
+    return ImageCache()
+
+@st.cache_resource(max_entries=1)
+def prefetch_images(community, deck_version):
+    count("st_cache.prefetch_images.misses")
+    return image_cache.prefetch_async(card_image_urls(card_store, [name for _, name, _ in deck_store.deck_cards()[1]]))
+
+# Opening hand simulation, cached per deck hash so an unchanged deck is never simulated twice
+@st.cache_data(show_spinner=False, max_entries=256)
+def load_simulation(key, _codes, cmc):
+    count("st_cache.load_simulation.misses")
+    return simulate_deck(_codes, cmc)
+
+@st.cache_data(show_spinner=False)
+def load_meta(community, deck_version, card_version):
+    count("st_cache.load_meta.misses")
+    return aggregates.frames()
+
+# A batch report (python mtg_meta.py build) of the community built from the same card store replaces
+# the EDHRec requests, and the meta tables too while it is the same deck store at the version it was built from
+@st.cache_data(show_spinner=False, max_entries=1)
+def load_report(built_at):
+    count("st_cache.load_report.misses")
+    return read_report(REPORT_DIR)
+
+deck_version = state_inputs["deck_version"]
+
+image_cache = call_cached("load_image_cache", load_image_cache)
+call_cached("prefetch_images", prefetch_images, community, deck_version)
+
+# Similarity index over the community decks and the EDHRec average decks, rebuilt when a deck is added
+@st.cache_resource(max_entries=1)
+def load_similarity(community, deck_version, card_version):
+    count("st_cache.load_similarity.misses")
+    return SimilarityIndex(collect_decks(load_decks(deck_store), edh_deckdata, card_index))
+
+if state is not None:
+    commander_list = state["commander_list"]
+    edh_deckdata, average_df, edh_failures = state["edh_deckdata"], state["average_df"], state["edh_failures"]
+    high_synergy = state["high_synergy"]
+    similarity_index = state["similarity_index"]
+    meta = state["meta"]
+else:
+    commander_list = call_cached("load_commander_list", load_commander_list, community, deck_version)
+
+    report_manifest = read_manifest(REPORT_DIR)
+    report_tables = None
+    if report_manifest is not None and (report_manifest.get("community") or DEFAULT_COMMUNITY) == community and report_manifest["card_version"] == card_store.version:
+        report_tables, report_manifest = call_cached("load_report", load_report, report_manifest["built_at"])
+
+    high_synergy = {}
+    if report_tables is not None and set(commander_list) <= set(report_manifest["commanders"]):
+        edh_deckdata, average_df = report_tables["edh_deckdata"], report_tables["average_df"]
+        edh_failures = {}
+        high_synergy = report_manifest["high_synergy"]
+        # Commanders EDHRec failed for while the report was built come from the EDHRec store, it can have them by now
+        report_failures = [commander for commander in commander_list if commander in report_manifest["edh_failures"]]
+        if report_failures:
+            (_, failed_deckdata, failed_average_df), edh_failures = fetch_edh_tables(report_failures)
+            edh_deckdata = pd.concat([edh_deckdata, failed_deckdata], ignore_index=True)
+            average_df = pd.concat([average_df, failed_average_df], ignore_index=True)
+    else:
+        (_, edh_deckdata, average_df), edh_failures = fetch_edh_tables(commander_list)
 
-rarity_plot.update_traces(
-    marker=dict(size=10)
-)
+    similarity_index = call_cached("load_similarity", load_similarity, community, deck_version, card_store.version)
 
-with col1:
-    st.write("<h2 style='font-size:20px'>Our local MTG EDH meta</h3><p>Using decklists from 10 EDH players from my local MTG community, I wanted to explore our local meta. A meta can be broken up into many aspects. For this dashboard I focused on <span style='color:#636EFA'>color identity, land/mana rock ratio, rarity, card types and high synergy cards.</span><br/>So, are we creative deck builders, or do we simply follow global trends? Judge for yourself! :)</p>", unsafe_allow_html=True)
+    if report_tables is not None and report_manifest.get("deck_store_id") == deck_store.store_id and report_manifest["deck_version"] == deck_version:
+        meta = dict(report_tables, average_mana_curve=report_manifest["average_mana_curve"])
+    else:
+        meta = call_cached("load_meta", load_meta, community, deck_version, card_store.version)
+
+# A commander that EDHRec doesn't know (or that keeps failing) is left out of the comparison
+if edh_failures:
+    with col1, span("render.col1"):
+        st.warning("No EDHRec data for " + ", ".join(edh_failures))
+
+long_manacurves = meta["long_manacurves"]
+average_mana_curve = meta["average_mana_curve"]
+card_frequency = meta["card_frequency"]
+color_identity_hveen = meta["color_identity_hveen"]
+artists_hveen = meta["artists_hveen"]
+rock_ratio = meta["rock_ratio"]
+rarities_df = meta["rarities_df"]
+
+# The builders of the figures of every commander, on the background thread. The latest deck of
+# every commander is simulated there too (simulations not in the state snapshot yet).
+def commander_builders(simulations):
+    deckdata = load_deckdata(deck_store, card_index)
+    latest_decks = deckdata[deckdata["deck_id"] == deckdata.groupby("commander", observed=True)["deck_id"].transform("max")]
+    batch = deck_batch(latest_decks, card_index)
+    simulations.update(simulate_decks({key: deck for key, deck in batch.items() if key not in simulations}))
+    return commander_figures(meta, deckdata, average_df, simulations, similarity_index)
+
+# Returns the prebuild and the simulations it fills in
+@st.cache_resource(max_entries=1)
+def prebuild_figures(figure_version):
+    count("st_cache.prebuild_figures.misses")
+    simulations = dict(state["simulations"]) if state is not None else {}
+    return figure_cache.prebuild_async(figure_version, commander_list, lambda: commander_builders(simulations)), simulations
+
+# The data version of the figures is the hash of the inputs of the state
+figure_version = state_digest
+
+with span("figures.global"):
+    identity_figure = figure_cache.figure("identity", None, figure_version, lambda: identity_chart(color_identity_hveen))
+    rock_ratio_figure = figure_cache.figure("rock_ratio", None, figure_version, lambda: rock_ratio_chart(rock_ratio))
+    rarity_figure = figure_cache.figure("rarity", None, figure_version, lambda: rarity_plot(rarities_df))
+
+player_count = call_cached("load_player_count", load_player_count, community, deck_version)
+
+# Open deck stores of all communities, to read their versions on every run
+@st.cache_resource
+def load_community_stores(community_names):
+    count("st_cache.load_community_stores.misses")
+    return {name: open_community(name) for name in community_names}
+
+# The communities are compared through the counters stored in their deck stores, and added up
+# for all communities together, so no deck is read again
+@st.cache_data(show_spinner=False, max_entries=1)
+def load_community_meta(community_versions, card_version):
+    count("st_cache.load_community_meta.misses")
+    counts = community_counts(community_stores, card_store)
+    merged = merge_counts(counts.values())
+    return community_summary(dict(counts, **{"All communities": merged})), aggregate_frames(merged)
+
+if len(community_names) > 1:
+    community_stores = call_cached("load_community_stores", load_community_stores, tuple(community_names))
+    community_versions = tuple((name, store.version()) for name, store in community_stores.items())
+    community_table, all_meta = call_cached("load_community_meta", load_community_meta, community_versions, card_store.version)
+    with span("figures.communities"):
+        all_identity_figure = figure_cache.figure("identity", "All communities", (community_versions, card_store.version), lambda: identity_chart(all_meta["color_identity_hveen"]))
+
+with col1, span("render.col1"):
+    st.write(f"<h2 style='font-size:20px'>Our local MTG EDH meta</h3><p>Using decklists from {player_count} EDH players from the {community} MTG community, I wanted to explore our local meta. A meta can be broken up into many aspects. For this dashboard I focused on <span style='color:#636EFA'>color identity, land/mana rock ratio, rarity, card types and high synergy cards.</span><br/>So, are we creative deck builders, or do we simply follow global trends? Judge for yourself! :)</p>", unsafe_allow_html=True)
     st.divider()
     st.write("<h2 style='font-size:20px'>Color identities of cards across all decks</h3>", unsafe_allow_html=True)
-    st.plotly_chart(identity_chart, theme=None, use_container_width=True)
+    st.plotly_chart(identity_figure, theme=None, use_container_width=True)
     st.divider()
 
-with col2:
+    if len(community_names) > 1:
+        st.write("<h2 style='font-size:20px'>How do the communities compare?</h2>", unsafe_allow_html=True)
+        st.dataframe(community_table.round(2), hide_index=True, use_container_width=True)
+        st.write("<h2 style='font-size:20px'>Color identities of cards across all communities</h2>", unsafe_allow_html=True)
+        st.plotly_chart(all_identity_figure, theme=None, use_container_width=True)
+        st.divider()
+
+with col2, span("render.col2"):
     st.write("<h2 style='font-size:20px'>Ratio of Lands to Mana Rocks for our local decks</h2>", unsafe_allow_html=True)
-    st.plotly_chart(rock_ratio_chart, use_container_width=True)
+    st.plotly_chart(rock_ratio_figure, use_container_width=True)
     st.divider()
 
     st.write("<h2 style='font-size:20px'>How rare are the cards in our decks?</h2>", unsafe_allow_html=True)
-    st.plotly_chart(rarity_plot, use_container_width=True)
+    st.plotly_chart(rarity_figure, use_container_width=True)
+
+def render_commander_columns():
+    col3, col4 = st.columns(2, gap="medium")
+
+    with col3, span("render.col3"):
+        choose_commander = st.selectbox("Select your commander:", commander_list)
+        st.write("<h2 style='font-size:20px'>Card types for ", choose_commander, "</h2>", unsafe_allow_html=True)
+        commander_deck = call_cached("load_commander_deckdata", load_commander_deckdata, choose_commander, community, deck_version, card_store.version)
+        card_types_chart = figure_cache.figure("radar", choose_commander, figure_version, lambda: radar_chart(choose_commander, commander_deck, average_df[average_df["commander"] == choose_commander]))
+        st.plotly_chart(card_types_chart, use_container_width=True)
+        st.divider()
+
+        st.write("<h2 style='font-size:20px'>Starting hand for your commander</h2>", unsafe_allow_html=True)
+        random_hand = commander_deck.sample(n=7)
+        random_hand = random_hand["name"].tolist()
+        hand_rows = card_index.positions(random_hand)
+        image_urls = [source_url(uris) for uris in card_store.image_uris(hand_rows[hand_rows >= 0])]
+        with span("image_cache.images"):
+            hand_images = image_cache.images([url for url in image_urls if url])
+
+        st.image(hand_images, width=130)
+
+        # Simulate the most recently submitted deck of this commander
+        latest_deck = commander_deck[commander_deck["deck_id"] == commander_deck["deck_id"].max()]
+        latest_key = deck_key(latest_deck)
+        if state is not None and latest_key in state["simulations"]:
+            simulation = state["simulations"][latest_key]
+        else:
+            simulation = call_cached("load_simulation", load_simulation, latest_key, encode_deck(latest_deck), commander_cmc(card_index, choose_commander))
+        if simulation is not None:
+            opening_hand_figure = figure_cache.figure("opening_hand", choose_commander, figure_version, lambda: opening_hand_chart(simulation))
+            st.plotly_chart(opening_hand_figure, use_container_width=True)
 
-with col3:
-    choose_commander = st.selectbox("Select your commander:", commander_list)
-    st.write("<h2 style='font-size:20px'>Card types for ", choose_commander, "</h2>", unsafe_allow_html=True)
-    card_types_chart = radar_chart(choose_commander)
-    st.plotly_chart(card_types_chart, use_container_width=True)
-    st.divider()
+            if simulation["on_curve"] is not None:
+                st.write(f"Chance to cast {choose_commander} on turn {simulation['commander_cmc']}: {simulation['on_curve']:.0%}")
+            keep_rates = ", ".join(f"{7 - mulligans} cards: {rate:.0%}" for mulligans, rate in enumerate(simulation["keep"][:-1]))
+            st.write(f"Keeping a hand with 2 to 5 lands with {keep_rates}")
 
-    st.write("<h2 style='font-size:20px'>Starting hand for your commander</h2>", unsafe_allow_html=True)
-    commander_deck = hveen_deckdata.loc[hveen_deckdata["commander"] == choose_commander]
-    random_hand = commander_deck.sample(n=7)
-    random_hand = random_hand["name"].tolist()
-    image_uris_list = []
-    for card_name in random_hand:
-        card_row = scryfall[scryfall['name'] == card_name]
-        normal_uri = card_row.iloc[0]['image_uris'].get('normal') if 'normal' in card_row.iloc[0]['image_uris'] else None
-    
-        if normal_uri:
-            image_uris_list.append(normal_uri)
-    
-    st.image(image_uris_list, width=130)
-    
-
-with col4:
-    st.write("<h2 style='font-size:20px'>Mana curve of ", choose_commander," vs. average manacurve</h2>", unsafe_allow_html=True)
-    manacurve_graph = px.histogram(long_manacurves[long_manacurves["Commander"] == choose_commander], x="Mana value", y="Count", color="Commander", color_discrete_sequence=px.colors.qualitative.Plotly).update_layout(
-        showlegend=False,
-        xaxis=dict(
-            tickmode = "array",
-            tickvals = [i + 0.5 for i in range(0, 12)],
-            ticktext = [str(i) for i in range(0, 12)],
-            dtick = 1
-        ),
-        bargap=0.1
-    )
-    manacurve_graph.update_traces(
-        xbins=dict(
-            start=0,
-            end=12,
-            size=1
-        )
-    )
-
-    curve_x_centered = [x + 0.5 for x in curve_x]
-                     
-    manacurve_graph.add_trace(go.Scatter(x=curve_x_centered, y=curve_y, mode="lines", name="Average Mana Curve", line=dict(color="cornsilk")))
-    st.plotly_chart(manacurve_graph, use_container_width=True)
-    st.divider()
 
-    high_synergy_cards = edhrec.get_high_synergy_cards(choose_commander)
-    high_synergy_cards_list = [card["name"] for card in high_synergy_cards["High Synergy Cards"]]
+    with col4, span("render.col4"):
+        st.write("<h2 style='font-size:20px'>Mana curve of ", choose_commander," vs. average manacurve</h2>", unsafe_allow_html=True)
+        manacurve_graph = figure_cache.figure("mana_curve", choose_commander, figure_version, lambda: mana_curve_chart(choose_commander, long_manacurves, average_mana_curve))
+        st.plotly_chart(manacurve_graph, use_container_width=True)
+        st.divider()
 
-    commander_df = average_df[average_df["commander"] == choose_commander].reset_index(drop=True)
+        if choose_commander in high_synergy:
+            high_synergy_cards_list = high_synergy[choose_commander]
+        else:
+            # Read from the cached commander page, so changing the commander doesn't wait for EDHRec
+            try:
+                high_synergy_cards_list = edh_cache.high_synergy_cards(choose_commander)
+            except FetchError:
+                high_synergy_cards_list = []
 
-    card_names_set = set(commander_df["name"])
+        commander_df = average_df[average_df["commander"] == choose_commander].reset_index(drop=True)
 
-    cards_not_in_df = [card for card in high_synergy_cards_list if card not in card_names_set]
+        card_names_set = set(commander_df["name"])
 
-    st.write("<h2 style='font-size:20px'>High Synergy Suggestions</h2>", unsafe_allow_html=True)
-    if not cards_not_in_df:
-        st.write("Your deck already has all the high synergy cards recommended for ", choose_commander)
-    else:
-        st.write("Your deck might benefit from these high synergy cards:<br/>", ", ".join(cards_not_in_df), unsafe_allow_html=True)
-    
-user_decklist_dict = {
-        "player": "",
-        "commander": "",
-        "cards": ""
+        cards_not_in_df = [card for card in high_synergy_cards_list if card not in card_names_set]
+
+        st.write("<h2 style='font-size:20px'>High Synergy Suggestions</h2>", unsafe_allow_html=True)
+        if not cards_not_in_df:
+            st.write("Your deck already has all the high synergy cards recommended for ", choose_commander)
+        else:
+            st.write("Your deck might benefit from these high synergy cards:<br/>", ", ".join(cards_not_in_df), unsafe_allow_html=True)
+        st.divider()
+
+        st.write("<h2 style='font-size:20px'>Decks most similar to ", choose_commander, "</h2>", unsafe_allow_html=True)
+        latest_label = deck_label(choose_commander, latest_deck["deck_id"].max())
+        similarity_figure = figure_cache.figure("similarity", choose_commander, figure_version, lambda: similarity_heatmap(similarity_index, latest_label))
+        st.plotly_chart(similarity_figure, use_container_width=True)
+
+        unique_cards = similarity_index.unique_cards(choose_commander, k=10)
+        if not unique_cards.empty:
+            st.write("Cards our ", choose_commander, " decks play that the EDHRec average deck doesn't:<br/>", ", ".join(unique_cards["name"]), unsafe_allow_html=True)
+
+        local_vs_global = similarity_index.local_vs_global()
+        if not local_vs_global.empty:
+            st.write(f"Average overlap (Jaccard) of our decks with the EDHRec average deck of their commander: {local_vs_global['similarity'].mean():.0%}")
+
+# Selecting a commander reruns only the fragment, the run of the whole script is finished by
+# then: a rerun of the fragment on its own records a run of its own
+@st.fragment
+def commander_columns():
+    if not recorder.finished:
+        render_commander_columns()
+        return
+
+    fragment_recorder = start_run()
+    try:
+        with span("fragment.commander_columns"):
+            render_commander_columns()
+    finally:
+        finish_run(fragment_recorder)
+
+with commander_col:
+    commander_columns()
+
+call_cached("prebuild_figures", prebuild_figures, figure_version)
+
+# Snapshot the state for the next start (snapshot.py) once the figures of every commander are
+# built: queued behind the prebuild on the background thread of the figure cache. The high
+# synergy cards of every commander are added there.
+@st.cache_resource(max_entries=1)
+def save_state(state_digest):
+    count("st_cache.save_state.misses")
+    inputs, directory = state_inputs, state_dir
+    _, simulations = prebuild_figures(state_digest)
+    saved = {
+        "commander_list": commander_list,
+        "edh_deckdata": edh_deckdata,
+        "average_df": average_df,
+        "edh_failures": edh_failures,
+        "high_synergy": dict(high_synergy),
+        "similarity_index": similarity_index,
+        "meta": meta,
     }
 
-def append_deck_to_json(file_path, new_deck):
-    if new_deck["player"] and new_deck["commander"] and new_deck["cards"]:
+    def save():
+        # The inputs changed in the meantime (a deck was added, EDHRec entries were fetched),
+        # a run with the new inputs saves its own state
+        if input_digest(dashboard_inputs()) != state_digest:
+            return None
+
+        saved["simulations"] = simulations
+        for commander in saved["commander_list"]:
+            if commander not in saved["high_synergy"]:
+                try:
+                    saved["high_synergy"][commander] = edh_cache.high_synergy_cards(commander)
+                except FetchError:
+                    pass
+        saved["figures"] = figure_cache.export(state_digest)
+        saved["cards"], saved["card_index"] = card_store.frame, card_index
+
+        with span("state_snapshot.write"):
+            return write_snapshot(saved, inputs, directory)
+
+    return figure_cache.background.submit(with_recorder(save))
+
+if state is None:
+    call_cached("save_state", save_state, state_digest)
+
+# A decklist from the sidebar goes through the same parser and checks as a bulk import (deck_import.py)
+@st.cache_resource
+def load_deck_validator(card_version):
+    count("st_cache.load_deck_validator.misses")
+    return DeckValidator(card_store)
+
+def add_deck_to_store(new_deck):
+    if new_deck["player"] and new_deck["commander"] and new_deck["card_counts"]:
+        deck_validator = call_cached("load_deck_validator", load_deck_validator, card_store.version)
+        deck, problems = deck_validator.validate(new_deck)
+        if problems:
+            st.write("The decklist was not added:<br/>" + "<br/>".join(problems), unsafe_allow_html=True)
+            return False
+
         try:
-            with open(file_path, "r") as file:
-                data = json.load(file)
-            
-            data.append(new_deck)
-
-            with open(file_path, "w") as file:
-                json.dump(data, file, indent=4)
-        except json.JSONDecodeError as e:
+            deck_store.add_decks([store_deck(deck)])
+
+            # Drop the cached analytics of the old deck database, the next run rebuilds them
+            load_commander_list.clear()
+            load_meta.clear()
+            load_commander_deckdata.clear()
+            return True
+        except sqlite3.Error as e:
             st.write(f"An error occured: {e}")
-    
+
     else:
-        st.write("The text input fields are empty, please add a commander and decklist first")
+        st.write("The text input fields are empty, please add your name, a commander and decklist first")
+
+    return False
 
 st.session_state["data_appended"] = False
 
 with st.sidebar:
     user_decklist = st.text_area(label="Add your own decklist", value="")
     user_commander = st.text_input(label="Your commander:", value="")
-    user_ID = 7
+    user_name = st.text_input(label="Your name:", value="")
 
-    user_decklist = list(user_decklist.replace('1 ', '').replace('\n', ',').split(','))
-    user_decklist_dict["player"] = user_ID
-    user_decklist_dict["commander"] = user_commander
-    user_decklist_dict["cards"] = user_decklist
-    json_file_path = "database_mtg.json"
+    # One card per line, "3 Forest" for more copies; MTGO and Arena exports can be pasted as they are
+    user_deck = parse_text(user_decklist.splitlines(), source="sidebar", player=user_name.strip(), commander=user_commander.strip() or None)
 
     if st.button("Submit Decklist"):
         if not st.session_state["data_appended"]:
-            append_deck_to_json(json_file_path, user_decklist_dict)
-            st.session_state["data_appended"] = True
-            st.write("Decklist succesfully added!")
+            if add_deck_to_store(user_deck):
+                st.session_state["data_appended"] = True
+                st.write("Decklist succesfully added!")
         else:
             st.write("Decklist has already been added.")
+
+# Timings and counters of this run (instrumentation.py), exportable as JSON lines
+run_snapshot = finish_run(recorder)
+if run_snapshot is not None:
+    with st.sidebar.expander("Performance"):
+        spans_df = pd.DataFrame(run_snapshot["spans"], columns=["name", "depth", "start", "seconds"])
+        spans_df["stage"] = ["\u00a0\u00a0" * depth + name for name, depth in zip(spans_df["name"], spans_df["depth"])]
+        spans_df["ms"] = (spans_df["seconds"] * 1000).round(1)
+        st.dataframe(spans_df[["stage", "ms"]], hide_index=True, use_container_width=True)
+
+        counters_df = pd.DataFrame(sorted(run_snapshot["counters"].items()), columns=["counter", "value"])
+        st.dataframe(counters_df, hide_index=True, use_container_width=True)
+
+        if run_snapshot["profile"]:
+            st.code(run_snapshot["profile"], language=None)
+
+        st.download_button("Download as JSON lines", to_jsonl(run_snapshot), file_name=f"performance-{run_snapshot['run_id']}.jsonl", mime="application/x-ndjson")
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark for building the EDHRec tables.
+#
+# Times EdhTableBuilder and CardIndex against the previous row-by-row implementation with
+# full-scan lookups on synthetic commanders. The check that both give the same tables is
+# tests/test_edh_tables.py, whose synthetic data and legacy implementation are used here.
+#
+# Usage (from the repository root):
+#   python benchmarks/edh_tables.py [commanders ...]
+
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tests"))
+
+from analytics import build_edh_tables
+from card_index import CardIndex
+from test_edh_tables import assert_same_tables, legacy_tables, synthetic_cards, synthetic_edhrec
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    sizes = [int(size) for size in sys.argv[1:]] or [10, 50, 100, 150]
+    rng = np.random.default_rng(0)
+    scryfall = synthetic_cards(30000, rng)
+    card_index = CardIndex(scryfall)
+
+    print(f"{'commanders':>10} {'legacy (s)':>12} {'builder (s)':>12} {'speedup':>8}")
+    for size in sizes:
+        pages, average_decks = synthetic_edhrec(size, scryfall, rng)
+        commanders = list(pages)
+        with warnings.catch_warnings():
+            # The legacy code concatenates onto empty frames, which pandas warns about
+            warnings.simplefilter("ignore")
+            legacy, legacy_time = timed(legacy_tables, commanders, scryfall, pages.get, average_decks.get)
+        built, builder_time = timed(build_edh_tables, commanders, card_index, pages.get, average_decks.get)
+        assert_same_tables(legacy, built)
+        print(f"{size:>10} {legacy_time:>12.3f} {builder_time:>12.3f} {legacy_time / builder_time:>7.1f}x")
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+# Stage-by-stage benchmark of the dashboard pipeline on synthetic community databases.
+#
+# Every stage is timed and its peak traced memory (tracemalloc, so NumPy and pandas buffers
+# count too) is recorded, as well as the memory its result keeps alive. EDHRec is served by edh_stub_server with responses generated for
+# the synthetic commanders. Results are written as JSON, and two result files can be compared
+# to spot regressions between commits.
+#
+# Usage (from the repository root):
+#   python benchmarks/pipeline.py run [decks ...] [--no-memory]   # default 10 1000 10000
+#   python benchmarks/pipeline.py compare old.json new.json
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aggregates import count_aggregates
+from analytics import build_edh_tables, build_local_deckdata, build_manacurves, build_rock_ratio, commander_slug, get_deckdata, load_deckdata, load_decks, parse_cardlist
+from card_store import open_card_store
+from deck_store import DeckStore
+from edh_cache import EdhCache
+from edh_stub_server import start_server
+from figures import radar_chart
+from similarity import SimilarityIndex, collect_decks
+from synthetic_decks import DeckGenerator, database_path, write_database
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+SIZES = [10, 1000, 10000]
+
+# Number of commanders the radar chart is drawn for, the stage reports the time per chart
+RADAR_CHARTS = 20
+
+# A stage that got this much slower is reported as a regression by compare
+REGRESSION = 1.2
+
+
+class Stages:
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.results = []
+
+    def run(self, decks, name, function, *args, calls=1):
+        if self.memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = (time.perf_counter() - start) / calls
+        peak, retained = None, None
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            peak, retained = peak / 2 ** 20, (current - before) / 2 ** 20
+
+        self.results.append({"decks": decks, "stage": name, "seconds": seconds, "peak_mb": peak, "retained_mb": retained})
+        print(f"{decks:>8} {name:<18} {seconds:>10.4f}s" + (f" {peak:>10.1f} MB {retained:>10.1f} MB" if peak is not None else ""))
+        return result
+
+
+def load(path):
+    with open(path, "r") as file:
+        return pd.DataFrame(json.load(file), columns=["player", "commander", "cards"])
+
+
+def parse(raw):
+    hveen = raw.copy()
+    hveen.insert(0, "deck_id", np.arange(1, len(hveen) + 1))
+    hveen["cards"] = [parse_cardlist(cards) for cards in hveen["cards"]]
+    return hveen
+
+
+def import_decks(raw, path):
+    deck_store = DeckStore(path)
+    deck_store.add_decks(raw.to_dict("records"))
+    return deck_store
+
+
+# What the app does when a commander is selected: its decks from the deck store, the card
+# join and the radar chart against the EDHRec average deck
+def radar_charts(deck_store, card_index, average_df, commanders):
+    for commander in commanders:
+        deck_data = load_deckdata(deck_store, card_index, commander=commander)
+        radar_chart(commander, deck_data, average_df[average_df["commander"] == commander])
+
+
+# Every commander requested from the stub server through an empty EDHRec store
+def edh_tables(commanders, card_index, base_url, store_path):
+    edh_data, failures = EdhCache(store_path, offline=False, base_url=base_url, rate=10000, legacy_cache=None).fetch_commanders(commanders)
+    fetched = [commander for commander in commanders if commander in edh_data]
+    return build_edh_tables(fetched, card_index, lambda commander: edh_data[commander]["page"], lambda commander: edh_data[commander]["average_deck"])
+
+
+def benchmark(size, cards, card_index, stages, work_dir):
+    path = database_path(size)
+    generator = DeckGenerator(cards, seed=size)
+    if not os.path.exists(path):
+        write_database(generator, size)
+
+    raw = stages.run(size, "load", load, path)
+    hveen = stages.run(size, "parse", parse, raw)
+    deck_store = stages.run(size, "deck_store_import", import_decks, raw, os.path.join(work_dir, f"decks_{size}.sqlite"))
+    stages.run(size, "deck_store_load", load_decks, deck_store)
+
+    stages.run(size, "get_deckdata", get_deckdata, card_index, hveen["cards"].explode().dropna())
+    hveen_deckdata = stages.run(size, "hveen_deckdata", build_local_deckdata, hveen, card_index)
+    stages.run(size, "manacurves", build_manacurves, hveen_deckdata)
+    stages.run(size, "aggregates", count_aggregates, hveen_deckdata)
+    stages.run(size, "rock_ratio", build_rock_ratio, hveen_deckdata)
+
+    commanders = list(dict.fromkeys(raw["commander"]))
+    server, base_url = start_server(generator.fixtures(commanders, commander_slug))
+    try:
+        _, edh_deckdata, average_df = stages.run(size, "edh_tables", edh_tables, commanders, card_index, base_url, os.path.join(work_dir, f"edh_store_{size}.sqlite"))
+    finally:
+        server.shutdown()
+
+    radar_commanders = commanders[:RADAR_CHARTS]
+    stages.run(size, "radar_chart", radar_charts, deck_store, card_index, average_df, radar_commanders, calls=len(radar_commanders))
+    stages.run(size, "similarity", lambda: SimilarityIndex(collect_decks(hveen, edh_deckdata, card_index)))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    card_store = open_card_store()
+    stages = Stages(memory=not args.no_memory)
+    if stages.memory:
+        tracemalloc.start()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in args.sizes or SIZES:
+            benchmark(size, card_store.frame, card_store.index, stages, work_dir)
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "card_version": card_store.version,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "memory": stages.memory,
+        "results": stages.results,
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'unknown'}.json")
+    with open(path, "w") as file:
+        json.dump(results, file, indent=1)
+    print(f"Results written to {path}")
+
+
+def compare(args):
+    frames = []
+    for path in [args.old, args.new]:
+        with open(path, "r") as file:
+            frames.append(pd.DataFrame(json.load(file)["results"]).set_index(["decks", "stage"])["seconds"])
+
+    both = pd.concat({"old": frames[0], "new": frames[1]}, axis=1).dropna()
+    both["ratio"] = both["new"] / both["old"]
+    print(both.to_string(float_format=lambda value: f"{value:.4f}"))
+
+    regressions = both[both["ratio"] > REGRESSION]
+    if not regressions.empty:
+        print(f"\n{len(regressions)} stages got more than {REGRESSION:.1f}x slower")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard pipeline on synthetic decks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("sizes", nargs="*", type=int)
+    run_parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, which slows allocation heavy stages down")
+    run_parser.set_defaults(function=run)
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.set_defaults(function=compare)
+
+    args = parser.parse_args()
+    args.function(args)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# Reproducible synthetic community databases for the pipeline benchmark.
+#
+# Decks are drawn from the local card store: a legendary creature as commander, only cards
+# within its colour identity, 33-38 lands of which the basics are written as "N Forest" count
+# lines, and the other cards sampled with a long-tailed popularity so decks overlap like real
+# ones do. The same seed always gives the same databases.
+#
+# Usage (from the repository root):
+#   python benchmarks/synthetic_decks.py [decks ...]     # writes benchmarks/data/decks_<n>.json
+
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import is_land
+from card_store import COLOR_BITS, TYPE_BITS, open_card_store
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+SIZES = [10, 1000, 10000, 100000]
+
+DECK_SIZE = 99
+LAND_RANGE = (33, 38)
+NONBASIC_RANGE = (5, 15)
+BASIC_LANDS = {"W": "Plains", "U": "Island", "B": "Swamp", "R": "Mountain", "G": "Forest", "C": "Wastes"}
+
+# Share of single cards that are written as "1 Cardname" instead of just the name
+COUNT_LINE_SHARE = 0.3
+
+
+class DeckGenerator:
+    def __init__(self, cards, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.names = cards["name"].to_numpy(dtype=object)
+        self.color_masks = cards["color_mask"].to_numpy().astype(np.int64)
+
+        type_masks = cards["type_mask"].to_numpy()
+        legendary = cards["type_line"].str.contains("Legendary", na=False).to_numpy()
+        creature = (type_masks & TYPE_BITS["Creature"]) != 0
+        basic = np.isin(self.names, list(BASIC_LANDS.values()))
+        land = is_land(cards)
+
+        self.commanders = np.flatnonzero(legendary & creature)
+        if len(self.commanders) == 0:
+            self.commanders = np.flatnonzero(creature)
+
+        # Long-tailed popularity: a few staples, many cards that hardly anyone plays
+        ranks = self.rng.permutation(len(cards))
+        popularity = 1.0 / (ranks + 10.0) ** 0.8
+        commander_popularity = popularity[self.commanders]
+        self.commander_cdf = np.cumsum(commander_popularity) / commander_popularity.sum()
+
+        # Cumulative popularity of the cards that fit in each of the 32 colour identities
+        self.pools = {}
+        for mask in range(32):
+            fits = (self.color_masks & ~mask) == 0
+            self.pools[mask] = {
+                "spells": self.pool(np.flatnonzero(fits & ~land), popularity),
+                "lands": self.pool(np.flatnonzero(fits & land & ~basic), popularity),
+            }
+
+    @staticmethod
+    def pool(rows, popularity):
+        weights = popularity[rows]
+        return rows, np.cumsum(weights) / weights.sum() if len(rows) else weights
+
+    # Distinct rows of a pool by popularity, without building a weight vector per deck
+    def sample(self, pool, count, exclude):
+        rows, cdf = pool
+        count = min(count, len(rows) - 1)
+        chosen = []
+        seen = set(exclude)
+        while len(chosen) < count:
+            for row in rows[np.searchsorted(cdf, self.rng.random(2 * (count - len(chosen))), side="right").clip(max=len(rows) - 1)]:
+                if row not in seen and len(chosen) < count:
+                    seen.add(row)
+                    chosen.append(row)
+        return chosen
+
+    def commander(self):
+        return self.commanders[min(np.searchsorted(self.commander_cdf, self.rng.random(), side="right"), len(self.commanders) - 1)]
+
+    # Card lines of one deck for a commander row
+    def deck(self, commander):
+        mask = int(self.color_masks[commander])
+        pools = self.pools[mask]
+
+        lands = int(self.rng.integers(LAND_RANGE[0], LAND_RANGE[1] + 1))
+        nonbasic = self.sample(pools["lands"], int(self.rng.integers(NONBASIC_RANGE[0], NONBASIC_RANGE[1] + 1)), [commander])
+        spells = self.sample(pools["spells"], DECK_SIZE - lands, [commander])
+
+        lines = [f"1 {self.names[row]}" if self.rng.random() < COUNT_LINE_SHARE else self.names[row] for row in nonbasic + spells]
+
+        colors = [color for color, bit in COLOR_BITS.items() if mask & bit] or ["C"]
+        basics = DECK_SIZE - len(lines)
+        for color, count in zip(colors, np.diff(np.linspace(0, basics, len(colors) + 1).round().astype(int))):
+            if count:
+                lines.append(f"{count} {BASIC_LANDS[color]}")
+
+        return lines
+
+    # Decks in the format of database_mtg.json
+    def decks(self, count):
+        players = max(1, count // 3)
+        decks = []
+        for _ in range(count):
+            commander = self.commander()
+            decks.append({"player": int(self.rng.integers(1, players + 1)), "commander": self.names[commander], "cards": self.deck(commander)})
+        return decks
+
+    # EDHRec responses for the commanders, keyed by URL path like edh_stub_server.load_fixtures
+    def fixtures(self, commanders, slug):
+        rows = {name: row for row, name in zip(self.commanders, self.names[self.commanders])}
+        fixtures = {}
+        for commander in commanders:
+            average_deck = self.deck(rows[commander])
+            cardviews = [{"name": line.split(" ", 1)[1] if line[0].isdigit() else line} for line in average_deck]
+            page = {
+                "cardlist": cardviews,
+                "container": {"json_dict": {"cardlists": [{"tag": "highsynergycards", "header": "High Synergy Cards", "cardviews": cardviews[:10]}]}},
+            }
+            fixtures[f"/pages/commanders/{slug(commander)}.json"] = (200, json.dumps(page).encode())
+            fixtures[f"/pages/average-decks/{slug(commander)}.json"] = (200, json.dumps({"deck": average_deck}).encode())
+        return fixtures
+
+
+def database_path(count, data_dir=DATA_DIR):
+    return os.path.join(data_dir, f"decks_{count}.json")
+
+
+def write_database(generator, count, data_dir=DATA_DIR):
+    os.makedirs(data_dir, exist_ok=True)
+    path = database_path(count, data_dir)
+    with open(path, "w") as file:
+        json.dump(generator.decks(count), file)
+    return path
+
+
+if __name__ == "__main__":
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    cards = open_card_store().frame
+    for size in sizes:
+        # Seeded per size, so a database doesn't depend on which other sizes were generated
+        print(f"Wrote {write_database(DeckGenerator(cards, seed=size), size)}")
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# Hash index over the card store, so looking up a deck costs O(deck size) instead of a full
+# scan of every card Scryfall knows about.
+
+import re
+import unicodedata
+
+import numpy as np
+
+HYPHENS = re.compile(r"[-‐‑‒–—]")
+PUNCTUATION = re.compile(r"[^\w\s/]")
+
+
+# Case, accent and punctuation insensitive form of a card name, e.g. "Lim-Dûl's Vault" -> "lim duls vault"
+def normalize_name(name):
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    name = HYPHENS.sub(" ", name.casefold())
+    name = PUNCTUATION.sub("", name)
+
+    return " ".join(name.split())
+
+
+class CardIndex:
+    def __init__(self, cards):
+        self.cards = cards
+        self.rows = {}
+        self.normalized_rows = {}
+
+        names = cards["name"].tolist()
+        for row, name in enumerate(names):
+            self.rows.setdefault(name, row)
+            self.normalized_rows.setdefault(normalize_name(name), row)
+
+        # Double-faced cards can also be found by their front face, unless a card has that name itself
+        for row, name in enumerate(names):
+            if " // " in name:
+                front = name.split(" // ")[0]
+                self.rows.setdefault(front, row)
+                self.normalized_rows.setdefault(normalize_name(front), row)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __contains__(self, name):
+        return self.position(name) >= 0
+
+    # Row position of a card name in the card store, or -1 if there is no such card
+    def position(self, name):
+        row = self.rows.get(name)
+        if row is None:
+            if not isinstance(name, str):
+                return -1
+            row = self.normalized_rows.get(normalize_name(name), -1)
+        return row
+
+    def positions(self, names):
+        return np.fromiter((self.position(name) for name in names), dtype=np.int64)
+
+    # Card rows for the given names in the same order, names that aren't found are skipped
+    def lookup(self, names):
+        positions = self.positions(names)
+        return self.cards.take(positions[positions >= 0])
+
+    # One row per distinct card, in card store order
+    def lookup_unique(self, names):
+        positions = self.positions(names)
+        return self.cards.take(np.unique(positions[positions >= 0]))
+
+    # Card store name for every name (e.g. the full name of a double-faced card),
+    # names that aren't found are returned unchanged
+    def canonical_names(self, names):
+        store_names = self.cards["name"].to_numpy()
+        return [store_names[row] if row >= 0 else name for name, row in zip(names, self.positions(names))]
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+# Local card store: a trimmed, columnar snapshot of the Scryfall oracle bulk file.
+#
+# The bulk file is ingested once and written as an uncompressed Arrow IPC file, so the
+# app can memory-map it instead of downloading and parsing ~100 MB of JSON on every run.
+#
+# The frame the analyses use is kept compact: repeated strings are categoricals, colour
+# identities are a bitmask, and the image URIs (a dict per card) stay in the snapshot and
+# are only read for the cards that are shown (CardStore.image_uris). Card roles are tagged
+# from the oracle text when the frame is loaded (roles.py), the text itself isn't kept.
+#
+# Usage:
+#   python card_store.py refresh          # fetch the latest bulk file if it changed
+#   python card_store.py ingest <file>    # ingest a downloaded bulk file or URL
+#   python card_store.py info             # show the current snapshot
+
+import json
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from card_index import CardIndex
+from instrumentation import span
+from roles import tag_roles
+
+BULK_DATA_URL = "https://api.scryfall.com/bulk-data/oracle-cards"
+DEFAULT_BULK_FILE = "http://data.scryfall.io/oracle-cards/oracle-cards-20240505210241.json"
+STORE_DIR = os.environ.get("MTG_CARD_STORE", "card_store")
+MANIFEST = "manifest.json"
+# Bump when CARD_COLUMNS changes, older snapshots are ingested again from their source
+SNAPSHOT_FORMAT = 3
+
+CARD_COLUMNS = ["name", "released_at", "mana_cost", "cmc", "type_line", "oracle_text", "color_identity", "set_name", "rarity", "artist", "image_uris", "commander_legality"]
+
+# Columns of the snapshot that aren't loaded into the frame
+LAZY_COLUMNS = ["image_uris"]
+# Columns with few distinct values, stored as categoricals in the frame
+CATEGORY_COLUMNS = ["mana_cost", "type_line", "set_name", "rarity", "artist", "commander_legality"]
+
+# Card types that are not real cards and never show up in a deck
+NONCARD_TYPES = ["Plane", "Token", "Emblem", "Attraction", "Dungeon", "Stickers", "Contraption"]
+
+# Bits of the derived type_mask and color_mask columns
+TYPE_BITS = {
+    "Artifact": 1,
+    "Creature": 2,
+    "Enchantment": 4,
+    "Instant": 8,
+    "Sorcery": 16,
+    "Land": 32,
+    "Planeswalker": 64,
+    "Battle": 128,
+}
+LAND = TYPE_BITS["Land"]
+
+COLOR_BITS = {"W": 1, "U": 2, "B": 4, "R": 8, "G": 16}
+COLORS = "WUBRG"
+
+# Cards that can lead a deck: legendary creatures and cards that say so
+COMMANDER_TYPES = re.compile(r"\bLegendary\b.*\bCreature\b")
+COMMANDER_TEXT = re.compile(r"can be your commander")
+
+
+class CardStoreMissing(Exception):
+    pass
+
+
+# Derive the snapshot version from the bulk file name, e.g. "oracle-cards-20240505210241"
+def bulk_version(source):
+    match = re.search(r"oracle-cards-\d+", os.path.basename(str(source)))
+    if match:
+        return match.group(0)
+    return "oracle-cards-" + str(int(os.path.getmtime(source)))
+
+
+def trim_cards(cards):
+    # Of all formats only the legality in Commander is kept ("legal", "banned", ...)
+    if "legalities" in cards.columns:
+        cards["commander_legality"] = cards["legalities"].map(lambda legalities: legalities.get("commander") if isinstance(legalities, dict) else None)
+    cards = cards[[column for column in CARD_COLUMNS if column in cards.columns]]
+    cards = cards[cards["type_line"].str.contains('|'.join(NONCARD_TYPES), na=False) == False]
+
+    return cards.reset_index(drop=True)
+
+
+def read_manifest(store_dir=STORE_DIR):
+    try:
+        with open(os.path.join(store_dir, MANIFEST), "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(store_dir, manifest):
+    path = os.path.join(store_dir, MANIFEST)
+    with open(path + ".tmp", "w") as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+# Read a Scryfall bulk file (local path or URL), trim it and write it as a new snapshot
+def ingest(source, store_dir=STORE_DIR, version=None):
+    version = version or bulk_version(source)
+    os.makedirs(store_dir, exist_ok=True)
+
+    cards = trim_cards(pd.read_json(source))
+    table = pa.Table.from_pandas(cards, preserve_index=False)
+
+    file_name = version + ".arrow"
+    path = os.path.join(store_dir, file_name)
+    # Uncompressed so the file can be memory-mapped without decoding
+    feather.write_feather(table, path + ".tmp", compression="uncompressed")
+    os.replace(path + ".tmp", path)
+
+    previous = read_manifest(store_dir)
+    write_manifest(store_dir, {"version": version, "format": SNAPSHOT_FORMAT, "file": file_name, "source": str(source), "rows": table.num_rows})
+
+    # Only remove the old snapshot once the manifest points to the new one
+    if previous and previous["file"] != file_name:
+        try:
+            os.remove(os.path.join(store_dir, previous["file"]))
+        except FileNotFoundError:
+            pass
+
+    return version
+
+
+# Ask Scryfall for the current oracle bulk file and ingest it when it is newer than ours
+def refresh(store_dir=STORE_DIR):
+    import requests
+
+    response = requests.get(BULK_DATA_URL, timeout=30)
+    response.raise_for_status()
+    download_uri = response.json()["download_uri"]
+
+    version = bulk_version(download_uri)
+    manifest = read_manifest(store_dir)
+    if manifest and manifest["version"] == version and manifest.get("format", 1) == SNAPSHOT_FORMAT:
+        return version, False
+
+    with span("card_store.ingest"):
+        return ingest(download_uri, store_dir, version), True
+
+
+class CardStore:
+    def __init__(self, store_dir=STORE_DIR):
+        manifest = read_manifest(store_dir)
+        if manifest is None:
+            raise CardStoreMissing(f"No card store in '{store_dir}', run 'python card_store.py refresh' first")
+
+        self.store_dir = store_dir
+        # The format is part of the version, so caches and reports of an older snapshot are rebuilt
+        self.version = f"{manifest['version']}.{manifest.get('format', 1)}"
+        self.path = os.path.join(store_dir, manifest["file"])
+        self._table = None
+        self._frame = None
+        self._index = None
+
+    # Arrow table backed by the memory-mapped snapshot, nothing is read until a column is used
+    @property
+    def table(self):
+        if self._table is None:
+            source = pa.memory_map(self.path, "r")
+            self._table = pa.ipc.open_file(source).read_all()
+        return self._table
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            with span("card_store.frame"):
+                table = self.table.drop_columns([column for column in LAZY_COLUMNS if column in self.table.column_names])
+                self._frame = compact_columns(add_derived_columns(table.to_pandas()))
+        return self._frame
+
+    # Use a frame and index built before from this same snapshot (kept in a state snapshot,
+    # see snapshot.py) instead of building them
+    def restore(self, frame, index):
+        if self._frame is None:
+            self._frame, self._index = frame, index
+
+    # Image URIs of the cards at the given frame rows, read from the snapshot
+    def image_uris(self, rows):
+        if "image_uris" not in self.table.column_names:
+            return [{} for _ in rows]
+        uris = self.table.column("image_uris").take(pa.array(rows, type=pa.int64()))
+        return [strip_missing_uris(row) for row in uris.to_pylist()]
+
+    # Name -> row index over the frame, built once per process
+    @property
+    def index(self):
+        if self._index is None:
+            frame = self.frame
+            with span("card_store.index"):
+                self._index = CardIndex(frame)
+        return self._index
+
+
+# Compact columns the analyses work on instead of re-parsing strings and lists per chart:
+# a card type bitmask, a WUBRG colour bitmask, a role bitmask (see roles.py) and whether the
+# card can be a commander
+def add_derived_columns(cards):
+    type_line = cards["type_line"].fillna("")
+    type_mask = np.zeros(len(cards), dtype=np.uint8)
+    for card_type, bit in TYPE_BITS.items():
+        type_mask |= np.where(type_line.str.contains(card_type, regex=False).to_numpy(), bit, 0).astype(np.uint8)
+    cards["type_mask"] = type_mask
+
+    colors = cards["color_identity"].explode().map(COLOR_BITS).fillna(0).astype(np.uint8)
+    cards["color_mask"] = colors.groupby(level=0).sum().reindex(cards.index, fill_value=0).astype(np.uint8)
+
+    cards["role_mask"] = tag_roles(cards)
+
+    can_be_commander = type_line.str.contains(COMMANDER_TYPES).to_numpy(dtype=bool)
+    if "oracle_text" in cards.columns:
+        can_be_commander |= cards["oracle_text"].fillna("").str.contains(COMMANDER_TEXT).to_numpy(dtype=bool)
+    cards["can_be_commander"] = can_be_commander
+
+    return cards
+
+
+# Drop the colour identity lists and the oracle text (color_mask and role_mask replace them)
+# and turn the repeated strings into categoricals, so a join per card copy only copies small
+# integer codes
+def compact_columns(cards):
+    cards = cards.drop(columns=["color_identity", "oracle_text"], errors="ignore")
+    for column in CATEGORY_COLUMNS:
+        if column in cards.columns:
+            cards[column] = cards[column].astype("category")
+    return cards
+
+
+# Number of cards with each of the given types, e.g. ["Artifact", "Creature"], from their type masks
+def type_counts(type_masks, types):
+    bits = np.array([TYPE_BITS[card_type] for card_type in types], dtype=np.uint8)
+    return ((np.asarray(type_masks, dtype=np.uint8)[:, None] & bits) != 0).sum(axis=0)
+
+
+def color_mask_letters(mask):
+    return [color for color in COLORS if mask & COLOR_BITS[color]]
+
+
+# Arrow stores image_uris as a struct, so every card gets every key; drop the empty ones again
+def strip_missing_uris(uris):
+    if not isinstance(uris, dict):
+        return {}
+    return {key: value for key, value in uris.items() if value is not None}
+
+
+# Open the local snapshot, ingesting the pinned bulk file once if there is none yet and
+# ingesting a snapshot of an older format again from its source
+def open_card_store(store_dir=STORE_DIR):
+    manifest = read_manifest(store_dir)
+    if manifest is None:
+        ingest(DEFAULT_BULK_FILE, store_dir)
+    elif manifest.get("format", 1) < SNAPSHOT_FORMAT:
+        ingest(manifest["source"], store_dir, manifest["version"])
+    return CardStore(store_dir)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "info"
+
+    if command == "refresh":
+        version, updated = refresh()
+        print(f"Card store updated to {version}" if updated else f"Card store already at {version}")
+    elif command == "ingest" and len(sys.argv) > 2:
+        print(f"Card store updated to {ingest(sys.argv[2])}")
+    elif command == "info":
+        manifest = read_manifest()
+        print(json.dumps(manifest, indent=4) if manifest else "No card store yet")
+    else:
+        print("Usage: python card_store.py [refresh | ingest <file> | info]")
+        sys.exit(1)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# Communities: the decks of every playgroup in a deck store partition of its own.
+#
+# A community is one SQLite deck store (deck_store.py) with its meta aggregates (aggregates.py)
+# stored in the same file and kept up to date on every write. The default community is the
+# original deck store (database_mtg.sqlite), every other community is a file in the
+# communities directory, named after the community. Views over several communities add up the
+# stored counters of their partitions, the decks themselves aren't read again.
+#
+# Partitions don't share anything, so they are counted again in parallel by a process pool
+# (after a new card store, or with --force).
+#
+# Usage:
+#   python communities.py list
+#   python communities.py import <community> <decks.json>
+#   python communities.py rebuild [<community> ...] [--workers N] [--force]
+#   python communities.py compare [<community> ...]
+
+import argparse
+import glob
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pandas as pd
+
+from aggregates import counts_current, refresh_counts, stored_counts
+from card_store import open_card_store
+from deck_store import DECK_DB, DeckStore, open_deck_store
+
+COMMUNITY_DIR = os.environ.get("MTG_COMMUNITY_DIR", "communities")
+DEFAULT_COMMUNITY = os.environ.get("MTG_COMMUNITY", "Heerenveen")
+
+SUMMARY_COLUMNS = ["Community", "Decks", "Commanders", "Average mana value", "Lands per deck", "Mana rocks per deck"]
+
+
+def community_slug(name):
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+def community_path(name, directory=COMMUNITY_DIR):
+    if name == DEFAULT_COMMUNITY:
+        return DECK_DB
+    return os.path.join(directory, f"{community_slug(name)}.sqlite")
+
+
+# The deck store of a community, created the first time. The default community imports the
+# legacy JSON file like before.
+def open_community(name=DEFAULT_COMMUNITY, directory=COMMUNITY_DIR):
+    if name == DEFAULT_COMMUNITY:
+        return open_deck_store()
+
+    if not community_slug(name):
+        raise ValueError(f"Community name '{name}' has no letters or digits")
+    os.makedirs(directory, exist_ok=True)
+    store = DeckStore(community_path(name, directory))
+
+    stored_name = store.read_meta("community")
+    if stored_name is None:
+        store.write_meta("community", name)
+    elif stored_name != name:
+        raise ValueError(f"Community '{name}' would share the deck store of '{stored_name}'")
+    return store
+
+
+# The default community first, then the partitions in the communities directory
+def list_communities(directory=COMMUNITY_DIR):
+    names = [DEFAULT_COMMUNITY]
+    for path in sorted(glob.glob(os.path.join(directory, "*.sqlite"))):
+        names.append(DeckStore(path).read_meta("community") or os.path.splitext(os.path.basename(path))[0])
+    return names
+
+
+# Communities whose counters aren't current: counted with another card store, behind their
+# decks, or never counted
+def stale_communities(names, card_version, directory=COMMUNITY_DIR):
+    return [name for name in names if not counts_current(open_community(name, directory), card_version)]
+
+
+# Card store of a rebuild worker, opened once per process (it is memory-mapped, so cheap)
+worker_card_store = None
+
+
+def init_worker():
+    global worker_card_store
+    worker_card_store = open_card_store()
+
+
+# Count the aggregates of one community again, in a worker or with the given card store
+def rebuild_partition(name, directory=COMMUNITY_DIR, card_store=None):
+    card_store = card_store or worker_card_store
+    start = time.perf_counter()
+    deck_store = open_community(name, directory)
+    refresh_counts(deck_store, card_store.index, card_store.version, force=True)
+    return {"community": name, "decks": len(deck_store), "seconds": time.perf_counter() - start}
+
+
+# Count the aggregates of communities again, by a pool of worker processes (one per core by
+# default). Only the stale ones unless forced. Returns a result per rebuilt community.
+def rebuild_communities(names, directory=COMMUNITY_DIR, workers=None, force=False):
+    card_store = open_card_store()
+    if not force:
+        names = stale_communities(names, card_store.version, directory)
+
+    if workers == 1 or len(names) <= 1:
+        return [rebuild_partition(name, directory, card_store) for name in names]
+
+    workers = min(workers or os.cpu_count() or 1, len(names))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        return list(executor.map(partial(rebuild_partition, directory=directory), names, chunksize=max(1, len(names) // (workers * 4))))
+
+
+# The stored counters of the deck stores of communities, by name. Counters that aren't current
+# are counted again first, in this process (rebuild_communities does many at once).
+def community_counts(deck_stores, card_store):
+    counts = {}
+    for name, deck_store in deck_stores.items():
+        refresh_counts(deck_store, card_store.index, card_store.version)
+        counts[name] = stored_counts(deck_store)
+    return counts
+
+
+# The counters of several communities added up, the same counters as one deck store with all
+# their decks would have. aggregates.aggregate_frames turns them into the dashboard tables.
+def merge_counts(counts):
+    counts = [part for part in counts if not part.empty]
+    if not counts:
+        return pd.DataFrame(columns=["kind", "commander", "key", "count"])
+    merged = pd.concat(counts, ignore_index=True).groupby(["kind", "commander", "key"], sort=False)["count"].sum()
+    return merged.reset_index()
+
+
+# One row per community from its counters: decks, commanders, the average mana value of the
+# cards that aren't lands and the lands and mana rocks per deck
+def community_summary(counts_by_community):
+    rows = []
+    for name, counts in counts_by_community.items():
+        totals = counts.groupby("kind")["count"].sum()
+        cmc = counts[counts["kind"] == "cmc"]
+        decks = int(totals.get("deck", 0))
+        rows.append([
+            name,
+            decks,
+            counts.loc[counts["kind"] == "deck", "commander"].nunique(),
+            (cmc["key"].astype(float) * cmc["count"]).sum() / max(cmc["count"].sum(), 1),
+            totals.get("land", 0) / max(decks, 1),
+            totals.get("rock", 0) / max(decks, 1),
+        ])
+    return pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the deck store partitions of the communities")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list the communities")
+    import_parser = commands.add_parser("import", help="import a legacy JSON deck file into a community")
+    import_parser.add_argument("community")
+    import_parser.add_argument("path")
+    rebuild_parser = commands.add_parser("rebuild", help="count the aggregates of communities again")
+    rebuild_parser.add_argument("communities", nargs="*", help="default: all communities")
+    rebuild_parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    rebuild_parser.add_argument("--force", action="store_true", help="also the communities whose aggregates are up to date")
+    compare_parser = commands.add_parser("compare", help="compare communities from their aggregates")
+    compare_parser.add_argument("communities", nargs="*", help="default: all communities")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for name in list_communities():
+            store = open_community(name)
+            print(f"{name:<30} {len(store):>8} decks {store.player_count():>6} players  {community_path(name)}")
+    elif args.command == "import":
+        # The counters are behind the decks after the import, they are counted again when they are used
+        print(f"Imported {len(open_community(args.community).import_json(args.path))} decks into {args.community}")
+    elif args.command == "rebuild":
+        start = time.perf_counter()
+        results = rebuild_communities(args.communities or list_communities(), workers=args.workers, force=args.force)
+        for result in results:
+            print(f"{result['community']:<30} {result['decks']:>8} decks {result['seconds']:>8.2f}s")
+        print(f"Rebuilt {len(results)} communities in {time.perf_counter() - start:.2f}s")
+    elif args.command == "compare":
+        names = args.communities or list_communities()
+        rebuild_communities(names)
+        counts = community_counts({name: open_community(name) for name in names}, open_card_store())
+        summary = community_summary(dict(counts, **{"All communities": merge_counts(counts.values())}))
+        print(summary.to_string(index=False, float_format="{:.2f}".format))
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+# Bulk import of decklists into the deck store.
+#
+# Decklists are streamed from files and directories (MTGO .txt, Arena exports and Moxfield CSV
+# exports) through one compiled line parser, checked against the card store and inserted in
+# a single transaction. Card names match like everywhere else (case, accents and punctuation
+# don't matter), names that still aren't found get fuzzy suggestions. A deck is rejected when
+# its commander can't lead a deck or is banned as commander.
+#
+# The commander is the card in the "Commander" section (Arena, Moxfield), or the sideboard of
+# one or two cards (MTGO); a second one is its partner. The player is the directory a file is in, unless given. A file that
+# can't be read (not UTF-8, no Name column, a count that isn't a number) is rejected on its own.
+#
+# Usage:
+#   python deck_import.py <file or directory> ... [--community NAME] [--player NAME] [--commander NAME] [--autocorrect] [--dry-run]
+
+import argparse
+import csv
+import difflib
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+from card_index import normalize_name
+
+# "1 Sol Ring", "4x Island" and "Sol Ring". Arena adds the set and collector number and
+# Moxfield a foil marker: "1 Sol Ring (C21) 263", "1 Fire // Ice (MH2) 290 *F*".
+LINE_PATTERN = re.compile(r"(?:(\d+)x?\s+)?(.+)")
+SET_SUFFIX = re.compile(r"(?:\s+\([A-Za-z0-9]+\)(?:\s+\S+)?)?(?:\s+\*[A-Z]+\*)?$")
+SECTION_PATTERN = re.compile(r"^(commander|companion|deck|main|mainboard|sideboard|maybeboard|considering|about)\s*:?$", re.IGNORECASE)
+COMMENT_PREFIXES = ("//", "#")
+
+MAIN, COMMANDER, SIDEBOARD, IGNORED = "main", "commander", "sideboard", "ignored"
+SECTIONS = {
+    "commander": COMMANDER,
+    "deck": MAIN,
+    "main": MAIN,
+    "mainboard": MAIN,
+    "sideboard": SIDEBOARD,
+    "companion": IGNORED,
+    "maybeboard": IGNORED,
+    "considering": IGNORED,
+    "about": IGNORED,
+}
+
+TEXT_EXTENSIONS = {".txt", ".dec"}
+CSV_EXTENSIONS = {".csv"}
+
+# Suggestions per unknown name and how similar they have to be (difflib ratio)
+SUGGESTIONS = 3
+SUGGESTION_CUTOFF = 0.8
+
+
+# A parsed deck, cards as (name, count) pairs. A second commander (partners) is a partner of
+# the deck, not one of its cards.
+def make_deck(sections, source, player, commander):
+    commanders = sections[COMMANDER]
+    if not commanders and 0 < len(sections[SIDEBOARD]) <= 2:
+        commanders = sections[SIDEBOARD]
+
+    names = [name for name, _ in commanders]
+    if commander is None and names:
+        commander = names[0]
+    # A commander given explicitly is usually in the list as well
+    partners = [name for name in names if commander is None or normalize_name(name) != normalize_name(commander)]
+
+    return {"source": source, "player": player, "commander": commander, "partners": partners, "card_counts": sections[MAIN]}
+
+
+# Parse the lines of an MTGO or Arena decklist (or a plain list of cards)
+def parse_text(lines, source="", player=None, commander=None):
+    sections = {MAIN: [], COMMANDER: [], SIDEBOARD: [], IGNORED: []}
+    section, headers = MAIN, False
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            # MTGO has no headers, the sideboard follows the deck after a blank line. Only the
+            # last block is the sideboard, the blocks before it belong to the deck.
+            if not headers and sections[MAIN]:
+                sections[MAIN] += sections[SIDEBOARD]
+                sections[SIDEBOARD], section = [], SIDEBOARD
+            continue
+
+        # Section headers and comments don't start with a count, most card lines do
+        if not line[0].isdigit():
+            if line.startswith(COMMENT_PREFIXES):
+                continue
+            header = SECTION_PATTERN.match(line)
+            if header:
+                section, headers = SECTIONS[header.group(1).lower()], True
+                continue
+
+        count, name = LINE_PATTERN.match(line).groups()
+        if " (" in name or name.endswith("*"):
+            name = SET_SUFFIX.sub("", name)
+        sections[section].append((name, int(count) if count else 1))
+
+    # A last block of more than two cards is no MTGO commander sideboard but part of a plain list
+    if not headers and len(sections[SIDEBOARD]) > 2:
+        sections[MAIN] += sections[SIDEBOARD]
+        sections[SIDEBOARD] = []
+
+    return make_deck(sections, source, player, commander)
+
+
+# Parse a Moxfield CSV export: a Count (or Quantity) and Name column and optionally a Board column
+def parse_csv(file, source="", player=None, commander=None):
+    sections = {MAIN: [], COMMANDER: [], SIDEBOARD: [], IGNORED: []}
+    reader = csv.DictReader(file)
+    fields = {field.strip().lower(): field for field in reader.fieldnames or []}
+    if "name" not in fields:
+        raise ValueError("No Name column")
+    name_field = fields["name"]
+    count_field = fields.get("count") or fields.get("quantity")
+    board_field = fields.get("board") or fields.get("section")
+
+    for row in reader:
+        # Short rows have None for the missing columns
+        name = (row[name_field] or "").strip()
+        if not name:
+            continue
+        try:
+            count = int(row[count_field] or 1) if count_field else 1
+        except ValueError:
+            raise ValueError(f"Count '{row[count_field]}' of {name} is not a number") from None
+        board = (row[board_field] or "").strip().lower() if board_field else "mainboard"
+        sections[SECTIONS.get(board, IGNORED)].append((name, count))
+
+    return make_deck(sections, source, player, commander)
+
+
+def deck_files(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, directories, files in os.walk(path):
+            directories.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in TEXT_EXTENSIONS | CSV_EXTENSIONS:
+                    yield os.path.join(root, name)
+
+
+# Stream the decks of files and directories, one file is one deck. A file that can't be read
+# is a deck with the problem, validate_decks rejects it.
+def read_decks(paths, player=None, commander=None):
+    for path in deck_files(paths):
+        deck_player = player or os.path.basename(os.path.dirname(os.path.abspath(path)))
+        try:
+            with open(path, "r", encoding="utf-8-sig", newline="") as file:
+                if os.path.splitext(path)[1].lower() in CSV_EXTENSIONS:
+                    deck = parse_csv(file, path, deck_player, commander)
+                else:
+                    deck = parse_text(file, path, deck_player, commander)
+        except UnicodeDecodeError as e:
+            deck = {"source": path, "problems": [f"Not a UTF-8 file ({e.reason} at byte {e.start})"]}
+        except (ValueError, csv.Error, OSError) as e:
+            deck = {"source": path, "problems": [str(e)]}
+        yield deck
+
+
+class DeckValidator:
+    def __init__(self, card_store):
+        cards = card_store.frame
+        self.index = card_store.index
+        self.names = cards["name"].to_numpy(dtype=object)
+        self.can_be_commander = cards["can_be_commander"].to_numpy() if "can_be_commander" in cards.columns else np.ones(len(cards), dtype=bool)
+        if "commander_legality" in cards.columns:
+            self.banned = (cards["commander_legality"] == "banned").to_numpy()
+        else:
+            self.banned = np.zeros(len(cards), dtype=bool)
+
+        self.normalized_names = list(self.index.normalized_rows)
+        self.suggestions = {}
+
+    # Closest card store names for a name that isn't found, cached per name
+    def suggest(self, name):
+        if name not in self.suggestions:
+            matches = difflib.get_close_matches(normalize_name(name), self.normalized_names, n=SUGGESTIONS, cutoff=SUGGESTION_CUTOFF)
+            self.suggestions[name] = [self.names[self.index.normalized_rows[match]] for match in matches]
+        return self.suggestions[name]
+
+    def unknown(self, what, name):
+        suggestions = self.suggest(name)
+        return f"Unknown {what} '{name}'" + (f", did you mean {' or '.join(suggestions)}?" if suggestions else "")
+
+    # Row of a name in the card store, or of its best suggestion with autocorrect (-1 if none)
+    def resolve(self, name, autocorrect):
+        row = self.index.position(name)
+        if row < 0 and autocorrect and self.suggest(name):
+            row = self.index.position(self.suggest(name)[0])
+        return row
+
+    # Card store name of a commander, or None with the problem added
+    def check_commander(self, name, autocorrect, problems):
+        row = self.resolve(name, autocorrect)
+        if row < 0:
+            problems.append(self.unknown("commander", name))
+        elif not self.can_be_commander[row]:
+            problems.append(f"{self.names[row]} can't be a commander")
+        elif self.banned[row]:
+            problems.append(f"{self.names[row]} is banned as commander")
+        else:
+            return self.names[row]
+        return None
+
+    # Check a parsed deck. Returns the deck with card store names and its cards int-coded as
+    # card_ids and counts, and the problems that keep it from being imported (none if it can be)
+    def validate(self, deck, autocorrect=False):
+        problems = []
+
+        commander = deck["commander"]
+        if not commander:
+            problems.append("No commander")
+        else:
+            commander = self.check_commander(commander, autocorrect, problems) or commander
+
+        partners = deck.get("partners", [])
+        if len(partners) > 1:
+            problems.append("More than two commanders")
+        partners = [self.check_commander(partner, autocorrect, problems) or partner for partner in partners]
+
+        names = [name for name, _ in deck["card_counts"]]
+        card_ids = self.index.positions(names)
+        counts = np.fromiter((count for _, count in deck["card_counts"]), dtype=np.int32, count=len(names))
+        for position in np.flatnonzero(card_ids < 0):
+            card_ids[position] = self.resolve(names[position], autocorrect)
+            if card_ids[position] < 0:
+                problems.append(self.unknown("card", names[position]))
+
+        if not names:
+            problems.append("No cards")
+
+        card_ids = card_ids.astype(np.int32)
+        found = card_ids >= 0
+        card_counts = list(zip(self.names[card_ids[found]], counts[found].tolist()))
+        return dict(deck, commander=commander, partners=partners, card_ids=card_ids[found], counts=counts[found], card_counts=card_counts), problems
+
+
+# A validated deck as DeckStore.add_decks takes it
+def store_deck(deck):
+    return {"player": deck["player"], "commander": deck["commander"], "partner": (deck.get("partners") or [None])[0], "card_counts": deck["card_counts"]}
+
+
+# Validate decks. Returns the valid decks, ready for DeckStore.add_decks, and the problems of
+# the rejected decks by source.
+def validate_decks(decks, validator, autocorrect=False):
+    valid, rejected = [], {}
+    for deck in decks:
+        if "problems" in deck:
+            rejected[deck["source"]] = deck["problems"]
+            continue
+        deck, problems = validator.validate(deck, autocorrect)
+        if problems:
+            rejected[deck["source"]] = problems
+        else:
+            valid.append(store_deck(deck))
+    return valid, rejected
+
+
+# Validate decks and add the valid ones to the deck store in one transaction. Returns the ids
+# of the added decks and the problems of the rejected decks by source.
+def import_decks(decks, deck_store, validator, autocorrect=False):
+    valid, rejected = validate_decks(decks, validator, autocorrect)
+    return deck_store.add_decks(valid) if valid else [], rejected
+
+
+if __name__ == "__main__":
+    from aggregates import MetaAggregates
+    from card_store import open_card_store
+    from communities import DEFAULT_COMMUNITY, open_community
+
+    parser = argparse.ArgumentParser(description="Import decklists into the deck store")
+    parser.add_argument("paths", nargs="+", help="decklist files or directories of them")
+    parser.add_argument("--community", default=DEFAULT_COMMUNITY, help="community to add the decks to (default: %(default)s)")
+    parser.add_argument("--player", help="player of all decks (default: the directory of each file)")
+    parser.add_argument("--commander", help="commander of all decks (default: read from each decklist)")
+    parser.add_argument("--autocorrect", action="store_true", help="replace unknown names by their closest suggestion")
+    parser.add_argument("--dry-run", action="store_true", help="only validate the decks")
+    args = parser.parse_args()
+
+    card_store = open_card_store()
+    deck_store = open_community(args.community)
+    # Keep the meta aggregates up to date, like a deck submitted in the app
+    MetaAggregates(deck_store, card_store.index, card_store.version)
+
+    start = time.perf_counter()
+    valid, rejected = validate_decks(read_decks(args.paths, args.player, args.commander), DeckValidator(card_store), args.autocorrect)
+    if valid and not args.dry_run:
+        deck_store.add_decks(valid)
+    seconds = time.perf_counter() - start
+
+    for source, problems in rejected.items():
+        print(f"{source}: " + "; ".join(problems))
+    print(f"{'Checked' if args.dry_run else 'Imported'} {len(valid)} decks and rejected {len(rejected)} in {seconds:.2f}s")
+    sys.exit(1 if rejected else 0)
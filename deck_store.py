@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+# Deck store: the community decks in a SQLite database in WAL mode.
+#
+# Every submitted deck is one transaction, so concurrent submissions can't overwrite each
+# other and a write doesn't get slower as the database grows. Decks can be queried by
+# commander or player through indexes.
+#
+# Usage:
+#   python deck_store.py import database_mtg.json   # import the legacy JSON file
+#   python deck_store.py info
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import uuid
+
+DECK_DB = os.environ.get("MTG_DECK_DB", "database_mtg.sqlite")
+LEGACY_DECK_FILE = "database_mtg.json"
+
+# A player has a name, or the player number of the legacy JSON file (legacy_id), never both:
+# legacy player 3 and a player called "Player 3" are different players
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE,
+    legacy_id INTEGER UNIQUE
+);
+CREATE TABLE IF NOT EXISTS decks (
+    id INTEGER PRIMARY KEY,
+    player_id INTEGER NOT NULL REFERENCES players(id),
+    commander TEXT NOT NULL,
+    partner TEXT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS deck_cards (
+    deck_id INTEGER NOT NULL REFERENCES decks(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (deck_id, position)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value NOT NULL
+);
+CREATE INDEX IF NOT EXISTS decks_commander_idx ON decks(commander);
+CREATE INDEX IF NOT EXISTS decks_player_idx ON decks(player_id);
+"""
+
+# Deck stores from before the legacy_id column named the legacy players "Player <id>"
+MIGRATE_PLAYERS = [
+    "CREATE TABLE players_new (id INTEGER PRIMARY KEY, name TEXT UNIQUE, legacy_id INTEGER UNIQUE)",
+    """
+    INSERT INTO players_new (id, name, legacy_id)
+    SELECT id, CASE WHEN name = 'Player ' || id THEN NULL ELSE name END, CASE WHEN name = 'Player ' || id THEN id END FROM players
+    """,
+    "DROP TABLE players",
+    "ALTER TABLE players_new RENAME TO players",
+]
+
+COUNT_PATTERN = re.compile(r'^(\d+)\s+(.*)$')
+
+
+# Split "3 Forest" into ("Forest", 3), lines without a count are a single copy
+def split_count(card):
+    match = COUNT_PATTERN.match(card.strip())
+    if match:
+        return match.group(2).strip(), int(match.group(1))
+    return card.strip(), 1
+
+
+def expand_counts(card_counts):
+    return [name for name, count in card_counts for _ in range(count)]
+
+
+class DeckStore:
+    def __init__(self, path=DECK_DB):
+        self.path = path
+        # Objects with add_decks(conn, decks) for a list of (deck_id, commander, cards) and
+        # remove_deck(conn, deck_id, commander, cards), called inside the write transaction
+        # after the version is bumped (see aggregates.MetaAggregates)
+        self.listeners = []
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            if not self.has_legacy_ids(conn):
+                self.migrate_players(conn)
+            if "partner" not in self.columns(conn, "decks"):
+                with conn.transaction():
+                    if "partner" not in self.columns(conn, "decks"):
+                        conn.execute("ALTER TABLE decks ADD COLUMN partner TEXT")
+            # Random id of this database, versions of different deck stores can be equal
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('store_id', ?)", (uuid.uuid4().hex,))
+            self.store_id = conn.execute("SELECT value FROM meta WHERE key = 'store_id'").fetchone()[0]
+
+    def columns(self, conn, table):
+        return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+    def has_legacy_ids(self, conn):
+        return "legacy_id" in self.columns(conn, "players")
+
+    # Replace the players table by one with legacy ids. Foreign keys are off meanwhile (they
+    # can't be switched inside a transaction), the decks keep their player ids.
+    def migrate_players(self, conn):
+        conn.execute("PRAGMA foreign_keys=OFF")
+        try:
+            with conn.transaction():
+                # Another process can have migrated while we waited for the lock
+                if not self.has_legacy_ids(conn):
+                    for statement in MIGRATE_PLAYERS:
+                        conn.execute(statement)
+        finally:
+            conn.execute("PRAGMA foreign_keys=ON")
+
+    def connect(self):
+        # Autocommit mode, transactions are started explicitly with BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA foreign_keys=ON")
+        return Connection(conn)
+
+    def read_meta(self, key, default=None):
+        with self.connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def write_meta(self, key, value):
+        with self.connect() as conn:
+            conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+    # Increases with every write, used as the cache key for everything derived from the decks
+    def version(self):
+        return self.read_meta("version", 0)
+
+    # Id of a player by legacy player number or by name, the player is added the first time
+    def player_id(self, conn, player):
+        if isinstance(player, int):
+            conn.execute("INSERT OR IGNORE INTO players (legacy_id) VALUES (?)", (player,))
+            return conn.execute("SELECT id FROM players WHERE legacy_id = ?", (player,)).fetchone()[0]
+
+        conn.execute("INSERT OR IGNORE INTO players (name) VALUES (?)", (player,))
+        return conn.execute("SELECT id FROM players WHERE name = ?", (player,)).fetchone()[0]
+
+    def insert_deck(self, conn, player, commander, partner=None):
+        player_id = self.player_id(conn, player)
+        return conn.execute("INSERT INTO decks (player_id, commander, partner) VALUES (?, ?, ?)", (player_id, commander, partner)).lastrowid
+
+    def bump_version(self, conn):
+        conn.execute("INSERT INTO meta (key, value) VALUES ('version', 1) ON CONFLICT(key) DO UPDATE SET value = value + 1")
+
+    # Add one deck atomically. player is a legacy player number or a player name.
+    def add_deck(self, player, commander, cards):
+        return self.add_decks([{"player": player, "commander": commander, "cards": cards}])[0]
+
+    # Add many decks in a single transaction. A deck has its cards either as "cards" lines
+    # ("3 Forest") or as "card_counts" (name, count) pairs, and optionally a "partner" (the
+    # second commander of partners).
+    def add_decks(self, decks):
+        with self.connect() as conn:
+            with conn.transaction():
+                added, rows = [], []
+                for deck in decks:
+                    card_counts = deck["card_counts"] if "card_counts" in deck else [split_count(card) for card in deck["cards"]]
+                    deck_id = self.insert_deck(conn, deck["player"], deck["commander"], deck.get("partner"))
+                    rows.extend((deck_id, position, name, count) for position, (name, count) in enumerate(card_counts))
+                    added.append((deck_id, deck["commander"], expand_counts(card_counts)))
+
+                # The cards of all decks in one statement
+                conn.executemany("INSERT INTO deck_cards (deck_id, position, name, count) VALUES (?, ?, ?, ?)", rows)
+
+                # Listeners see the new version
+                self.bump_version(conn)
+                for listener in self.listeners:
+                    listener.add_decks(conn, added)
+        return [deck_id for deck_id, _, _ in added]
+
+    # Remove a deck atomically, raises KeyError when there is no deck with that id
+    def remove_deck(self, deck_id):
+        with self.connect() as conn:
+            with conn.transaction():
+                row = conn.execute("SELECT commander FROM decks WHERE id = ?", (deck_id,)).fetchone()
+                if row is None:
+                    raise KeyError(deck_id)
+                self.bump_version(conn)
+                if self.listeners:
+                    commander = row[0]
+                    card_counts = conn.execute("SELECT name, count FROM deck_cards WHERE deck_id = ? ORDER BY position", (deck_id,)).fetchall()
+                    for listener in self.listeners:
+                        listener.remove_deck(conn, deck_id, commander, expand_counts(card_counts))
+
+                conn.execute("DELETE FROM deck_cards WHERE deck_id = ?", (deck_id,))
+                conn.execute("DELETE FROM decks WHERE id = ?", (deck_id,))
+
+    # Stream decks as {"deck_id", "player", "commander", "cards"} records, one at a time, the
+    # player as its player id. Cards are expanded to one entry per copy, like the lists in the
+    # legacy JSON file. Decks of a player are selected by legacy player number or name.
+    def iter_decks(self, commander=None, player=None):
+        query = """
+            SELECT decks.id, decks.player_id, decks.commander, deck_cards.name, deck_cards.count
+            FROM decks LEFT JOIN deck_cards ON deck_cards.deck_id = decks.id
+        """
+        conditions, params = [], []
+        if commander is not None:
+            conditions.append("decks.commander = ?")
+            params.append(commander)
+        if player is not None:
+            conditions.append(f"decks.player_id = (SELECT id FROM players WHERE {'legacy_id' if isinstance(player, int) else 'name'} = ?)")
+            params.append(player)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY decks.id, deck_cards.position"
+
+        with self.connect() as conn:
+            deck = None
+            for deck_id, player_id, deck_commander, name, count in conn.execute(query, params):
+                if deck is None or deck["deck_id"] != deck_id:
+                    if deck is not None:
+                        yield deck
+                    deck = {"deck_id": deck_id, "player": player_id, "commander": deck_commander, "cards": []}
+                if name is not None:
+                    deck["cards"].extend([name] * count)
+            if deck is not None:
+                yield deck
+
+    # The decks as (deck_id, player, commander) rows and their cards as (deck_id, name, count)
+    # rows, without expanding the counts. Both are read in one transaction.
+    def deck_cards(self, commander=None):
+        condition, params = ("WHERE decks.commander = ?", (commander,)) if commander is not None else ("", ())
+        with self.connect() as conn:
+            conn.execute("BEGIN")
+            try:
+                decks = conn.execute(f"SELECT id, player_id, commander FROM decks {condition} ORDER BY id", params).fetchall()
+                cards = conn.execute(
+                    f"""
+                    SELECT deck_cards.deck_id, deck_cards.name, deck_cards.count
+                    FROM deck_cards JOIN decks ON decks.id = deck_cards.deck_id {condition}
+                    ORDER BY deck_cards.deck_id, deck_cards.position
+                    """,
+                    params
+                ).fetchall()
+            finally:
+                conn.execute("COMMIT")
+        return decks, cards
+
+    def decks_by_commander(self, commander):
+        return list(self.iter_decks(commander=commander))
+
+    def decks_by_player(self, player):
+        return list(self.iter_decks(player=player))
+
+    def commanders(self):
+        with self.connect() as conn:
+            return [row[0] for row in conn.execute("SELECT commander FROM decks ORDER BY id")]
+
+    def player_count(self):
+        with self.connect() as conn:
+            return conn.execute("SELECT COUNT(DISTINCT player_id) FROM decks").fetchone()[0]
+
+    def __len__(self):
+        with self.connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM decks").fetchone()[0]
+
+    # Import the decks of the legacy JSON file in one transaction
+    def import_json(self, path=LEGACY_DECK_FILE):
+        with open(path, "r") as file:
+            decks = json.load(file)
+        return self.add_decks(decks)
+
+
+class Connection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.conn.close()
+
+    def execute(self, *args):
+        return self.conn.execute(*args)
+
+    def executemany(self, *args):
+        return self.conn.executemany(*args)
+
+    def executescript(self, *args):
+        return self.conn.executescript(*args)
+
+    def transaction(self):
+        return Transaction(self.conn)
+
+
+# BEGIN IMMEDIATE takes the write lock up front, so two writers queue instead of failing halfway
+class Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, *exc):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+# Open the deck store, importing the legacy JSON file the first time
+def open_deck_store(path=DECK_DB, legacy_file=LEGACY_DECK_FILE):
+    store = DeckStore(path)
+    if len(store) == 0 and legacy_file and os.path.exists(legacy_file):
+        store.import_json(legacy_file)
+    return store
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "info"
+
+    if command == "import" and len(sys.argv) > 2:
+        print(f"Imported {len(DeckStore().import_json(sys.argv[2]))} decks into {DECK_DB}")
+    elif command == "info":
+        store = DeckStore()
+        print(f"{len(store)} decks in {DECK_DB}, version {store.version()}")
+    else:
+        print("Usage: python deck_store.py [import <file> | info]")
+        sys.exit(1)
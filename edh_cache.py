@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+
+# Caching facade over all EDHRec access.
+#
+# Commander pages and average decks are kept in a SQLite store with a TTL per endpoint. A
+# fresh entry is served from the store; a stale entry is served as well and refreshed in
+# the background, so a render never waits for EDHRec once a commander has been seen. A 404
+# (a commander EDHRec doesn't know) is cached too. In offline mode the network is never used.
+# The high synergy cards come from the cached commander page, no separate request needed.
+#
+# The store (edh_store.sqlite) is the one that is read and written. edh_cache.sqlite is the
+# requests_cache database of the original app: it is imported once, when the store is created
+# (python edh_cache.py import imports it again). It only holds commander pages, so offline a
+# commander without a stored average deck is compared without one.
+#
+# Usage:
+#   python edh_cache.py stats
+#   python edh_cache.py warm [commander ...]      # default: the commanders in the deck store
+#   python edh_cache.py purge [--expired]
+#   python edh_cache.py import [edh_cache]        # seed from a requests_cache database
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+from analytics import commander_slug, high_synergy_cards
+from edh_fetch import (BACKOFF, EDHREC_JSON_URL, MAX_WORKERS, REQUESTS_PER_SECOND, RETRIES, FetchError, TokenBucket, average_deck_url,
+                       commander_page_url, get_json)
+from instrumentation import count, instrument_session, with_recorder
+
+EDH_CACHE_DB = os.environ.get("MTG_EDH_CACHE", "edh_store.sqlite")
+# requests_cache name of the legacy cache (edh_cache.sqlite)
+LEGACY_CACHE = "edh_cache"
+OFFLINE = os.environ.get("MTG_EDH_OFFLINE", "0") == "1"
+
+ENDPOINTS = {
+    "commander": commander_page_url,
+    "average_deck": average_deck_url,
+}
+
+# Seconds an entry is fresh, per endpoint. Average decks change slower than commander pages.
+TTLS = {
+    "commander": 5 * 3600,
+    "average_deck": 24 * 3600,
+}
+NEGATIVE_TTL = 24 * 3600
+
+REFRESH_WORKERS = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    endpoint TEXT NOT NULL,
+    slug TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    body TEXT,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (endpoint, slug)
+);
+"""
+
+
+class NotFound(FetchError):
+    pass
+
+
+class EdhCache:
+    def __init__(self, path=EDH_CACHE_DB, offline=OFFLINE, base_url=EDHREC_JSON_URL, session=None, ttls=TTLS, negative_ttl=NEGATIVE_TTL,
+                 rate=REQUESTS_PER_SECOND, retries=RETRIES, backoff=BACKOFF, legacy_cache=LEGACY_CACHE):
+        self.path = path
+        self.offline = offline
+        self.base_url = base_url
+        self.session = session or instrument_session(requests.Session(), prefix="edhrec")
+        self.ttls = ttls
+        self.negative_ttl = negative_ttl
+        self.bucket = TokenBucket(rate)
+        self.retries = retries
+        self.backoff = backoff
+
+        self.stats = Counter()
+        # Bumped when a background refresh or a purge changes the entries, so callers can key
+        # their own caches on it
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.refreshing = set()
+        self.refresher = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix="edh-refresh")
+
+        created = not os.path.exists(path)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        if created and legacy_cache and os.path.exists(f"{legacy_cache}.sqlite"):
+            self.import_requests_cache(legacy_cache)
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def record(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+        count(f"edh_cache.{stat}")
+
+    def read(self, endpoint, slug):
+        conn = self.connect()
+        try:
+            return conn.execute("SELECT status, body, fetched_at FROM entries WHERE endpoint = ? AND slug = ?", (endpoint, slug)).fetchone()
+        finally:
+            conn.close()
+
+    def write(self, endpoint, slug, status, body, fetched_at=None):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO entries (endpoint, slug, status, body, fetched_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(endpoint, slug) DO UPDATE SET status = excluded.status, body = excluded.body, fetched_at = excluded.fetched_at",
+                    (endpoint, slug, status, body, fetched_at or time.time())
+                )
+        finally:
+            conn.close()
+
+    # Request an endpoint and store the answer, a 404 is stored as a negative entry
+    def fetch(self, endpoint, commander):
+        slug = commander_slug(commander)
+        try:
+            data = get_json(self.session, ENDPOINTS[endpoint](commander, self.base_url), self.bucket, self.retries, self.backoff)
+        except FetchError as e:
+            if e.status == 404:
+                self.write(endpoint, slug, 404, None)
+                raise NotFound(str(e), 404) from None
+            raise
+
+        self.write(endpoint, slug, 200, json.dumps(data))
+        return data
+
+    def refresh(self, endpoint, commander):
+        key = (endpoint, commander_slug(commander))
+        try:
+            self.fetch(endpoint, commander)
+            self.record("refreshes")
+            with self.lock:
+                self.generation += 1
+        except FetchError:
+            # Keep serving the stale entry, the next request tries again
+            self.record("refresh_errors")
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def schedule_refresh(self, endpoint, commander):
+        key = (endpoint, commander_slug(commander))
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        self.refresher.submit(with_recorder(self.refresh), endpoint, commander)
+
+    # Response of an endpoint for a commander. Raises NotFound for a commander EDHRec doesn't
+    # know and FetchError when it can't be fetched (or isn't cached in offline mode).
+    def get(self, endpoint, commander):
+        row = self.read(endpoint, commander_slug(commander))
+        if row is None:
+            if self.offline:
+                self.record("offline_misses")
+                raise FetchError(f"{commander}: {endpoint} is not cached (offline)")
+            self.record("misses")
+            return self.fetch(endpoint, commander)
+
+        status, body, fetched_at = row
+        age = time.time() - fetched_at
+        if status != 200:
+            if age < self.negative_ttl or self.offline:
+                self.record("negative_hits")
+                raise NotFound(f"{commander}: {endpoint} not found on EDHRec (cached)", status)
+            self.record("misses")
+            return self.fetch(endpoint, commander)
+
+        if age < self.ttls[endpoint]:
+            self.record("hits")
+        else:
+            self.record("stale_hits")
+            if not self.offline:
+                self.schedule_refresh(endpoint, commander)
+        return json.loads(body)
+
+    # Whether EDHRec answered 404 for an endpoint of the commander, unlike a failed request
+    # that can succeed next time
+    def not_found(self, commander):
+        slug = commander_slug(commander)
+        return any((row := self.read(endpoint, slug)) is not None and row[0] == 404 for endpoint in ENDPOINTS)
+
+    def commander_page(self, commander):
+        return self.get("commander", commander)
+
+    def average_deck(self, commander):
+        return {"commander": commander, "decklist": self.get("average_deck", commander).get("deck", [])}
+
+    def high_synergy_cards(self, commander):
+        return high_synergy_cards(self.commander_page(commander))
+
+    # Fetch the commander page and the average deck of all commanders concurrently, served from
+    # the store where possible. Returns the results per commander and the error message per
+    # commander that failed.
+    def fetch_commanders(self, commanders, max_workers=MAX_WORKERS):
+        commanders = list(dict.fromkeys(commanders))
+
+        def load(commander):
+            page = self.commander_page(commander)
+            try:
+                average_deck = self.average_deck(commander)
+            except FetchError as e:
+                if not self.offline or isinstance(e, NotFound):
+                    raise
+                average_deck = {"commander": commander, "decklist": []}
+            return {"page": page, "average_deck": average_deck}
+
+        results, failures = {}, {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {commander: executor.submit(with_recorder(load), commander) for commander in commanders}
+            for commander, future in futures.items():
+                try:
+                    results[commander] = future.result()
+                except (FetchError, ValueError) as e:
+                    failures[commander] = str(e)
+
+        return results, failures
+
+    # Fetch every endpoint of the commanders that isn't fresh yet, returns the failures
+    def warm(self, commanders, max_workers=MAX_WORKERS):
+        def warm_one(commander, endpoint):
+            row = self.read(endpoint, commander_slug(commander))
+            ttl = self.ttls[endpoint] if row is None or row[0] == 200 else self.negative_ttl
+            if row is None or time.time() - row[2] >= ttl:
+                self.fetch(endpoint, commander)
+
+        failures = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {(commander, endpoint): executor.submit(with_recorder(warm_one), commander, endpoint) for commander in dict.fromkeys(commanders) for endpoint in ENDPOINTS}
+            for (commander, endpoint), future in futures.items():
+                try:
+                    future.result()
+                except (FetchError, ValueError) as e:
+                    failures[commander] = str(e)
+
+        return failures
+
+    # Remove entries: everything, one endpoint, one commander, or only the expired ones
+    def purge(self, endpoint=None, commander=None, expired=False):
+        conditions, params = [], []
+        if endpoint is not None:
+            conditions.append("endpoint = ?")
+            params.append(endpoint)
+        if commander is not None:
+            conditions.append("slug = ?")
+            params.append(commander_slug(commander))
+        if expired:
+            now = time.time()
+            ttl_cases = " ".join(f"WHEN '{name}' THEN {ttl}" for name, ttl in self.ttls.items())
+            conditions.append(f"fetched_at < ? - CASE WHEN status != 200 THEN ? ELSE CASE endpoint {ttl_cases} ELSE 0 END END")
+            params.extend([now, self.negative_ttl])
+
+        query = "DELETE FROM entries" + (" WHERE " + " AND ".join(conditions) if conditions else "")
+        conn = self.connect()
+        try:
+            with conn:
+                removed = conn.execute(query, params).rowcount
+        finally:
+            conn.close()
+        with self.lock:
+            self.generation += 1
+        return removed
+
+    # Changes whenever an entry is written or removed, in this process or another one (the
+    # generation only counts this process), for callers that persist what they built from it
+    def fingerprint(self):
+        conn = self.connect()
+        try:
+            entries, fetched_at = conn.execute("SELECT COUNT(*), TOTAL(fetched_at) FROM entries").fetchone()
+        finally:
+            conn.close()
+        return f"{entries}:{fetched_at!r}"
+
+    # Hit/miss counters of this process and the number of fresh, stale and negative entries per endpoint
+    def cache_stats(self):
+        now = time.time()
+        conn = self.connect()
+        try:
+            rows = conn.execute("SELECT endpoint, status, fetched_at FROM entries").fetchall()
+        finally:
+            conn.close()
+
+        entries = Counter()
+        for endpoint, status, fetched_at in rows:
+            if status != 200:
+                entries[(endpoint, "negative")] += 1
+            elif now - fetched_at < self.ttls.get(endpoint, 0):
+                entries[(endpoint, "fresh")] += 1
+            else:
+                entries[(endpoint, "stale")] += 1
+
+        with self.lock:
+            return {"requests": dict(self.stats), "entries": {f"{endpoint}.{state}": number for (endpoint, state), number in sorted(entries.items())}}
+
+    # Seed the store from the responses in a requests_cache database (like edh_cache.sqlite),
+    # as fetched when they were cached: the stale ones are refreshed when they are used
+    def import_requests_cache(self, cache_name=LEGACY_CACHE):
+        import requests_cache
+
+        imported = 0
+        for response in requests_cache.SQLiteCache(cache_name).responses.values():
+            path = urlparse(response.url).path
+            for endpoint, prefix in [("commander", "/pages/commanders/"), ("average_deck", "/pages/average-decks/")]:
+                if path.startswith(prefix) and path.endswith(".json"):
+                    slug = path[len(prefix):-len(".json")]
+                    fetched_at = response.created_at.timestamp()
+                    if response.status_code == 200:
+                        self.write(endpoint, slug, 200, json.dumps(response.json()), fetched_at)
+                    elif response.status_code == 404:
+                        self.write(endpoint, slug, 404, None, fetched_at)
+                    imported += 1
+        return imported
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    cache = EdhCache()
+
+    if command == "stats":
+        print(json.dumps(cache.cache_stats(), indent=1))
+    elif command == "warm":
+        commanders = sys.argv[2:]
+        if not commanders:
+            from deck_store import open_deck_store
+            commanders = open_deck_store().commanders()
+        failures = cache.warm(commanders)
+        for commander, error in failures.items():
+            print(f"No EDHRec data for {commander}: {error}")
+        print(f"Warmed {len(set(commanders)) - len(failures)} commanders")
+    elif command == "purge":
+        print(f"Removed {cache.purge(expired='--expired' in sys.argv[2:])} entries")
+    elif command == "import":
+        print(f"Imported {cache.import_requests_cache(sys.argv[2] if len(sys.argv) > 2 else LEGACY_CACHE)} responses")
+    else:
+        print("Usage: python edh_cache.py [stats | warm [commander ...] | purge [--expired] | import [cache name]]")
+        sys.exit(1)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# HTTP requests to EDHRec, for the EDHRec store (edh_cache.py).
+#
+# A shared token bucket keeps us under the EDHRec rate limit, failed requests are retried
+# with exponential backoff and a request that keeps failing raises FetchError instead of
+# taking the whole app down.
+
+import os
+import threading
+import time
+
+import requests
+
+from analytics import commander_slug
+from instrumentation import count
+
+EDHREC_JSON_URL = os.environ.get("EDHREC_JSON_URL", "https://json.edhrec.com")
+
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 5
+RETRIES = 3
+BACKOFF = 0.5
+
+# Status codes worth another try, anything else (e.g. a 404 for an unknown slug) fails at once
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Block until a token is available
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class FetchError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        # HTTP status of the failed request, None for connection errors
+        self.status = status
+
+
+# Responses already in a requests_cache session don't hit EDHRec, so they don't need a token
+def is_cached(session, url):
+    cache = getattr(session, "cache", None)
+    return cache is not None and cache.contains(url=url)
+
+
+def get_json(session, url, bucket, retries=RETRIES, backoff=BACKOFF):
+    for attempt in range(retries + 1):
+        if attempt or not is_cached(session, url):
+            bucket.acquire()
+        try:
+            response = session.get(url, timeout=30)
+        except requests.RequestException as e:
+            error = FetchError(f"{url}: {e}")
+        else:
+            if response.status_code == 200:
+                return response.json()
+            error = FetchError(f"{url}: HTTP {response.status_code}", response.status_code)
+            if response.status_code not in RETRY_STATUS:
+                raise error
+
+        if attempt < retries:
+            count("edhrec.retries")
+            time.sleep(backoff * 2 ** attempt)
+
+    raise error
+
+
+def commander_page_url(commander, base_url=EDHREC_JSON_URL):
+    return f"{base_url}/pages/commanders/{commander_slug(commander)}.json"
+
+
+def average_deck_url(commander, base_url=EDHREC_JSON_URL):
+    return f"{base_url}/pages/average-decks/{commander_slug(commander)}.json"
+
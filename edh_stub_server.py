@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+# Local stand-in for json.edhrec.com that replays the responses stored in edh_cache.sqlite.
+# The cache only has commander pages, so the average deck of every commander is made up from
+# its page: the most played cards and basic lands of its colours.
+#
+# Usage:
+#   python edh_stub_server.py [port]
+#   EDHREC_JSON_URL=http://127.0.0.1:8765 streamlit run app.py
+#
+# Paths that are not in the cache answer with a 404, like an unknown commander slug would.
+
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import requests_cache
+
+COMMANDER_PATH = "/pages/commanders/"
+AVERAGE_DECK_PATH = "/pages/average-decks/"
+DECK_SIZE = 99
+BASIC_LANDS = {"W": "Plains", "U": "Island", "B": "Swamp", "R": "Mountain", "G": "Forest"}
+
+
+# An average deck like EDHRec's ("deck" lines with counts) from a commander page
+def average_deck_fixture(page):
+    colors = [color for color in page["container"]["json_dict"]["card"].get("color_identity", []) if color in BASIC_LANDS]
+    basics = min(page.get("basic", 0), DECK_SIZE)
+    cards = [card["name"] for card in page["cardlist"][:DECK_SIZE - basics]]
+    lands = [BASIC_LANDS[color] for color in colors] or ["Wastes"]
+
+    deck = [f"1 {name}" for name in cards]
+    per_land, extra = divmod(basics, len(lands))
+    for position, land in enumerate(lands):
+        copies = per_land + (position < extra)
+        if copies:
+            deck.append(f"{copies} {land}")
+    return {"deck": deck}
+
+
+# Map the URL path of every cached response to its body, with an average deck for every
+# commander page that has none
+def load_fixtures(cache_name="edh_cache"):
+    cache = requests_cache.SQLiteCache(cache_name)
+    fixtures = {}
+    for response in cache.responses.values():
+        fixtures[urlparse(response.url).path] = (response.status_code, response.content)
+
+    for path, (status, body) in list(fixtures.items()):
+        average_path = path.replace(COMMANDER_PATH, AVERAGE_DECK_PATH)
+        if status == 200 and path.startswith(COMMANDER_PATH) and average_path not in fixtures:
+            fixtures[average_path] = (200, json.dumps(average_deck_fixture(json.loads(body))).encode())
+    return fixtures
+
+
+def make_handler(fixtures):
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, body = fixtures.get(urlparse(self.path).path, (404, b'{"error": "not found"}'))
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FixtureHandler
+
+
+# Start the stub server in a background thread, returns the server and its base URL
+def start_server(fixtures=None, port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fixtures if fixtures is not None else load_fixtures()))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    fixtures = load_fixtures()
+    server, base_url = start_server(fixtures, port)
+    print(f"Serving {len(fixtures)} EDHRec fixtures at {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+
+# Plotly figures of the dashboard, memoised as serialised Plotly JSON.
+#
+# A figure is built once per (figure, commander, data version) and kept as JSON in a bounded
+# LRU, so a rerun only deserialises it. The figures that don't depend on the selected
+# commander use commander None. After the first load the figures of every commander are built
+# on a background thread, so switching commanders doesn't build a figure at all.
+#
+# plotly.express takes longer to import than the rest of plotly and is only needed to build a
+# figure, not to show a memoised one, so the builders import it when they are called.
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.colors import qualitative
+
+from card_store import type_counts
+from instrumentation import count, with_recorder
+from similarity import deck_label
+from simulate import deck_key
+
+FIGURE_CACHE_ENTRIES = int(os.environ.get("MTG_FIGURE_CACHE_ENTRIES", 512))
+
+mana_unicode = {
+    'W': '\ue600',
+    'U': '\ue601',
+    'B': '\ue602',
+    'R': '\ue603',
+    'G': '\ue604',
+    '': '\ue904'
+}
+
+# One color per color identity, keyed by its WUBRG bitmask (W=1, U=2, B=4, R=8, G=16)
+color_discrete_map = {
+    0: "#808080",  # Grey
+    1: "#fde7a2",  # White
+    2: "#85b7e5",  # Blue
+    4: "#7d76ab",  # Black
+    8: "#d28282",  # Red
+    16: "#a0c27c",  # Green
+    1 | 2: "#add8e6",  # Light Blue
+    1 | 4: "#d3d3d3",  # Light Grey
+    1 | 8: "#ffcccc",  # Light Red
+    1 | 16: "#90ee90",  # Light Green
+    2 | 4: "#666699",  # Dark Blue
+    2 | 8: "#800080",  # Purple
+    2 | 16: "#4682b4",  # Steel Blue
+    4 | 8: "#808080",  # Grey
+    4 | 16: "#006400",  # Dark Green
+    8 | 16: "#b22222",  # Firebrick
+    1 | 2 | 4: "#778899",  # Light Slate Grey
+    1 | 2 | 8: "#db7093",  # Pale Violet Red
+    1 | 2 | 16: "#3cb371",  # Medium Sea Green
+    1 | 4 | 8: "#bc8f8f",  # Rosy Brown
+    1 | 4 | 16: "#32cd32",  # Lime Green
+    1 | 8 | 16: "#ff4500",  # Orange Red
+    2 | 4 | 8: "#663399",  # Rebecca Purple
+    2 | 4 | 16: "#8a2be2",  # Blue Violet
+    2 | 8 | 16: "#c71585",  # Medium Violet Red
+    4 | 8 | 16: "#a52a2a",  # Brown
+}
+
+# Set default color for unknown combinations of colors
+default_color = "#999999"
+
+# Card type analysis
+types = ["Artifact", "Instant", "Sorcery", "Creature", "Enchantment"]
+
+
+def convert_to_unicode(char_list):
+    return "".join(mana_unicode.get(char, "") for char in char_list) or mana_unicode['']
+
+
+# Count the card types of a deck from the type bitmask of the card store
+def count_card_types(deck_data):
+    card_types = pd.DataFrame({"type": types, "type_count": type_counts(deck_data["type_mask"], types)})
+    card_types = card_types[card_types["type_count"] > 0]
+
+    return card_types.sort_values("type", ascending=False)
+
+
+# Pie chart displaying color identity distribution in all cards used in Heerenveen decks
+def identity_chart(color_identity_hveen):
+    import plotly.express as px
+
+    # Named apart from the color_identity column, which holds arrays after a report round-trip
+    labels = color_identity_hveen["color_identity"].apply(convert_to_unicode).rename("color_unicode")
+    values = color_identity_hveen["count"]
+    identity_colors = [color_discrete_map.get(mask, default_color) for mask in color_identity_hveen["color_mask"]]
+
+    chart = px.pie(color_identity_hveen, names=labels, values=values, hole=.3, color_discrete_sequence=identity_colors, hover_name=labels, custom_data=["color_identity"])
+    # Setting fonts of chart labels and percentage correctly (for mana symbol font)
+    chart.update_traces(
+        textposition="inside",
+        textinfo="label+percent",
+        texttemplate="<span style='font-family:Mana'>%{label}</span><br><span style='font-family:Courier New'>%{percent}</span>",
+        hovertemplate="<b style='font-family:Mana'>%{label}:</b> %{value} cards<extra></extra>"
+    )
+
+    chart.update_layout(
+        margin=dict(l=20, r=20, b=0, t=20),
+        showlegend=False,
+        font_size=18,
+        title={
+            "text": "",
+            "xanchor": "left",
+            "x": 0
+        },
+        font_family="Source Sans Pro"
+    )
+    return chart
+
+
+# Land vs mana rock analysis
+def rock_ratio_chart(rock_ratio):
+    import plotly.express as px
+
+    chart = px.bar(rock_ratio, x="commander", y=["Land Count", "Mana Rock Count"], title=None, color_discrete_sequence=qualitative.Plotly).update_layout(
+        xaxis_title="Deck", yaxis_title="Number of cards", showlegend=False
+    )
+    chart["data"][0].hovertemplate = "Land Count: %{y}<extra></extra>"
+    chart["data"][1].hovertemplate = "Mana Rock Count: %{y}<extra></extra>"
+    return chart
+
+
+# Analysis of rarity per deck
+def rarity_plot(rarities_df):
+    import plotly.express as px
+
+    chart = px.scatter(rarities_df, x='rarity', y='counts', color='commander', title=None, height=600)
+
+    chart.update_layout(
+        xaxis=dict(
+            tickmode="array",
+            tickvals=[0, 1, 2, 3, 4],
+            ticktext=["common", "uncommon", "rare", "mythic", "special"]
+        ),
+        showlegend=False
+    )
+
+    chart.update_traces(
+        marker=dict(size=10)
+    )
+    return chart
+
+
+# Card types of the decks of a commander against its EDHRec average deck
+def radar_chart(commander, deck_data, average_deck):
+    avg_card_types = count_card_types(average_deck)
+    card_types = count_card_types(deck_data)
+
+    chart = go.Figure()
+
+    chart.add_trace(go.Scatterpolar(
+        r=card_types["type_count"],
+        theta=card_types["type"],
+        fill="toself",
+        fillcolor=qualitative.Plotly[0],
+        marker_color=qualitative.Plotly[0],
+        opacity=0.8,
+        name=commander
+    ))
+
+    chart.add_trace(go.Scatterpolar(
+        r=avg_card_types["type_count"],
+        theta=avg_card_types["type"],
+        line=dict(
+            dash="dot"
+        ),
+        marker_color=qualitative.Plotly[1],
+        opacity=0.8,
+        name="Average deck"
+    ))
+
+    chart.update_layout(
+        polar=dict(
+            radialaxis=dict(
+                visible=True
+            )
+        ),
+        showlegend=True,
+        title="",
+        margin_t=10,
+        margin_l=50,
+        margin_b=0,
+        height=400
+    )
+    return chart
+
+
+# Mana curve of a commander against the average curve over all decks
+def mana_curve_chart(commander, long_manacurves, average_mana_curve):
+    import plotly.express as px
+
+    chart = px.histogram(long_manacurves[long_manacurves["Commander"] == commander], x="Mana value", y="Count", color="Commander", color_discrete_sequence=qualitative.Plotly).update_layout(
+        showlegend=False,
+        xaxis=dict(
+            tickmode="array",
+            tickvals=[i + 0.5 for i in range(0, 12)],
+            ticktext=[str(i) for i in range(0, 12)],
+            dtick=1
+        ),
+        bargap=0.1
+    )
+    chart.update_traces(
+        xbins=dict(
+            start=0,
+            end=12,
+            size=1
+        )
+    )
+
+    curve_x_centered = [x + 0.5 for x in average_mana_curve.keys()]
+    chart.add_trace(go.Scatter(x=curve_x_centered, y=list(average_mana_curve.values()), mode="lines", name="Average Mana Curve", line=dict(color="cornsilk")))
+    return chart
+
+
+# Chance of each number of lands and mana rocks in the opening hand (simulate.py)
+def opening_hand_chart(simulation):
+    import plotly.express as px
+
+    opening_hands = pd.DataFrame({
+        "Cards in opening hand": list(range(len(simulation["lands"]))) * 2,
+        "Chance": simulation["lands"] + simulation["rocks"],
+        "Type": ["Lands"] * len(simulation["lands"]) + ["Mana rocks"] * len(simulation["rocks"]),
+    })
+    chart = px.bar(opening_hands, x="Cards in opening hand", y="Chance", color="Type", barmode="group")
+    chart.update_layout(yaxis_tickformat=".0%", legend_title_text="")
+    return chart
+
+
+# Jaccard similarity of a deck and the decks most similar to it
+def similarity_heatmap(similarity_index, deck, k=8):
+    import plotly.express as px
+
+    similarity_matrix = similarity_index.pairwise([deck] + similarity_index.most_similar(deck, k=k)["deck"].tolist())
+    return px.imshow(similarity_matrix, zmin=0, zmax=1, color_continuous_scale="Blues", labels=dict(color="Jaccard"))
+
+
+# Builders of the figures of every commander from the meta tables, the cards of all local decks
+# and the EDHRec average decks: figure -> function(commander). With the simulations of the
+# latest decks (by deck key) and the similarity index their figures are built too, a builder
+# returns None for a figure a commander doesn't have.
+def commander_figures(meta, hveen_deckdata, average_df, simulations=None, similarity_index=None):
+    decks = dict(tuple(hveen_deckdata.groupby("commander", observed=True)))
+    average_decks = dict(tuple(average_df.groupby("commander", observed=True)))
+    empty = hveen_deckdata.iloc[:0]
+
+    def latest_deck(commander):
+        deck = decks.get(commander, empty)
+        return deck[deck["deck_id"] == deck["deck_id"].max()]
+
+    def opening_hand(commander):
+        simulation = simulations.get(deck_key(latest_deck(commander)))
+        return opening_hand_chart(simulation) if simulation is not None else None
+
+    def similarity(commander):
+        deck = latest_deck(commander)
+        return similarity_heatmap(similarity_index, deck_label(commander, deck["deck_id"].max())) if len(deck) else None
+
+    builders = {
+        "radar": lambda commander: radar_chart(commander, decks.get(commander, empty), average_decks.get(commander, average_df.iloc[:0])),
+        "mana_curve": lambda commander: mana_curve_chart(commander, meta["long_manacurves"], meta["average_mana_curve"]),
+    }
+    if simulations is not None:
+        builders["opening_hand"] = opening_hand
+    if similarity_index is not None:
+        builders["similarity"] = similarity
+    return builders
+
+
+class FigureCache:
+    def __init__(self, max_entries=FIGURE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="figure-prebuild")
+
+    def lookup(self, key):
+        with self.lock:
+            figure_json = self.entries.get(key)
+            if figure_json is not None:
+                self.entries.move_to_end(key)
+            return figure_json
+
+    # Store a figure, evicting the least recently used ones. A prebuild doesn't evict: it
+    # stops when the cache is full (returns False) rather than push out what is being shown.
+    def store(self, key, figure_json, evict=True):
+        with self.lock:
+            if key not in self.entries and len(self.entries) >= self.max_entries and not evict:
+                return False
+            self.entries[key] = figure_json
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                count("figures.evicted")
+        return True
+
+    # The figure of a (figure, commander, data version), built with build() when it isn't cached
+    def figure(self, name, commander, version, build):
+        key = (name, commander, version)
+        figure_json = self.lookup(key)
+        if figure_json is None:
+            count("figures.misses")
+            figure_json = build().to_json()
+            self.store(key, figure_json)
+        else:
+            count("figures.hits")
+        return pio.from_json(figure_json)
+
+    # Build the figures of the commanders that aren't cached yet. Returns the number built.
+    def prebuild(self, version, commanders, builders):
+        built = 0
+        for commander, (name, build) in ((commander, builder) for commander in commanders for builder in builders.items()):
+            key = (name, commander, version)
+            if self.lookup(key) is not None:
+                continue
+            figure = build(commander)
+            if figure is None:
+                continue
+            if not self.store(key, figure.to_json(), evict=False):
+                break
+            built += 1
+        count("figures.prebuilt", built)
+        return built
+
+    # Prebuild on the background thread, a render doesn't wait for it. The builders are made
+    # there too (load_builders()), as loading their data can take a while itself.
+    def prebuild_async(self, version, commanders, load_builders):
+        commanders = list(commanders)
+        return self.background.submit(with_recorder(lambda: self.prebuild(version, commanders, load_builders())))
+
+    # Figures of a data version as {(figure, commander): JSON}, to persist them (snapshot.py)
+    def export(self, version):
+        with self.lock:
+            return {(name, commander): figure_json for (name, commander, key_version), figure_json in self.entries.items() if key_version == version}
+
+    # Add exported figures under a data version, as far as they fit
+    def seed(self, version, figures):
+        for (name, commander), figure_json in figures.items():
+            if not self.store((name, commander, version), figure_json, evict=False):
+                break
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+# Local cache of card images.
+#
+# Images are downloaded from a bounded, rate-limited thread pool and stored content
+# addressed (by SHA-256 of the image) next to a copy resized to the width the dashboard
+# shows them at. HTTP cache headers are honoured: an image is revalidated with its ETag or
+# Last-Modified date once its max-age is over. The cache is capped in size and evicts the
+# least recently used images first. Any base URL works, so it can be tested against a
+# local file server (python -m http.server).
+#
+# Usage:
+#   python image_cache.py prefetch     # images of every card in the deck store
+#   python image_cache.py stats
+#   python image_cache.py evict
+
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from PIL import Image
+
+from edh_fetch import TokenBucket
+from instrumentation import count, with_recorder
+
+IMAGE_CACHE_DIR = os.environ.get("MTG_IMAGE_CACHE", "image_cache")
+MAX_BYTES = int(os.environ.get("MTG_IMAGE_CACHE_BYTES", 512 * 2 ** 20))
+
+DISPLAY_WIDTH = 130
+# Scryfall's "small" image is 146 pixels wide, enough for widths up to that
+SMALL_WIDTH = 146
+
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 10
+# Used when the response has no max-age
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+# A failed download isn't retried on every render
+FAILURE_BACKOFF = 300
+
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    digest TEXT NOT NULL REFERENCES blobs(digest),
+    etag TEXT,
+    last_modified TEXT,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_last_used_idx ON blobs(last_used);
+CREATE INDEX IF NOT EXISTS urls_digest_idx ON urls(digest);
+"""
+
+
+# The image to download for a card: the small one when it is wide enough for the display
+def source_url(image_uris, width=DISPLAY_WIDTH):
+    if width <= SMALL_WIDTH and "small" in image_uris:
+        return image_uris["small"]
+    return image_uris.get("normal") or image_uris.get("small")
+
+
+def max_age(response):
+    cache_control = response.headers.get("Cache-Control", "")
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0
+    match = MAX_AGE_PATTERN.search(cache_control)
+    return int(match.group(1)) if match else DEFAULT_MAX_AGE
+
+
+def resize(content, width):
+    image = Image.open(io.BytesIO(content))
+    if image.width > width:
+        image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+
+    output = io.BytesIO()
+    image.convert("RGB").save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+
+class ImageCache:
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR, max_bytes=MAX_BYTES, width=DISPLAY_WIDTH, session=None,
+                 max_workers=MAX_WORKERS, rate=REQUESTS_PER_SECOND):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.width = width
+        self.session = session or requests.Session()
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(rate)
+        # Images a render asked for get their own pool and bucket, so they don't queue behind a prefetch
+        self.on_demand_bucket = TokenBucket(rate)
+
+        self.lock = threading.Lock()
+        self.failed = {}
+        self.pending = set()
+        self.background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-prefetch")
+        self.on_demand = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-fetch")
+
+        os.makedirs(os.path.join(cache_dir, "blobs"), exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def connect(self):
+        return sqlite3.connect(os.path.join(self.cache_dir, "index.sqlite"), timeout=30)
+
+    # Original and resized image of a digest, in a directory per first two hex digits
+    def blob_path(self, digest, width=None):
+        name = digest if width is None else f"{digest}-{width}.jpg"
+        return os.path.join(self.cache_dir, "blobs", digest[:2], name)
+
+    def write_file(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as file:
+            file.write(content)
+        os.replace(path + ".tmp", path)
+
+    def lookup(self, url):
+        conn = self.connect()
+        try:
+            return conn.execute("SELECT digest, etag, last_modified, expires_at FROM urls WHERE url = ?", (url,)).fetchone()
+        finally:
+            conn.close()
+
+    # Download (or revalidate) one image, returns its digest
+    def fetch(self, url, bucket=None):
+        row = self.lookup(url)
+        headers = {}
+        if row is not None and os.path.exists(self.blob_path(row[0], self.width)):
+            if row[1]:
+                headers["If-None-Match"] = row[1]
+            if row[2]:
+                headers["If-Modified-Since"] = row[2]
+
+        (bucket or self.bucket).acquire()
+        response = self.session.get(url, headers=headers, timeout=30)
+        count("images.requests")
+
+        if response.status_code == 304 and row is not None:
+            count("images.not_modified")
+            digest = row[0]
+        elif response.status_code == 200:
+            count("images.bytes", len(response.content))
+            digest = hashlib.sha256(response.content).hexdigest()
+            if not os.path.exists(self.blob_path(digest, self.width)):
+                self.write_file(self.blob_path(digest), response.content)
+                self.write_file(self.blob_path(digest, self.width), resize(response.content, self.width))
+        else:
+            raise requests.HTTPError(f"{url}: HTTP {response.status_code}", response=response)
+
+        size = os.path.getsize(self.blob_path(digest)) + os.path.getsize(self.blob_path(digest, self.width))
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO blobs (digest, size, last_used) VALUES (?, ?, ?) ON CONFLICT(digest) DO UPDATE SET size = excluded.size",
+                    (digest, size, time.time())
+                )
+                conn.execute(
+                    "INSERT INTO urls (url, digest, etag, last_modified, expires_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(url) DO UPDATE SET digest = excluded.digest, etag = excluded.etag, "
+                    "last_modified = excluded.last_modified, expires_at = excluded.expires_at",
+                    (url, digest, response.headers.get("ETag", row[1] if row else None),
+                     response.headers.get("Last-Modified", row[2] if row else None), time.time() + max_age(response))
+                )
+        finally:
+            conn.close()
+        return digest
+
+    def try_fetch(self, url, bucket=None):
+        with self.lock:
+            if time.time() - self.failed.get(url, 0) < FAILURE_BACKOFF:
+                return None
+        try:
+            return self.fetch(url, bucket)
+        except (requests.RequestException, OSError):
+            count("images.failures")
+            with self.lock:
+                self.failed[url] = time.time()
+            return None
+
+    def fetch_on_demand(self, url):
+        try:
+            self.try_fetch(url, self.on_demand_bucket)
+        finally:
+            with self.lock:
+                self.pending.discard(url)
+
+    # Local paths of the resized images, in order. Never waits for the network: a missing
+    # image is returned as its URL and downloaded in the background for the next render, an
+    # expired one is served and revalidated in the background.
+    def images(self, urls):
+        paths, digests, expired = [], [], []
+        now = time.time()
+        for url in urls:
+            row = self.lookup(url)
+            if row is not None and os.path.exists(self.blob_path(row[0], self.width)):
+                count("images.hits")
+                digest = row[0]
+                if row[3] < now:
+                    expired.append(url)
+            else:
+                count("images.misses")
+                digest = None
+                with self.lock:
+                    queue = url not in self.pending
+                    self.pending.add(url)
+                if queue:
+                    self.on_demand.submit(with_recorder(self.fetch_on_demand), url)
+
+            paths.append(self.blob_path(digest, self.width) if digest else url)
+            if digest:
+                digests.append(digest)
+
+        self.touch(digests)
+        if expired:
+            self.background.submit(with_recorder(self.prefetch), expired, True)
+        return paths
+
+    def touch(self, digests):
+        if not digests:
+            return
+        conn = self.connect()
+        try:
+            with conn:
+                now = time.time()
+                conn.executemany("UPDATE blobs SET last_used = ? WHERE digest = ?", ((now, digest) for digest in digests))
+        finally:
+            conn.close()
+
+    # Download every image that isn't cached yet (or has expired, with revalidate) from a
+    # bounded pool, then evict down to the size cap. Returns the number of failures.
+    def prefetch(self, urls, revalidate=False):
+        now = time.time()
+        todo = []
+        for url in dict.fromkeys(urls):
+            row = self.lookup(url)
+            if row is None or not os.path.exists(self.blob_path(row[0], self.width)) or (revalidate and row[3] < now):
+                todo.append(url)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            failures = sum(digest is None for digest in executor.map(with_recorder(self.try_fetch), todo))
+
+        self.evict()
+        return failures
+
+    # Prefetch on the background thread, images() doesn't wait for it
+    def prefetch_async(self, urls):
+        return self.background.submit(with_recorder(self.prefetch), list(urls))
+
+    # Remove the least recently used images until the cache fits in max_bytes
+    def evict(self):
+        conn = self.connect()
+        try:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+
+            removed = []
+            for digest, size in conn.execute("SELECT digest, size FROM blobs ORDER BY last_used"):
+                if total <= self.max_bytes:
+                    break
+                removed.append(digest)
+                total -= size
+
+            with conn:
+                conn.executemany("DELETE FROM urls WHERE digest = ?", ((digest,) for digest in removed))
+                conn.executemany("DELETE FROM blobs WHERE digest = ?", ((digest,) for digest in removed))
+        finally:
+            conn.close()
+
+        for digest in removed:
+            for path in [self.blob_path(digest), self.blob_path(digest, self.width)]:
+                if os.path.exists(path):
+                    os.remove(path)
+        count("images.evicted", len(removed))
+        return len(removed)
+
+    def stats(self):
+        conn = self.connect()
+        try:
+            images, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            urls = conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+        finally:
+            conn.close()
+        return {"images": images, "urls": urls, "bytes": size, "max_bytes": self.max_bytes}
+
+
+# Image URLs of all cards in a list of card names, one per distinct card
+def card_image_urls(card_store, names, width=DISPLAY_WIDTH):
+    rows = card_store.index.positions(names)
+    urls = (source_url(uris, width) for uris in card_store.image_uris(np.unique(rows[rows >= 0])))
+    return [url for url in urls if url]
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    cache = ImageCache()
+
+    if command == "prefetch":
+        from card_store import open_card_store
+        from deck_store import open_deck_store
+
+        names = [name for _, name, _ in open_deck_store().deck_cards()[1]]
+        urls = card_image_urls(open_card_store(), names)
+        failures = cache.prefetch(urls)
+        print(f"Prefetched {len(urls) - failures} of {len(urls)} images")
+    elif command == "stats":
+        print(cache.stats())
+    elif command == "evict":
+        print(f"Evicted {cache.evict()} images")
+    else:
+        print("Usage: python image_cache.py [prefetch | stats | evict]")
+        sys.exit(1)
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+# Lightweight instrumentation: named timing spans around the pipeline stages and counters
+# for HTTP calls, cache hits and misses and bytes fetched.
+#
+# Every Streamlit run records into its own Recorder (start_run / finish_run), kept in a context
+# variable of the script thread, so sessions running at once don't share one. Executor tasks
+# record into the run that submitted them (with_recorder). The app shows
+# the result in the "Performance" sidebar panel and, when MTG_METRICS_FILE is set, appends it
+# to that file as JSON lines.
+#
+#   MTG_INSTRUMENT=0                    turn spans and counters off (a no-op recorder is used)
+#   MTG_PROFILE=cprofile|pyinstrument   profile every run as well
+#   MTG_METRICS_FILE=metrics.jsonl      append every run to this file
+
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+ENABLED = os.environ.get("MTG_INSTRUMENT", "1") != "0"
+PROFILER = os.environ.get("MTG_PROFILE", "")
+METRICS_FILE = os.environ.get("MTG_METRICS_FILE", "")
+
+PROFILE_LINES = 30
+
+
+class Span:
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.depth = self.recorder.enter()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.add_span(self.name, self.depth, self.start, time.perf_counter())
+        return False
+
+
+class Recorder:
+    def __init__(self):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.counters = Counter()
+        self.profile = None
+        self.finished = False
+        # Spans can end in fetch threads, the depth is tracked per thread
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def span(self, name):
+        return Span(self, name)
+
+    def enter(self):
+        depth = getattr(self.local, "depth", 0)
+        self.local.depth = depth + 1
+        return depth
+
+    def add_span(self, name, depth, start, end):
+        self.local.depth = depth
+        with self.lock:
+            self.spans.append({"name": name, "depth": depth, "start": start - self.origin, "seconds": end - start})
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "run_id": self.run_id,
+                "started_at": self.started_at,
+                "spans": sorted(self.spans, key=lambda span: span["start"]),
+                "counters": dict(self.counters),
+                "profile": self.profile,
+            }
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+# Used when instrumentation is off, so a span costs one attribute lookup and a method call
+class NullRecorder:
+    run_id = None
+    finished = False
+    null_span = NullSpan()
+
+    def span(self, name):
+        return self.null_span
+
+    def count(self, name, value=1):
+        pass
+
+    def snapshot(self):
+        return None
+
+
+NULL_RECORDER = NullRecorder()
+
+# The recorder of the run in this thread, threads without one record nothing
+recorder_var = contextvars.ContextVar("recorder", default=NULL_RECORDER)
+# The profiler of the run in this thread
+local = threading.local()
+
+
+def current():
+    return recorder_var.get()
+
+
+# The function with the recorder of the calling thread, for tasks of an executor (its threads
+# don't inherit it). Every call runs in a copy of the context, so calls can overlap.
+def with_recorder(function):
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(function, *args, **kwargs)
+
+
+def span(name):
+    return current().span(name)
+
+
+def count(name, value=1):
+    current().count(name, value)
+
+
+class Profiler:
+    def __init__(self, kind):
+        self.kind = kind
+        if kind == "pyinstrument":
+            from pyinstrument import Profiler as PyinstrumentProfiler
+            self.profiler = PyinstrumentProfiler()
+        else:
+            self.profiler = cProfile.Profile()
+
+    def start(self):
+        if self.kind == "pyinstrument":
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.kind == "pyinstrument":
+            self.profiler.stop()
+            return self.profiler.output_text()
+
+        self.profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(self.profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        return output.getvalue()
+
+
+# Start recording a run in this thread, returns its recorder
+def start_run(enabled=ENABLED, profiler=PROFILER):
+    recorder = Recorder() if enabled else NULL_RECORDER
+    recorder_var.set(recorder)
+
+    # A run that raised never reached finish_run, don't leave its profiler running
+    if getattr(local, "profiler", None) is not None:
+        local.profiler.stop()
+    local.profiler = None
+    if enabled and profiler:
+        try:
+            local.profiler = Profiler(profiler)
+            local.profiler.start()
+        except (ImportError, ValueError) as e:
+            # pyinstrument is optional, and only one cProfile can run at a time
+            recorder.count("profiler.unavailable")
+            recorder.profile = f"Profiler {profiler} unavailable: {e}"
+            local.profiler = None
+
+    return recorder
+
+
+# Stop recording, returns the snapshot of the run (None when instrumentation is off)
+def finish_run(recorder, metrics_file=METRICS_FILE):
+    profiler = getattr(local, "profiler", None)
+    if profiler is not None:
+        recorder.profile = profiler.stop()
+        local.profiler = None
+
+    if recorder is not NULL_RECORDER:
+        recorder.finished = True
+    snapshot = recorder.snapshot()
+    if snapshot is not None and metrics_file:
+        with open(metrics_file, "a") as file:
+            file.write(to_jsonl(snapshot))
+    return snapshot
+
+
+# One JSON object per span and per counter, tagged with the run
+def to_jsonl(snapshot):
+    lines = []
+    for entry in snapshot["spans"]:
+        lines.append({"run_id": snapshot["run_id"], "started_at": snapshot["started_at"], "type": "span", **entry})
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append({"run_id": snapshot["run_id"], "started_at": snapshot["started_at"], "type": "counter", "name": name, "value": value})
+
+    return "".join(json.dumps(line) + "\n" for line in lines)
+
+
+# Count HTTP calls, requests_cache hits and misses and bytes fetched over the network for a
+# session. Without a recorder the counts go to the recorder of the thread making the request,
+# for sessions that outlive a run.
+def instrument_session(session, recorder=None, prefix="http"):
+    if recorder is NULL_RECORDER:
+        return session
+    counter = recorder.count if recorder is not None else count
+
+    def on_response(response, *args, **kwargs):
+        # requests_cache can dispatch the hook twice for a response it just stored
+        if getattr(response, "instrumented", False):
+            return response
+        response.instrumented = True
+
+        counter(f"{prefix}.requests")
+        if getattr(response, "from_cache", False):
+            counter(f"{prefix}.cache_hits")
+        else:
+            counter(f"{prefix}.cache_misses")
+            counter(f"{prefix}.bytes", len(response.content))
+        return response
+
+    session.hooks["response"].append(on_response)
+    return session
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# Command line entry point for the batch report, no Streamlit needed.
+#
+# Usage:
+#   python mtg_meta.py build                                  # decks from the deck store
+#   python mtg_meta.py build --community Leeuwarden           # decks of another community
+#   python mtg_meta.py build --decks database_mtg.json --out report/
+#   python mtg_meta.py info --out report/
+
+import argparse
+import sys
+
+from analytics import load_decks
+from card_store import open_card_store
+from communities import DEFAULT_COMMUNITY, open_community
+from deck_store import open_deck_store
+from edh_cache import EdhCache
+from report import REPORT_DIR, build_report, load_deck_file, read_manifest, write_report
+
+
+def build(args):
+    card_store = open_card_store()
+
+    if args.decks and args.decks.endswith(".json"):
+        hveen = load_deck_file(args.decks)
+        deck_version = community = deck_store_id = None
+    else:
+        deck_store = open_deck_store(args.decks) if args.decks else open_community(args.community)
+        community = None if args.decks else args.community
+        hveen = load_decks(deck_store)
+        deck_version = deck_store.version()
+        deck_store_id = deck_store.store_id
+
+    if hveen.empty:
+        print("No decks to report on")
+        sys.exit(1)
+
+    edh_data, edh_failures = EdhCache().fetch_commanders(hveen["commander"].tolist())
+    for commander, error in edh_failures.items():
+        print(f"No EDHRec data for {commander}: {error}", file=sys.stderr)
+
+    tables, manifest = build_report(hveen, card_store.index, edh_data, edh_failures, card_store.version, deck_version, community, deck_store_id)
+    write_report(tables, manifest, args.out)
+    print(f"Report of {manifest['deck_count']} decks written to {args.out}")
+
+
+def info(args):
+    manifest = read_manifest(args.out)
+    if manifest is None:
+        print(f"No report in {args.out}")
+        sys.exit(1)
+
+    print(f"Report of {manifest['deck_count']} decks and {len(manifest['commanders'])} commanders, built at {manifest['built_at']}")
+    if manifest.get("community"):
+        print(f"Community {manifest['community']}")
+    print(f"Card store version {manifest['card_version']}, deck store version {manifest['deck_version']}")
+    if manifest["edh_failures"]:
+        print("No EDHRec data for " + ", ".join(manifest["edh_failures"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="mtg_meta", description="Build the Magic the Gathering meta report")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="run the full pipeline and write the report")
+    build_parser.add_argument("--decks", help="legacy JSON deck file or SQLite deck store (default: the deck store of the community)")
+    build_parser.add_argument("--community", default=DEFAULT_COMMUNITY, help="community of the decks (default: %(default)s)")
+    build_parser.add_argument("--out", default=REPORT_DIR, help="report directory")
+    build_parser.set_defaults(run=build)
+
+    info_parser = commands.add_parser("info", help="describe an existing report")
+    info_parser.add_argument("--out", default=REPORT_DIR, help="report directory")
+    info_parser.set_defaults(run=info)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# Batch build of everything the dashboard shows about the meta.
+#
+# The whole pipeline runs once without Streamlit: the decks are joined with the card store,
+# compared with EDHRec and summarised, and the tables are written to a report directory as
+# Parquet files next to a report.json manifest. The app loads the report when there is one,
+# so a cron job does the work once for every dashboard user (see mtg_meta.py).
+
+import json
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from analytics import build_edh_tables, build_local_analytics, build_synergy_gaps, high_synergy_cards
+from deck_store import expand_counts, split_count
+from similarity import SimilarityIndex, collect_decks
+
+REPORT_DIR = os.environ.get("MTG_REPORT_DIR", "report")
+MANIFEST = "report.json"
+
+META_TABLES = ["long_manacurves", "card_frequency", "color_identity_hveen", "artists_hveen", "rock_ratio", "rarities_df"]
+EDH_TABLES = ["edh_deckdata", "average_df"]
+TABLES = META_TABLES + EDH_TABLES + ["local_vs_global"]
+
+
+# Decks of a legacy JSON file as a dataframe with one row per deck, like analytics.load_decks
+def load_deck_file(path):
+    with open(path, "r") as file:
+        decks = json.load(file)
+
+    records = [
+        [deck_id, deck["player"], deck["commander"], expand_counts(split_count(card) for card in deck["cards"])]
+        for deck_id, deck in enumerate(decks, start=1)
+    ]
+    return pd.DataFrame(records, columns=["deck_id", "player", "commander", "cards"])
+
+
+# Run the full pipeline. edh_data and edh_failures are the results of EdhCache.fetch_commanders.
+# Returns the tables and the manifest of the report.
+def build_report(hveen, card_index, edh_data, edh_failures, card_version=None, deck_version=None, community=None, deck_store_id=None):
+    analytics = build_local_analytics(hveen, card_index)
+
+    commanders = list(dict.fromkeys(hveen["commander"]))
+    fetched = [commander for commander in commanders if commander in edh_data]
+    _, edh_deckdata, average_df = build_edh_tables(fetched, card_index, lambda commander: edh_data[commander]["page"], lambda commander: edh_data[commander]["average_deck"])
+
+    high_synergy = {commander: high_synergy_cards(edh_data[commander]["page"]) for commander in fetched}
+    similarity_index = SimilarityIndex(collect_decks(hveen, edh_deckdata, card_index))
+
+    tables = {name: analytics[name] for name in META_TABLES}
+    tables["edh_deckdata"] = edh_deckdata
+    tables["average_df"] = average_df
+    tables["local_vs_global"] = similarity_index.local_vs_global()
+
+    manifest = {
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        "card_version": card_version,
+        "deck_version": deck_version,
+        "deck_store_id": deck_store_id,
+        "community": community,
+        "deck_count": len(hveen),
+        "commanders": commanders,
+        "average_mana_curve": analytics["average_mana_curve"],
+        "high_synergy": high_synergy,
+        "synergy_gaps": build_synergy_gaps(high_synergy, average_df),
+        "edh_failures": edh_failures,
+        "tables": [f"{name}.parquet" for name in TABLES],
+    }
+
+    return tables, manifest
+
+
+# Write the tables first and the manifest last, so a reader never sees half a report
+def write_report(tables, manifest, report_dir=REPORT_DIR):
+    os.makedirs(report_dir, exist_ok=True)
+    for name, table in tables.items():
+        table.reset_index(drop=True).to_parquet(os.path.join(report_dir, f"{name}.parquet"), index=False)
+
+    path = os.path.join(report_dir, MANIFEST)
+    with open(path + ".tmp", "w") as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def read_manifest(report_dir=REPORT_DIR):
+    path = os.path.join(report_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as file:
+        manifest = json.load(file)
+    # JSON turns the mana values into strings
+    manifest["average_mana_curve"] = {int(key): value for key, value in manifest["average_mana_curve"].items()}
+    return manifest
+
+
+# The tables and the manifest of a report, or None when there is no report
+def read_report(report_dir=REPORT_DIR):
+    manifest = read_manifest(report_dir)
+    if manifest is None:
+        return None
+
+    tables = {name: pd.read_parquet(os.path.join(report_dir, f"{name}.parquet")) for name in TABLES}
+    return tables, manifest
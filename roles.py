@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# Card roles (land, mana rock, ramp, removal, ...) tagged from the type line and oracle text.
+#
+# Every role is a rule of card types and an oracle text pattern, evaluated once over the
+# whole card store with vectorised string passes and stored as a bitmask column (role_mask).
+# The analyses only test bits, so adding a role is adding a rule here.
+#
+# Usage:
+#   python roles.py                 # number of cards per role in the card store
+#   python roles.py <card> ...      # roles of the given cards
+
+import re
+import sys
+
+import numpy as np
+
+# An activated ability that adds mana, e.g. "{T}: Add {C}{C}." or "{T}, Sacrifice Lotus Petal: Add
+# one mana of any color." Abilities in quotes are granted to other permanents and don't count.
+MANA_ABILITY = r'(?m)^[^"\n:]*:\s+Add\b'
+
+RAMP = (
+    r"(?i)search your library for [^.]*?\b(?:basic )?(?:land|forest|plains|island|swamp|mountain)s? cards?\b[^.]*?onto the battlefield"
+    r"|put (?:a|up to \w+) land cards? from your hand onto the battlefield"
+)
+
+CARD_DRAW = r"(?i)\bdraws? (?:a|an|one|two|three|four|five|six|seven|x|that many|\d+) (?:additional )?cards?\b|\bdraws? cards equal to\b"
+
+REMOVAL = (
+    r"(?i)\b(?:destroy|exile) (?:up to \w+ )?(?:another )?target (?:[\w-]+ )*?(?:creature|artifact|enchantment|planeswalker|permanent|battle)s?\b"
+    r"|\bdeals [^.]*?damage[^.]*? to (?:any target|target (?:[\w-]+ )*?(?:creature|planeswalker))"
+    r"|\breturn (?:up to \w+ )?target [^.]*?(?:creature|permanent)[^.]*? to (?:its|their) owner(?:'s|s') hands?"
+)
+
+BOARD_WIPE = (
+    r"(?i)\b(?:destroy|exile) all (?:other )?(?:[\w-]+ )*?(?:creatures|permanents|artifacts|enchantments|planeswalkers)\b"
+    r"|\bdeals \w+ damage to each (?:other )?creature\b"
+    r"|\ball (?:other )?creatures get -\w+/-\w+"
+    r"|\breturn all (?:[\w-]+ )*?(?:creatures|permanents) to their owners' hands"
+)
+
+# Role -> (card types of which it needs one, card types it can't have, oracle text pattern)
+ROLE_RULES = {
+    "land": (["Land"], [], None),
+    "mana_rock": (["Artifact"], ["Land"], MANA_ABILITY),
+    "mana_dork": (["Creature"], ["Land"], MANA_ABILITY),
+    "ramp": (None, ["Land"], RAMP),
+    "card_draw": (None, [], CARD_DRAW),
+    "removal": (None, ["Land"], REMOVAL),
+    "board_wipe": (None, ["Land"], BOARD_WIPE),
+}
+
+ROLE_BITS = {role: 1 << bit for bit, role in enumerate(ROLE_RULES)}
+ROLE_DTYPE = np.uint16
+
+
+def type_pattern(types):
+    return re.compile(r"\b(?:" + "|".join(types) + r")\b")
+
+
+# Rules with their patterns compiled once per process
+COMPILED_RULES = {
+    role: (
+        type_pattern(types) if types else None,
+        type_pattern(excluded) if excluded else None,
+        re.compile(pattern) if pattern else None,
+    )
+    for role, (types, excluded, pattern) in ROLE_RULES.items()
+}
+
+
+# Role bitmask for every card, from its type line and oracle text (a frame without oracle
+# text only gets the roles that need no text)
+def tag_roles(cards):
+    type_line = cards["type_line"].astype(object).fillna("")
+    oracle_text = cards["oracle_text"].fillna("") if "oracle_text" in cards.columns else None
+
+    masks = np.zeros(len(cards), dtype=ROLE_DTYPE)
+    for role, (types, excluded, pattern) in COMPILED_RULES.items():
+        if pattern is not None and oracle_text is None:
+            continue
+
+        tagged = np.ones(len(cards), dtype=bool)
+        if types is not None:
+            tagged &= type_line.str.contains(types).to_numpy(dtype=bool)
+        if excluded is not None:
+            tagged &= ~type_line.str.contains(excluded).to_numpy(dtype=bool)
+        if pattern is not None:
+            tagged &= oracle_text.str.contains(pattern).to_numpy(dtype=bool)
+
+        masks[tagged] |= ROLE_BITS[role]
+    return masks
+
+
+# Whether each card has a role, read from the role_mask column
+def has_role(cards, role):
+    return (cards["role_mask"].to_numpy() & ROLE_BITS[role]) != 0
+
+
+# Number of cards with each of the given roles
+def role_counts(role_masks, roles):
+    bits = np.array([ROLE_BITS[role] for role in roles], dtype=ROLE_DTYPE)
+    return ((np.asarray(role_masks, dtype=ROLE_DTYPE)[:, None] & bits) != 0).sum(axis=0)
+
+
+def role_names(mask):
+    return [role for role, bit in ROLE_BITS.items() if mask & bit]
+
+
+if __name__ == "__main__":
+    from card_store import open_card_store
+
+    card_store = open_card_store()
+    cards = card_store.frame
+
+    if len(sys.argv) > 1:
+        for name in sys.argv[1:]:
+            row = card_store.index.position(name)
+            print(f"{name}: " + (", ".join(role_names(cards["role_mask"].iat[row])) or "-" if row >= 0 else "not in the card store"))
+    else:
+        for role, number in zip(ROLE_BITS, role_counts(cards["role_mask"], ROLE_BITS)):
+            print(f"{role:<12} {number:>8}")
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+# Deck similarity between the community decks and the EDHRec average decks.
+#
+# Decks are rows of a sparse deck x card incidence matrix (SciPy CSR), so memory grows with
+# the number of cards in the decks and not with decks x cards. Every deck also gets a MinHash
+# signature; decks whose signatures agree on a whole band land in the same LSH bucket, and
+# only those candidates are compared exactly, so a nearest-neighbour query doesn't touch
+# every deck.
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+NUM_PERM = 120
+# 40 bands of 3 rows: decks sharing about 30% of their cards or more are likely candidates
+BANDS = 40
+
+PRIME = (1 << 31) - 1
+
+# Decks are reduced in chunks to bound the size of the (card copies x permutations) block
+CHUNK_SIZE = 512
+
+LOCAL = "local"
+EDHREC = "edhrec"
+
+
+# Label of a local deck in the index
+def deck_label(commander, deck_id):
+    return f"{commander} #{deck_id}"
+
+
+# One row per deck with the columns deck, source, commander and cards (distinct card names)
+def collect_decks(hveen, edh_deckdata, card_index=None):
+    local = hveen[["deck_id", "commander", "cards"]].copy()
+    if card_index is not None:
+        local["cards"] = [card_index.canonical_names(cards) for cards in local["cards"]]
+    local["deck"] = local["commander"] + " #" + local["deck_id"].astype(str)
+    local["source"] = LOCAL
+
+    edhrec = edh_deckdata.groupby("commander", sort=False)["name"].agg(list).reset_index()
+    edhrec.columns = ["commander", "cards"]
+    edhrec["deck"] = edhrec["commander"] + " (EDHRec)"
+    edhrec["source"] = EDHREC
+
+    decks = pd.concat([local, edhrec], ignore_index=True)[["deck", "source", "commander", "cards"]]
+    decks["cards"] = [list(dict.fromkeys(cards)) for cards in decks["cards"]]
+
+    return decks
+
+
+# Binary deck x card matrix, with the card names of the columns
+def incidence_matrix(decks):
+    lengths = np.fromiter((len(cards) for cards in decks["cards"]), dtype=np.int64, count=len(decks))
+    names = [name for cards in decks["cards"] for name in cards]
+    codes, cards = pd.factorize(pd.Series(names, dtype=object))
+
+    indptr = np.concatenate([[0], np.cumsum(lengths)])
+    matrix = sparse.csr_matrix((np.ones(len(codes), dtype=np.int32), codes, indptr), shape=(len(decks), len(cards)))
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+
+    return matrix, np.asarray(cards, dtype=object)
+
+
+# MinHash signature per deck, with hash functions (a * card + b) mod PRIME
+def minhash_signatures(matrix, num_perm=NUM_PERM, seed=0):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, PRIME, size=num_perm, dtype=np.uint64)
+
+    # Every card is hashed once, decks only gather the hashes of their cards
+    card_hashes = ((np.arange(matrix.shape[1], dtype=np.uint64)[:, None] * a + b) % PRIME).astype(np.uint32)
+
+    signatures = np.full((matrix.shape[0], num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+    for start in range(0, matrix.shape[0], CHUNK_SIZE):
+        chunk = matrix[start:start + CHUNK_SIZE]
+        rows = np.flatnonzero(np.diff(chunk.indptr))
+        if len(rows) == 0:
+            continue
+
+        signatures[start + rows] = np.minimum.reduceat(card_hashes[chunk.indices], chunk.indptr[rows], axis=0)
+
+    return signatures
+
+
+# LSH buckets: per band, the band hash of every deck in sorted order, so the decks that share
+# a bucket with a query are found with a binary search
+class LshIndex:
+    def __init__(self, signatures, bands=BANDS, seed=0):
+        self.bands = bands
+        self.rows = signatures.shape[1] // bands
+        rng = np.random.default_rng(seed)
+        self.multipliers = rng.integers(1, np.iinfo(np.int64).max, size=self.rows, dtype=np.uint64) | np.uint64(1)
+
+        keys = self.band_keys(signatures)
+        self.order = np.argsort(keys, axis=0, kind="stable")
+        self.sorted_keys = np.take_along_axis(keys, self.order, axis=0)
+
+    # One uint64 per deck and band, wrapping multiplication is fine for hashing
+    def band_keys(self, signatures):
+        bands = signatures[:, :self.bands * self.rows].astype(np.uint64).reshape(len(signatures), self.bands, self.rows)
+        with np.errstate(over="ignore"):
+            return (bands * self.multipliers).sum(axis=2, dtype=np.uint64)
+
+    def candidates(self, signature):
+        keys = self.band_keys(signature[None, :])[0]
+        found = []
+        for band, key in enumerate(keys):
+            start = np.searchsorted(self.sorted_keys[:, band], key, side="left")
+            stop = np.searchsorted(self.sorted_keys[:, band], key, side="right")
+            found.append(self.order[start:stop, band])
+
+        return np.unique(np.concatenate(found))
+
+
+class SimilarityIndex:
+    def __init__(self, decks, num_perm=NUM_PERM, bands=BANDS, seed=0):
+        self.decks = decks.reset_index(drop=True)
+        self.matrix, self.cards = incidence_matrix(self.decks)
+        self.sizes = np.asarray(self.matrix.sum(axis=1)).ravel()
+        self.signatures = minhash_signatures(self.matrix, num_perm, seed)
+        self.lsh = LshIndex(self.signatures, bands, seed)
+        self.positions = {deck: row for row, deck in enumerate(self.decks["deck"])}
+
+    def __len__(self):
+        return len(self.decks)
+
+    def row(self, deck):
+        return deck if isinstance(deck, (int, np.integer)) else self.positions[deck]
+
+    # Exact Jaccard similarity of one deck with the given rows
+    def jaccard(self, row, rows):
+        intersection = np.asarray((self.matrix[rows] @ self.matrix[row].T).todense()).ravel()
+        union = self.sizes[rows] + self.sizes[row] - intersection
+        return np.divide(intersection, union, out=np.zeros(len(rows)), where=union > 0)
+
+    # The k decks most similar to a deck (a row or a deck label). Only the LSH candidates are
+    # compared, unless there are fewer of those than k.
+    def most_similar(self, deck, k=10, source=None):
+        row = self.row(deck)
+        rows = self.lsh.candidates(self.signatures[row])
+        if len(rows) <= k:
+            rows = np.arange(len(self.decks))
+        rows = rows[rows != row]
+        if source is not None:
+            rows = rows[self.decks["source"].to_numpy()[rows] == source]
+
+        similarity = self.jaccard(row, rows)
+        best = np.argsort(-similarity, kind="stable")[:k]
+
+        result = self.decks.loc[rows[best], ["deck", "source", "commander"]].reset_index(drop=True)
+        result["similarity"] = similarity[best]
+        return result
+
+    # Exact Jaccard matrix of a few decks, for the heatmap
+    def pairwise(self, decks):
+        rows = [self.row(deck) for deck in decks]
+        intersection = (self.matrix[rows] @ self.matrix[rows].T).toarray()
+        union = self.sizes[rows][:, None] + self.sizes[rows][None, :] - intersection
+        similarity = np.divide(intersection, union, out=np.zeros(intersection.shape), where=union > 0)
+
+        labels = self.decks["deck"].to_numpy()[rows]
+        return pd.DataFrame(similarity, index=labels, columns=labels)
+
+    # Similarity of every local deck with the EDHRec average deck of its commander
+    def local_vs_global(self):
+        source = self.decks["source"].to_numpy()
+        edhrec_rows = {commander: row for row, commander in zip(np.flatnonzero(source == EDHREC), self.decks["commander"][source == EDHREC])}
+
+        local_rows = np.flatnonzero(source == LOCAL)
+        local_rows = np.array([row for row in local_rows if self.decks.at[row, "commander"] in edhrec_rows], dtype=np.int64)
+        average_rows = np.array([edhrec_rows[self.decks.at[row, "commander"]] for row in local_rows], dtype=np.int64)
+
+        intersection = np.asarray(self.matrix[local_rows].multiply(self.matrix[average_rows]).sum(axis=1)).ravel()
+        union = self.sizes[local_rows] + self.sizes[average_rows] - intersection
+
+        result = self.decks.loc[local_rows, ["deck", "commander"]].reset_index(drop=True)
+        result["similarity"] = np.divide(intersection, union, out=np.zeros(len(local_rows)), where=union > 0)
+        return result
+
+    # Cards the local decks play that no EDHRec average deck of the same commanders has,
+    # by the number of local decks playing them
+    def unique_cards(self, commander=None, k=20):
+        source = self.decks["source"].to_numpy()
+        commanders = self.decks["commander"].to_numpy()
+        selected = np.ones(len(self.decks), dtype=bool) if commander is None else commanders == commander
+
+        local_rows = np.flatnonzero(selected & (source == LOCAL))
+        edhrec_rows = np.flatnonzero(np.isin(commanders, commanders[local_rows]) & (source == EDHREC))
+
+        local_counts = np.asarray(self.matrix[local_rows].sum(axis=0)).ravel()
+        edhrec_counts = np.asarray(self.matrix[edhrec_rows].sum(axis=0)).ravel()
+
+        unique = np.flatnonzero((local_counts > 0) & (edhrec_counts == 0))
+        best = unique[np.argsort(-local_counts[unique], kind="stable")][:k]
+
+        return pd.DataFrame({"name": self.cards[best], "decks": local_counts[best]})
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+# Monte Carlo simulation of opening hands.
+#
+# A deck is encoded as a small int array (land / mana rock / other card). Only the number of
+# lands and rocks drawn matters for these statistics, so instead of shuffling whole decks the
+# cards are dealt by their odds (one uniform draw per card) for a few hundred thousand games
+# at once, and every statistic is a NumPy reduction over those arrays. The games of a batch
+# of decks are dealt together, with the deck counts broadcast over (decks, hands) arrays.
+# The dealing costs about 25ns a card and game, so a batch of every deck of the community
+# plays fewer games per deck than one deck on its own.
+
+import hashlib
+
+import numpy as np
+
+from analytics import is_land, is_mana_rock
+
+HANDS = 100000
+# Games per deck in a batch: 1,000 decks in about two seconds, within half a percentage point
+BATCH_HANDS = 10000
+HAND_SIZE = 7
+
+# A hand is kept with this many lands (inclusive), otherwise we take a London mulligan
+KEEP_LANDS = (2, 5)
+MULLIGANS = 3
+
+OTHER, LAND, ROCK = 0, 1, 2
+
+# Games dealt at once in a batch: decks are simulated in chunks of BATCH_GAMES // hands decks,
+# which keeps the (decks, hands) arrays of a chunk at some tens of MB
+BATCH_GAMES = 2000000
+
+
+# Stable key for a deck, used to cache its simulation
+def deck_key(deck_data):
+    names = sorted(deck_data["name"].tolist())
+    return hashlib.sha1("\n".join(names).encode("utf-8")).hexdigest()
+
+
+# One code per card copy in the deck
+def encode_deck(deck_data):
+    codes = np.full(len(deck_data), OTHER, dtype=np.int8)
+    codes[is_mana_rock(deck_data)] = ROCK
+    codes[is_land(deck_data)] = LAND
+
+    return codes
+
+
+# Deal up to n more cards (an array with one entry per deck) one at a time from what is left
+# of the deck in every game. A card is a land, a mana rock or another card with the odds of
+# what is left, decided by one uniform draw. Returns the number of lands and mana rocks dealt.
+def draw(rng, lands_left, rocks_left, cards_left, n, shape):
+    # Lands, and lands and rocks, still in the deck, updated in place card by card
+    start_lands = np.broadcast_to(lands_left, shape).astype(np.float32)
+    start_mana = start_lands + np.broadcast_to(rocks_left, shape)
+    lands, mana = start_lands.copy(), start_mana.copy()
+
+    n = np.asarray(n)
+    for card in range(int(n.max(initial=0))):
+        pick = rng.random(shape, dtype=np.float32)
+        pick *= cards_left - card
+        land = pick < lands
+        mana_card = pick < mana
+        if not (n > card).all():
+            land &= n > card
+            mana_card &= n > card
+        lands -= land
+        mana -= mana_card
+
+    dealt_lands = (start_lands - lands).astype(np.int16)
+    return dealt_lands, (start_mana - mana).astype(np.int16) - dealt_lands
+
+
+# Distribution of the values of every row of a (decks, games) array
+def row_distribution(values, length):
+    rows = np.arange(values.shape[0])[:, None] * length
+    return np.bincount((rows + values).ravel(), minlength=values.shape[0] * length).reshape(-1, length) / values.shape[1]
+
+
+# Simulate opening hands for decks given as arrays of their size, lands, mana rocks and
+# commander mana value (-1 if unknown), one (decks, hands) array per statistic
+def simulate_batch(rng, deck_size, deck_lands, deck_rocks, turns, hands):
+    attempts = MULLIGANS + 1
+    deck_size, deck_lands, deck_rocks, turns = (np.asarray(values, dtype=np.int16)[:, None] for values in (deck_size, deck_lands, deck_rocks, turns))
+    shape = (len(deck_size), hands)
+
+    # Lands and rocks in the opening seven of every game of every deck
+    opening_lands, opening_rocks = draw(rng, deck_lands, deck_rocks, deck_size, HAND_SIZE, shape)
+
+    # Number of mulligans before a hand is kept, `attempts` when none of them is a keep.
+    # A mulligan is a fresh shuffle, so only the games that are still looking draw again,
+    # those of all decks at once.
+    kept = np.full(shape, attempts, dtype=np.int16)
+    pending = np.ones(shape, dtype=bool)
+    hand_lands = opening_lands
+    for attempt in range(attempts):
+        if attempt > 0:
+            rows = np.nonzero(pending)[0]
+            hand_lands = np.zeros(shape, dtype=np.int16)
+            hand_lands[pending], _ = draw(rng, deck_lands[rows, 0], deck_rocks[rows, 0], deck_size[rows, 0], HAND_SIZE, len(rows))
+
+        keep = pending & (hand_lands >= KEEP_LANDS[0]) & (hand_lands <= KEEP_LANDS[1])
+        kept[keep] = attempt
+        pending &= ~keep
+
+    # On the play we have seen 7 + (turns - 1) cards by the commander's turn; a mana rock
+    # has to be drawn a turn earlier to be on the battlefield by then
+    land_depth = np.minimum(HAND_SIZE + np.maximum(turns - 1, 0), deck_size)
+    rock_depth = np.where(turns >= 2, np.minimum(HAND_SIZE + turns - 2, deck_size), HAND_SIZE)
+
+    cards_left = deck_size - HAND_SIZE
+    early_lands, early_rocks = draw(rng, deck_lands - opening_lands, deck_rocks - opening_rocks, cards_left, rock_depth - HAND_SIZE, shape)
+    cards_left = cards_left - (rock_depth - HAND_SIZE)
+    late_lands, _ = draw(rng, deck_lands - opening_lands - early_lands, deck_rocks - opening_rocks - early_rocks, cards_left, land_depth - rock_depth, shape)
+
+    lands_seen = opening_lands + early_lands + late_lands
+    rocks_seen = np.where(turns >= 2, opening_rocks + early_rocks, 0)
+    on_curve = (np.minimum(lands_seen, turns) + rocks_seen >= turns).mean(axis=1)
+
+    return {
+        "lands": row_distribution(opening_lands, HAND_SIZE + 1),
+        "rocks": row_distribution(opening_rocks, HAND_SIZE + 1),
+        "on_curve": on_curve,
+        "keep": row_distribution(kept, attempts + 1),
+    }
+
+
+# Simulate opening hands for one deck. Returns the distribution of lands and mana rocks in
+# the opening seven, the chance to cast the commander on curve (on the play, without
+# mulligans) and how often the hand is kept after 0..MULLIGANS London mulligans.
+def simulate_deck(codes, commander_cmc=None, hands=HANDS, seed=0):
+    return simulate_decks({None: (codes, commander_cmc)}, hands, seed)[None]
+
+
+def commander_cmc(card_index, commander):
+    cmc = card_index.lookup([commander])["cmc"]
+    return float(cmc.iloc[0]) if len(cmc) else None
+
+
+# Encoded decks for a deck table with a deck_id column (see analytics.build_local_deckdata),
+# keyed by deck key
+def deck_batch(deckdata, card_index):
+    batch = {}
+    for deck_id, deck_data in deckdata.groupby("deck_id"):
+        batch[deck_key(deck_data)] = (encode_deck(deck_data), commander_cmc(card_index, deck_data["commander"].iloc[0]))
+    return batch
+
+
+# Simulate every deck in one call: decks maps a deck key to (codes, commander cmc). The games
+# of a chunk of decks are drawn together, a deck of less than a hand gets None.
+def simulate_decks(decks, hands=BATCH_HANDS, seed=0):
+    rng = np.random.default_rng(seed)
+    results = {key: None for key in decks}
+
+    encoded = {}
+    for key, (codes, cmc) in decks.items():
+        codes = np.asarray(codes, dtype=np.int8)
+        if len(codes) >= HAND_SIZE:
+            turns = int(cmc) if cmc is not None and not np.isnan(cmc) else None
+            encoded[key] = (len(codes), int((codes == LAND).sum()), int((codes == ROCK).sum()), turns)
+
+    keys = list(encoded)
+    chunk = max(1, BATCH_GAMES // hands)
+    for start in range(0, len(keys), chunk):
+        chunk_keys = keys[start:start + chunk]
+        deck_size, deck_lands, deck_rocks, turns = zip(*(encoded[key] for key in chunk_keys))
+        batch = simulate_batch(rng, deck_size, deck_lands, deck_rocks, [-1 if turn is None else turn for turn in turns], hands)
+
+        for row, key in enumerate(chunk_keys):
+            results[key] = {
+                "hands": hands,
+                "lands": batch["lands"][row].tolist(),
+                "rocks": batch["rocks"][row].tolist(),
+                "on_curve": float(batch["on_curve"][row]) if turns[row] is not None else None,
+                "commander_cmc": turns[row],
+                # Chance to keep with 7, 6, 5, ... cards, the last entry is "no keepable hand"
+                "keep": batch["keep"][row].tolist(),
+            }
+    return results
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+# Snapshot of the computed dashboard state, so a restarted app renders without recomputing.
+#
+# The state (card frame and index, EDHRec tables, meta tables, similarity index, simulations
+# and the memoised figures) is pickled with protocol 5 into one file. The numpy buffers of the
+# frames and arrays are written out of band, aligned, after the pickle. Loading memory-maps the
+# file and unpickles with buffers that point into the map, so the arrays are neither copied nor
+# read until they are used (they are read-only).
+#
+# The header holds the inputs the state was built from: the card store, deck store and
+# EDHRec store (or report) versions, plus this format and the pandas version. A snapshot is
+# only unpickled when the hash of its inputs matches the hash of the current ones, and the
+# file is named after that hash. Writing a new snapshot removes the old ones. The app keeps the
+# snapshots of every community in a directory of its own under the state directory.
+#
+# Usage:
+#   python snapshot.py info
+#   python snapshot.py clear
+
+import glob
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+from datetime import datetime, timezone
+
+import pandas as pd
+
+STATE_DIR = os.environ.get("MTG_STATE_DIR", "state")
+# Bump when the layout of the file or of the state changes
+STATE_FORMAT = 1
+
+MAGIC = b"MTGSTATE"
+PREFIX = struct.Struct("<8sQ")
+ALIGNMENT = 64
+
+
+def aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+# Hash of the inputs of a state, with what it takes to unpickle it
+def input_digest(inputs):
+    inputs = dict(inputs, format=STATE_FORMAT, pandas=pd.__version__, python=list(sys.version_info[:2]))
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def snapshot_path(digest, state_dir=STATE_DIR):
+    return os.path.join(state_dir, f"{digest[:16]}.state")
+
+
+def read_header(view):
+    magic, header_length = PREFIX.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ValueError("not a state snapshot")
+    header = json.loads(bytes(view[PREFIX.size:PREFIX.size + header_length]))
+    return header, aligned(PREFIX.size + header_length)
+
+
+# Write a state with the inputs it was built from. Returns the path of the snapshot.
+def write_snapshot(state, inputs, state_dir=STATE_DIR):
+    digest = input_digest(inputs)
+    buffers = []
+    payload = pickle.dumps(state, protocol=5, buffer_callback=buffers.append)
+    raw_buffers = [buffer.raw() for buffer in buffers]
+
+    # Offsets are relative to the end of the header, each part starts aligned
+    parts, offset = [], 0
+    for part in [payload] + raw_buffers:
+        parts.append([offset, part.nbytes if isinstance(part, memoryview) else len(part)])
+        offset = aligned(offset + parts[-1][1])
+
+    header = json.dumps({
+        "format": STATE_FORMAT,
+        "digest": digest,
+        "inputs": inputs,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "pickle": parts[0],
+        "buffers": parts[1:],
+    }, default=str).encode()
+
+    os.makedirs(state_dir, exist_ok=True)
+    path = snapshot_path(digest, state_dir)
+    with open(path + ".tmp", "wb") as file:
+        file.write(PREFIX.pack(MAGIC, len(header)))
+        file.write(header)
+        start = aligned(PREFIX.size + len(header))
+        for (part_offset, _), part in zip(parts, [payload] + raw_buffers):
+            file.seek(start + part_offset)
+            file.write(part)
+    os.replace(path + ".tmp", path)
+
+    # A snapshot that is still mapped can't be removed on Windows, the next write tries again
+    for old in glob.glob(os.path.join(state_dir, "*.state")):
+        if old != path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return path
+
+
+# The state built from these inputs, or None when there is no (valid) snapshot of them
+def read_snapshot(inputs, state_dir=STATE_DIR):
+    digest = input_digest(inputs)
+    path = snapshot_path(digest, state_dir)
+    if not os.path.exists(path) or os.path.getsize(path) < PREFIX.size:
+        return None
+
+    try:
+        with open(path, "rb") as file:
+            view = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        header, start = read_header(view)
+        if header["format"] != STATE_FORMAT or header["digest"] != digest:
+            return None
+        parts = [header["pickle"]] + header["buffers"]
+        if start + max(offset + length for offset, length in parts) > len(view):
+            return None
+
+        buffers = [view[start + offset:start + offset + length] for offset, length in header["buffers"]]
+        pickle_offset, pickle_length = header["pickle"]
+        return pickle.loads(view[start + pickle_offset:start + pickle_offset + pickle_length], buffers=buffers)
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        # A damaged snapshot or one of older code is built again
+        return None
+
+
+# The snapshots in the state directory and the community directories in it
+def snapshot_paths(state_dir=STATE_DIR):
+    return sorted(glob.glob(os.path.join(state_dir, "**", "*.state"), recursive=True))
+
+
+def snapshot_info(state_dir=STATE_DIR):
+    snapshots = []
+    for path in snapshot_paths(state_dir):
+        with open(path, "rb") as file:
+            view = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        header, _ = read_header(view)
+        snapshots.append({"path": path, "bytes": len(view), "created_at": header["created_at"], "inputs": header["inputs"], "buffers": len(header["buffers"])})
+    return snapshots
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "info"
+
+    if command == "info":
+        snapshots = snapshot_info()
+        for snapshot in snapshots:
+            print(json.dumps(snapshot, indent=1))
+        if not snapshots:
+            print(f"No state snapshot in {STATE_DIR}")
+    elif command == "clear":
+        paths = snapshot_paths()
+        for path in paths:
+            os.remove(path)
+        print(f"Removed {len(paths)} snapshots")
+    else:
+        print("Usage: python snapshot.py [info | clear]")
+        sys.exit(1)
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+# The modules live in the repository root, like when the app is run from there
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# The card store built from the Scryfall bulk file (python card_store.py refresh), tests that
+# need card data are skipped without one
+@pytest.fixture(scope="session")
+def card_store():
+    from card_store import STORE_DIR, CardStore, read_manifest
+
+    if read_manifest(STORE_DIR) is None:
+        pytest.skip(f"no card store in {STORE_DIR}")
+    return CardStore(STORE_DIR)
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+from aggregates import MetaAggregates, counts_current
+from analytics import build_local_analytics, load_decks
+from deck_store import DeckStore
+
+COMMANDER = "Atraxa, Praetors' Voice"
+
+
+def test_writes_without_listener_make_counters_stale(card_store, tmp_path):
+    deck_store = DeckStore(str(tmp_path / "decks.sqlite"))
+    deck_store.add_deck("Ann", COMMANDER, ["1 Sol Ring", "30 Forest"])
+    aggregates = MetaAggregates(deck_store, card_store.index, card_store.version)
+
+    # Written with the aggregates listening: still current
+    deck_store.add_deck("Bob", COMMANDER, ["1 Arcane Signet", "30 Island"])
+    assert counts_current(deck_store, card_store.version)
+    assert aggregates.check_consistency().empty
+
+    # Written by another deck store object (like python deck_store.py import): stale until used
+    DeckStore(deck_store.path).add_deck("Cas", COMMANDER, ["30 Swamp"])
+    deck_store.add_deck("Dan", COMMANDER, ["30 Plains"])
+    assert not counts_current(deck_store, card_store.version)
+
+    frames = aggregates.frames()
+    assert counts_current(deck_store, card_store.version)
+    assert aggregates.check_consistency().empty
+    assert set(frames["card_frequency"]["name"]) >= {"Swamp", "Plains"}
+
+
+# The card frequency of the stored counters and of the report (the decks themselves) agree
+def test_card_frequency_of_counters_and_decks_agree(card_store, tmp_path):
+    deck_store = DeckStore(str(tmp_path / "decks.sqlite"))
+    deck_store.add_deck("Ann", COMMANDER, ["1 Sol Ring", "30 Forest", "1 Arcane Signet"])
+    deck_store.add_deck("Bob", COMMANDER, ["1 Sol Ring", "30 Island"])
+
+    from_counters = MetaAggregates(deck_store, card_store.index, card_store.version).frames()["card_frequency"]
+    from_decks = build_local_analytics(load_decks(deck_store), card_store.index)["card_frequency"]
+
+    assert list(from_decks.columns) == list(from_counters.columns) == ["name", "count"]
+    assert dict(zip(from_decks["name"], from_decks["count"])) == dict(zip(from_counters["name"], from_counters["count"]))
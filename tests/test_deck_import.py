@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+
+from deck_import import DeckValidator, parse_csv, parse_text, read_decks, validate_decks
+from deck_store import DeckStore
+
+
+def test_mtgo_sideboard_is_the_commander():
+    deck = parse_text(["1 Sol Ring", "4 Island", "", "1 Anje Falkenrath"])
+    assert deck["commander"] == "Anje Falkenrath"
+    assert deck["card_counts"] == [("Sol Ring", 1), ("Island", 4)]
+
+
+def test_mtgo_partners_keep_the_second_commander_as_a_partner():
+    deck = parse_text(["1 Sol Ring", "", "1 Tymna the Weaver", "1 Thrasios, Triton Hero"])
+    assert deck["commander"] == "Tymna the Weaver"
+    assert deck["partners"] == ["Thrasios, Triton Hero"]
+    assert deck["card_counts"] == [("Sol Ring", 1)]
+
+
+def test_explicit_commander_is_not_counted_again_from_the_sideboard():
+    deck = parse_text(["1 Sol Ring", "", "1 Anje Falkenrath"], commander="anje falkenrath")
+    assert deck["commander"] == "anje falkenrath"
+    assert deck["partners"] == []
+    assert deck["card_counts"] == [("Sol Ring", 1)]
+
+    deck = parse_text(["1 Sol Ring", "", "1 Tymna the Weaver", "1 Thrasios, Triton Hero"], commander="Thrasios, Triton Hero")
+    assert deck["commander"] == "Thrasios, Triton Hero"
+    assert deck["partners"] == ["Tymna the Weaver"]
+    assert deck["card_counts"] == [("Sol Ring", 1)]
+
+
+def test_arena_sections_and_set_suffixes():
+    lines = ["Commander", "1 Anje Falkenrath (C19) 37", "", "Deck", "1 Sol Ring (C21) 263", "1 Fire // Ice (MH2) 290 *F*", "4x Island", "", "Sideboard", "1 Duress"]
+    deck = parse_text(lines)
+    assert deck["commander"] == "Anje Falkenrath"
+    assert deck["card_counts"] == [("Sol Ring", 1), ("Fire // Ice", 1), ("Island", 4)]
+
+
+def test_blocks_before_the_last_one_belong_to_the_deck():
+    deck = parse_text(["1 Sol Ring", "", "1 Arcane Signet", "1 Mind Stone", "", "1 Anje Falkenrath"])
+    assert deck["commander"] == "Anje Falkenrath"
+    assert deck["card_counts"] == [("Sol Ring", 1), ("Arcane Signet", 1), ("Mind Stone", 1)]
+
+
+def test_last_block_of_more_than_two_cards_is_kept_in_the_deck():
+    deck = parse_text(["1 Sol Ring", "", "1 Arcane Signet", "1 Mind Stone", "1 Fellwar Stone"], commander="Anje Falkenrath")
+    assert deck["commander"] == "Anje Falkenrath"
+    assert [name for name, _ in deck["card_counts"]] == ["Sol Ring", "Arcane Signet", "Mind Stone", "Fellwar Stone"]
+
+
+def test_moxfield_csv_boards():
+    file = io.StringIO('"Count","Name","Board"\n"1","Anje Falkenrath","commander"\n"1","Sol Ring","mainboard"\n"4","Island","mainboard"\n"1","Duress","maybeboard"\n')
+    deck = parse_csv(file)
+    assert deck["commander"] == "Anje Falkenrath"
+    assert deck["card_counts"] == [("Sol Ring", 1), ("Island", 4)]
+
+
+def test_files_that_cant_be_read_are_rejected_on_their_own(tmp_path, card_store):
+    (tmp_path / "good.txt").write_text("1 Sol Ring\n\n1 Anje Falkenrath\n", encoding="utf-8")
+    (tmp_path / "latin1.txt").write_bytes("1 Sol Ring\n\n1 Séance\n".encode("latin-1"))
+    (tmp_path / "no_name.csv").write_text("Count,Card\n1,Sol Ring\n", encoding="utf-8")
+    (tmp_path / "bad_count.csv").write_text("Count,Name\nabc,Sol Ring\n", encoding="utf-8")
+
+    valid, rejected = validate_decks(read_decks([str(tmp_path)], player="Test"), DeckValidator(card_store))
+
+    assert [deck["commander"] for deck in valid] == ["Anje Falkenrath"]
+    assert sorted(os.path.basename(source) for source in rejected) == ["bad_count.csv", "latin1.txt", "no_name.csv"]
+    assert rejected[str(tmp_path / "no_name.csv")] == ["No Name column"]
+    assert rejected[str(tmp_path / "bad_count.csv")] == ["Count 'abc' of Sol Ring is not a number"]
+    assert rejected[str(tmp_path / "latin1.txt")][0].startswith("Not a UTF-8 file")
+
+
+def test_partners_are_stored_as_commanders(tmp_path, card_store):
+    deck = parse_text(["1 Sol Ring", "", "1 Anje Falkenrath", "1 Arcum Dagsson"], player="Ann")
+    valid, rejected = validate_decks([deck], DeckValidator(card_store))
+    assert rejected == {}
+    assert valid == [{"player": "Ann", "commander": "Anje Falkenrath", "partner": "Arcum Dagsson", "card_counts": [("Sol Ring", 1)]}]
+
+    deck_store = DeckStore(str(tmp_path / "decks.sqlite"))
+    deck_store.add_decks(valid)
+    assert [deck["cards"] for deck in deck_store.iter_decks()] == [["Sol Ring"]]
+    with deck_store.connect() as conn:
+        assert conn.execute("SELECT commander, partner FROM decks").fetchall() == [("Anje Falkenrath", "Arcum Dagsson")]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+
+import pytest
+
+from deck_store import DeckStore
+
+COMMANDER = "Atraxa, Praetors' Voice"
+
+
+def test_legacy_players_and_named_players_are_apart(tmp_path):
+    store = DeckStore(str(tmp_path / "decks.sqlite"))
+    named = store.add_deck("Ann", COMMANDER, ["1 Sol Ring"])
+    legacy = store.add_deck(1, COMMANDER, ["1 Arcane Signet"])
+    player_three = store.add_deck("Player 3", COMMANDER, ["1 Mind Stone"])
+    legacy_three = store.add_deck(3, COMMANDER, ["1 Fellwar Stone"])
+    legacy_three_again = store.add_deck(3, COMMANDER, ["1 Thought Vessel"])
+
+    assert store.player_count() == 4
+    assert [deck["deck_id"] for deck in store.decks_by_player("Ann")] == [named]
+    assert [deck["deck_id"] for deck in store.decks_by_player(1)] == [legacy]
+    assert [deck["deck_id"] for deck in store.decks_by_player("Player 3")] == [player_three]
+    assert [deck["deck_id"] for deck in store.decks_by_player(3)] == [legacy_three, legacy_three_again]
+
+
+def test_old_players_table_is_migrated(tmp_path):
+    path = str(tmp_path / "decks.sqlite")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE players (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+        CREATE TABLE decks (id INTEGER PRIMARY KEY, player_id INTEGER NOT NULL REFERENCES players(id), commander TEXT NOT NULL, created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP);
+        INSERT INTO players (id, name) VALUES (2, 'Player 2'), (3, 'Bob');
+        INSERT INTO decks (player_id, commander) VALUES (2, 'Atraxa, Praetors'' Voice'), (3, 'Atraxa, Praetors'' Voice');
+    """)
+    conn.commit()
+    conn.close()
+
+    store = DeckStore(path)
+    assert [deck["deck_id"] for deck in store.decks_by_player(2)] == [1]
+    assert [deck["deck_id"] for deck in store.decks_by_player("Bob")] == [2]
+    store.add_deck("Player 2", COMMANDER, ["1 Sol Ring"])
+    assert store.player_count() == 3
+
+
+def test_removing_a_missing_deck_raises_key_error(tmp_path):
+    store = DeckStore(str(tmp_path / "decks.sqlite"))
+    deck_id = store.add_deck("Ann", COMMANDER, ["1 Sol Ring"])
+    version = store.version()
+
+    with pytest.raises(KeyError):
+        store.remove_deck(deck_id + 1)
+    assert store.version() == version
+
+    store.remove_deck(deck_id)
+    assert len(store) == 0
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+from deck_store import split_count
+from edh_cache import EdhCache
+from edh_stub_server import COMMANDER_PATH, DECK_SIZE, load_fixtures, start_server
+
+from conftest import ROOT
+
+
+def fixture_commanders(fixtures):
+    return [
+        json.loads(body)["container"]["json_dict"]["card"]["name"]
+        for path, (status, body) in fixtures.items() if path.startswith(COMMANDER_PATH) and status == 200
+    ]
+
+
+def test_fetch_commanders_against_stub(tmp_path):
+    fixtures = load_fixtures(os.path.join(ROOT, "edh_cache"))
+    commanders = fixture_commanders(fixtures)
+    server, base_url = start_server(fixtures)
+    try:
+        results, failures = EdhCache(str(tmp_path / "edh_store.sqlite"), offline=False, base_url=base_url, rate=1000, legacy_cache=None).fetch_commanders(commanders)
+    finally:
+        server.shutdown()
+
+    assert commanders
+    assert failures == {}
+    assert set(results) == set(commanders)
+    for result in results.values():
+        assert sum(count for _, count in map(split_count, result["average_deck"]["decklist"])) == DECK_SIZE
+
+
+# A new store starts with the legacy cache: offline, its commanders are served without an
+# average deck (the legacy cache has none)
+def test_new_store_imports_the_legacy_cache(tmp_path):
+    commanders = fixture_commanders(load_fixtures(os.path.join(ROOT, "edh_cache")))
+    cache = EdhCache(str(tmp_path / "edh_store.sqlite"), offline=True, legacy_cache=os.path.join(ROOT, "edh_cache"))
+
+    results, failures = cache.fetch_commanders(commanders)
+
+    assert failures == {}
+    assert all(results[commander]["page"] and results[commander]["average_deck"]["decklist"] == [] for commander in commanders)
+    assert cache.cache_stats()["entries"] == {"commander.stale": len(commanders)}
+
+
+def test_edh_cache_tells_not_found_from_failed_requests(tmp_path):
+    fixtures = load_fixtures(os.path.join(ROOT, "edh_cache"))
+    commander = fixture_commanders(fixtures)[0]
+    cache = EdhCache(str(tmp_path / "edh_store.sqlite"), offline=False, rate=1000, retries=0, backoff=0, legacy_cache=None)
+    server, cache.base_url = start_server(fixtures)
+    try:
+        _, failures = cache.fetch_commanders([commander, "Not A Commander"])
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert list(failures) == ["Not A Commander"]
+    assert cache.not_found("Not A Commander")
+
+    # The server is gone: the request fails without an answer from EDHRec
+    _, failures = cache.fetch_commanders(["Another Commander"])
+    assert list(failures) == ["Another Commander"]
+    assert not cache.not_found("Another Commander")
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from analytics import CARD_COLUMNS, build_edh_tables, clean_card_names, create_manacurve, parse_cardlist
+from card_index import CardIndex
+from card_store import add_derived_columns, compact_columns
+
+TYPES = ["Creature — Elf", "Instant", "Sorcery", "Artifact", "Enchantment", "Land", "Basic Land — Forest"]
+
+
+def synthetic_cards(count, rng):
+    return compact_columns(add_derived_columns(pd.DataFrame({
+        "name": [f"Card {i}" for i in range(count)],
+        "released_at": "2020-01-01",
+        "mana_cost": "{1}",
+        "cmc": rng.integers(0, 9, count).astype(float),
+        "type_line": rng.choice(TYPES, count),
+        "color_identity": [["G"]] * count,
+        "set_name": "Synthetic",
+        "rarity": rng.choice(["common", "uncommon", "rare", "mythic"], count),
+        "artist": "Nobody",
+    })))
+
+
+# EDHRec commander pages and average decks ("1 Card 3" lines) of synthetic commanders
+def synthetic_edhrec(commanders, cards, rng, deck_size=100, page_size=50):
+    names = cards["name"].to_numpy()
+    pages, average_decks = {}, {}
+    for i in range(commanders):
+        commander = f"Commander {i}"
+        pages[commander] = {"cardlist": [{"name": name} for name in rng.choice(names, page_size, replace=False)]}
+        average_decks[commander] = {"commander": commander, "decklist": [f"1 {name}" for name in rng.choice(names, deck_size, replace=False)]}
+    return pages, average_decks
+
+
+# The row-by-row implementation with full-scan lookups that EdhTableBuilder and CardIndex replaced
+def legacy_tables(commander_list, scryfall, get_edh, get_average_deck):
+    edh_df = pd.DataFrame(data=None, index=None, columns=["commander", "cards", "manacurve", "average_deck_noland"])
+    edh_deckdata = pd.DataFrame(data=None, index=None, columns=["commander"] + CARD_COLUMNS)
+    average_df = pd.DataFrame(data=None, index=None, columns=["commander"] + CARD_COLUMNS)
+
+    for commander in commander_list:
+        cardnames = pd.DataFrame(get_edh(commander)["cardlist"])["name"].tolist()
+
+        average_deck = parse_cardlist(clean_card_names(get_average_deck(commander)["decklist"]))
+        average_deck_data = scryfall[scryfall["name"].isin(average_deck)][CARD_COLUMNS]
+        average_deck_data["commander"] = commander
+        average_deck_noland = average_deck_data[~average_deck_data["type_line"].str.contains("Land", na=False, case=False)]
+
+        manacurve = create_manacurve(average_deck_noland)
+
+        edh_df.loc[len(edh_df)] = [commander, cardnames, manacurve, average_deck_noland]
+
+        for index, row in average_deck_noland.iterrows():
+            average_df = pd.concat([average_df, average_deck_noland], ignore_index=True)
+
+        average_df = average_df.drop_duplicates(subset=["commander", "name"])
+
+        edh_deckdata = pd.concat([edh_deckdata, average_deck_data])
+
+    return edh_df, edh_deckdata, average_df
+
+
+def assert_same_tables(legacy, built):
+    legacy_edh, legacy_deckdata, legacy_average = legacy
+    edh_df, edh_deckdata, average_df = built
+
+    assert legacy_edh["commander"].tolist() == edh_df["commander"].tolist()
+    assert legacy_edh["cards"].tolist() == edh_df["cards"].tolist()
+    assert legacy_edh["manacurve"].tolist() == edh_df["manacurve"].tolist()
+    for legacy_noland, noland in zip(legacy_edh["average_deck_noland"], edh_df["average_deck_noland"]):
+        pd.testing.assert_frame_equal(legacy_noland, noland)
+
+    # The legacy tables start from empty object columns, so only compare values
+    pd.testing.assert_frame_equal(legacy_deckdata, edh_deckdata, check_dtype=False)
+    pd.testing.assert_frame_equal(legacy_average.reset_index(drop=True), average_df.reset_index(drop=True), check_dtype=False)
+
+
+def test_builder_matches_the_row_by_row_tables():
+    rng = np.random.default_rng(0)
+    scryfall = synthetic_cards(3000, rng)
+    pages, average_decks = synthetic_edhrec(20, scryfall, rng)
+    commanders = list(pages)
+
+    with warnings.catch_warnings():
+        # The legacy code concatenates onto empty frames, which pandas warns about
+        warnings.simplefilter("ignore")
+        legacy = legacy_tables(commanders, scryfall, pages.get, average_decks.get)
+    built = build_edh_tables(commanders, CardIndex(scryfall), pages.get, average_decks.get)
+
+    assert_same_tables(legacy, built)
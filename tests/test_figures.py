@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+import pandas as pd
+
+from figures import convert_to_unicode, identity_chart
+
+
+# The colour identity table of the meta, written and read back like a report does (report.py)
+def test_identity_chart_from_a_report_round_trip(tmp_path):
+    table = pd.DataFrame({"color_mask": [0, 26, 3], "count": [436, 292, 93], "color_identity": [[], ["U", "R", "G"], ["W", "U"]]})
+    table.to_parquet(tmp_path / "color_identity_hveen.parquet", index=False)
+    read_back = pd.read_parquet(tmp_path / "color_identity_hveen.parquet")
+
+    chart = identity_chart(read_back)
+
+    assert list(chart.data[0].labels) == [convert_to_unicode(identity) for identity in table["color_identity"]]
+    assert list(chart.data[0].values) == [436, 292, 93]
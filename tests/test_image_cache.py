@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from image_cache import ImageCache
+
+CARD_SIZE = (488, 680)
+
+
+# Serves a directory like python -m http.server, with the status of every request
+class RecordingHandler(SimpleHTTPRequestHandler):
+    statuses = []
+
+    def log_request(self, code="-", size="-"):
+        self.statuses.append(int(code))
+
+
+@pytest.fixture
+def image_server(tmp_path):
+    directory = tmp_path / "images"
+    directory.mkdir()
+    for number, color in enumerate(["red", "green", "blue"]):
+        Image.new("RGB", CARD_SIZE, color).save(directory / f"card{number}.png")
+
+    RecordingHandler.statuses = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(RecordingHandler, directory=str(directory)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield [f"http://127.0.0.1:{server.server_port}/card{number}.png" for number in range(3)]
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_resize_revalidate_and_evict(image_server, tmp_path):
+    cache = ImageCache(str(tmp_path / "cache"), rate=1000)
+
+    # Fetch and resize to the display width
+    assert cache.prefetch(image_server) == 0
+    paths = cache.images(image_server)
+    assert all(os.path.exists(path) for path in paths)
+    with Image.open(paths[0]) as image:
+        assert image.size == (cache.width, round(CARD_SIZE[1] * cache.width / CARD_SIZE[0]))
+    assert RecordingHandler.statuses == [200, 200, 200]
+
+    # Expired images are revalidated with their Last-Modified date, the server answers 304
+    with cache.connect() as conn:
+        conn.execute("UPDATE urls SET expires_at = 0")
+    assert cache.prefetch(image_server, revalidate=True) == 0
+    assert RecordingHandler.statuses[3:] == [304, 304, 304]
+    assert cache.images(image_server) == paths
+
+    # The least recently used image is evicted first
+    time.sleep(0.01)
+    cache.images(image_server[1:])
+    cache.max_bytes = cache.stats()["bytes"] - 1
+    assert cache.evict() == 1
+    assert not os.path.exists(paths[0])
+    assert all(os.path.exists(path) for path in paths[1:])
+    assert cache.stats()["urls"] == 2
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import NULL_RECORDER, count, current, finish_run, span, start_run, with_recorder
+
+
+def test_a_run_after_a_finished_one_records_on_its_own():
+    run = start_run(enabled=True, profiler="")
+    with span("run"):
+        pass
+    finish_run(run, metrics_file="")
+    assert run.finished
+
+    # A fragment rerun: the run of the whole script is finished, the fragment starts its own
+    fragment = start_run(enabled=True, profiler="")
+    with span("fragment"):
+        pass
+    snapshot = finish_run(fragment, metrics_file="")
+    assert current() is fragment
+    assert [entry["name"] for entry in snapshot["spans"]] == ["fragment"]
+    assert [entry["name"] for entry in run.snapshot()["spans"]] == ["run"]
+
+
+def test_finishing_the_null_recorder_leaves_it_unfinished():
+    assert finish_run(start_run(enabled=False), metrics_file="") is None
+    assert not NULL_RECORDER.finished
+
+
+# Two sessions run their scripts in threads of their own at the same time
+def test_runs_in_other_threads_keep_their_own_recorder():
+    started, counted = threading.Barrier(2), threading.Barrier(2)
+    counters = {}
+
+    def session(name):
+        run = start_run(enabled=True, profiler="")
+        started.wait()
+        count(f"{name}.calls")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            executor.submit(with_recorder(count), f"{name}.fetches").result()
+            list(executor.map(with_recorder(count), [f"{name}.images"] * 3))
+            # A task without the recorder of the run records nothing
+            executor.submit(count, f"{name}.lost").result()
+        counted.wait()
+        counters[name] = finish_run(run, metrics_file="")["counters"]
+
+    threads = [threading.Thread(target=session, args=(name,)) for name in ("ann", "bob")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for name in ("ann", "bob"):
+        assert counters[name] == {f"{name}.calls": 1, f"{name}.fetches": 1, f"{name}.images": 3}
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+from math import comb
+
+import numpy as np
+import pytest
+
+from simulate import BATCH_HANDS, HAND_SIZE, KEEP_LANDS, LAND, MULLIGANS, OTHER, ROCK, simulate_deck, simulate_decks
+
+HANDS = 200000
+
+
+def deck(lands, rocks, size=99):
+    return np.array([LAND] * lands + [ROCK] * rocks + [OTHER] * (size - lands - rocks), dtype=np.int8)
+
+
+def hypergeometric(good, size, drawn, hits):
+    return comb(good, hits) * comb(size - good, drawn - hits) / comb(size, drawn)
+
+
+def test_batch_matches_exact_probabilities():
+    decks = {"lean": (deck(31, 10), 5.0), "heavy": (deck(40, 2), 3.0)}
+    results = simulate_decks(decks, hands=HANDS)
+
+    for key, (codes, _) in decks.items():
+        lands = int((codes == LAND).sum())
+        rocks = int((codes == ROCK).sum())
+        expected_lands = [hypergeometric(lands, len(codes), HAND_SIZE, hits) for hits in range(HAND_SIZE + 1)]
+        expected_rocks = [hypergeometric(rocks, len(codes), HAND_SIZE, hits) for hits in range(HAND_SIZE + 1)]
+        assert results[key]["lands"] == pytest.approx(expected_lands, abs=0.005)
+        assert results[key]["rocks"] == pytest.approx(expected_rocks, abs=0.005)
+
+        # Every mulligan is a fresh seven, so the keep rates are geometric
+        keepable = sum(expected_lands[KEEP_LANDS[0]:KEEP_LANDS[1] + 1])
+        expected_keep = [keepable * (1 - keepable) ** attempt for attempt in range(MULLIGANS + 1)] + [(1 - keepable) ** (MULLIGANS + 1)]
+        assert results[key]["keep"] == pytest.approx(expected_keep, abs=0.005)
+
+
+def test_on_curve_for_a_two_drop():
+    # On turn 2 on the play we have seen 8 cards: lands among all 8 count, mana rocks only
+    # from the opening seven
+    lands, rocks, size = 36, 8, 99
+    expected = 0.0
+    for hand_lands in range(HAND_SIZE + 1):
+        for hand_rocks in range(HAND_SIZE + 1 - hand_lands):
+            opening = comb(lands, hand_lands) * comb(rocks, hand_rocks) * comb(size - lands - rocks, HAND_SIZE - hand_lands - hand_rocks) / comb(size, HAND_SIZE)
+            land_drawn = (lands - hand_lands) / (size - HAND_SIZE)
+            for seen_lands, chance in ((hand_lands + 1, land_drawn), (hand_lands, 1 - land_drawn)):
+                if min(seen_lands, 2) + hand_rocks >= 2:
+                    expected += opening * chance
+
+    assert simulate_deck(deck(lands, rocks, size), 2.0, hands=HANDS)["on_curve"] == pytest.approx(expected, abs=0.005)
+
+
+def test_short_decks_and_unknown_commanders():
+    results = simulate_decks({"short": (deck(3, 0, size=6), 2.0), "unknown": (deck(36, 8), None), "nan": (deck(36, 8), float("nan"))}, hands=1000)
+    assert results["short"] is None
+    assert results["unknown"]["on_curve"] is None and results["unknown"]["commander_cmc"] is None
+    assert results["nan"]["on_curve"] is None
+
+
+def test_single_deck_is_a_batch_of_one():
+    assert simulate_deck(deck(36, 8), 4.0, hands=1000) == simulate_decks({"deck": (deck(36, 8), 4.0)}, hands=1000)["deck"]
+
+
+# A batch of 1,000 decks at the default number of games, the mean lands and mana rocks in
+# the opening seven are hypergeometric means
+def test_batch_of_many_decks_has_hypergeometric_means():
+    rng = np.random.default_rng(1)
+    counts = [(int(rng.integers(30, 42)), int(rng.integers(0, 12))) for _ in range(1000)]
+    results = simulate_decks({index: (deck(lands, rocks), 3.0) for index, (lands, rocks) in enumerate(counts)})
+
+    hits = np.arange(HAND_SIZE + 1)
+    for index, (lands, rocks) in enumerate(counts):
+        assert results[index]["hands"] == BATCH_HANDS
+        assert hits @ results[index]["lands"] == pytest.approx(HAND_SIZE * lands / 99, abs=0.05)
+        assert hits @ results[index]["rocks"] == pytest.approx(HAND_SIZE * rocks / 99, abs=0.05)